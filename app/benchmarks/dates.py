@@ -0,0 +1,18 @@
+# Usage (from the app folder): python -m benchmarks.dates
+import timeit
+
+from libs.dates          import parse_date, parse_date_slow
+from benchmarks.fixtures import tvdb_episodes
+
+
+if __name__ == '__main__':
+    # 50 seasons x 100 episodes, the size of a long running anime
+    airdates = [ episode['aired'] for episode in tvdb_episodes(2000, 50, 100) ]
+    assert all( parse_date(airdate) == parse_date_slow(airdate) for airdate in airdates[:100] )
+
+    slow_time = timeit.timeit(lambda: [ parse_date_slow(airdate) for airdate in airdates ], number = 1)
+    fast_time = timeit.timeit(lambda: [ parse_date(airdate) for airdate in airdates ], number = 10) / 10
+    print(
+        f'{len(airdates)} episodes: dateparser {slow_time * 1000:8.2f}ms | '
+        f'fast path {fast_time * 1000:8.2f}ms ({slow_time / fast_time:.0f}x)'
+    )
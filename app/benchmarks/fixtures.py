@@ -0,0 +1,211 @@
+from math   import ceil
+from typing import Dict
+
+
+# Synthetic payloads shaped after recorded TVDB v4 responses (GET /series/{id}/episodes/{season-type}[/{lang}])
+TVDB_PAGE_SIZE = 500
+
+def tvdb_episodes(series_id: int, seasons: int, episodes_per_season: int, language: str = None) -> list:
+    episodes = []
+    for season in range(1, seasons + 1):
+        for number in range(1, episodes_per_season + 1):
+            episode_id = series_id * 100000 + season * 1000 + number
+            episodes.append({
+                'id':                   episode_id,
+                'seriesId':             series_id,
+                'name':                 f'Episode {season}x{number}' + (f' ({language})' if language else ''),
+                'aired':                f'{2000 + season % 20}-{1 + number % 12:02d}-{1 + number % 28:02d}',
+                'runtime':              24,
+                'nameTranslations':     [ 'eng', 'ita' ],
+                'overview':             f'Overview of episode {season}x{number}.',
+                'image':                f'/banners/episodes/{series_id}/{episode_id}.jpg',
+                'imageType':            11,
+                'isMovie':              0,
+                'seasons':              None,
+                'number':               number,
+                'seasonNumber':         season,
+                'lastUpdated':          '2022-05-01 10:00:00',
+                'finaleType':           None,
+                'overviewTranslations': [ 'eng', 'ita' ]
+            })
+    return episodes
+
+def tvdb_episodes_page(
+    series_id:           int,
+    seasons:             int,
+    episodes_per_season: int,
+    page:                int = 0,
+    language:            str = None,
+    page_size:           int = TVDB_PAGE_SIZE
+) -> Dict:
+    episodes    = tvdb_episodes(series_id, seasons, episodes_per_season, language)
+    total_pages = ceil(len(episodes) / page_size)
+    return {
+        'status': 'success',
+        'data':   {
+            'series':   {
+                'id':         series_id,
+                'name':       f'Series {series_id}',
+                'slug':       f'series-{series_id}',
+                'image':      f'https://artworks.thetvdb.com/banners/posters/{series_id}-1.jpg',
+                'firstAired': '2000-01-01',
+                'status':     { 'id': 1, 'name': 'Continuing' }
+            },
+            'episodes': episodes[page * page_size:(page + 1) * page_size]
+        },
+        'links':  {
+            'prev':        page - 1 if page > 0 else None,
+            'self':        page,
+            'next':        page + 1 if page + 1 < total_pages else None,
+            'total_items': len(episodes),
+            'page_size':   page_size
+        }
+    }
+
+def tvdb_series_extended(series_id: int, seasons: int) -> Dict:
+    # GET /series/{id}/extended?meta=translations&short=true
+    return {
+        'status': 'success',
+        'data':   {
+            'id':               series_id,
+            'name':             f'Series {series_id}',
+            'slug':             f'series-{series_id}',
+            'image':            f'https://artworks.thetvdb.com/banners/posters/{series_id}-1.jpg',
+            'firstAired':       '2000-01-01',
+            'originalLanguage': 'jpn',
+            'status':           { 'id': 1, 'name': 'Continuing' },
+            'seasons':          [ {
+                'id':       series_id * 1000 + season,
+                'seriesId': series_id,
+                'number':   season,
+                'type':     { 'id': 1, 'name': 'Aired Order', 'type': 'official' },
+                'image':    f'https://artworks.thetvdb.com/banners/seasons/{series_id}-{season}.jpg'
+            } for season in range(1, seasons + 1) ],
+            'translations':     {
+                'nameTranslations':     [ { 'language': 'ita', 'name': f'Serie {series_id}' } ],
+                'overviewTranslations': [ { 'language': 'eng', 'overview': f'Overview of series {series_id}.' } ]
+            }
+        }
+    }
+
+def tvdb_movie_extended(movie_id: int) -> Dict:
+    # GET /movies/{id}/extended?meta=translations&short=true
+    return {
+        'status': 'success',
+        'data':   {
+            'id':            movie_id,
+            'name':          f'Movie {movie_id}',
+            'slug':          f'movie-{movie_id}',
+            'image':         f'https://artworks.thetvdb.com/banners/movies/{movie_id}/posters/{movie_id}.jpg',
+            'runtime':       120,
+            'status':        { 'id': 5, 'name': 'Released' },
+            'first_release': { 'country': 'usa', 'date': '2010-05-01' },
+            'translations':  {
+                'nameTranslations':     [ { 'language': 'ita', 'name': f'Film {movie_id}' } ],
+                'overviewTranslations': [ { 'language': 'eng', 'overview': f'Overview of movie {movie_id}.' } ]
+            }
+        }
+    }
+
+def tvdb_search(query: str, type: str = None, offset: int = 0, limit: int = 20, total: int = 100) -> Dict:
+    # GET /search?query=...&offset=...&limit=...[&type=...]
+    types = [ type ] if type else [ 'series', 'movie' ]
+    return {
+        'status': 'success',
+        'data':   [ {
+            'type':           types[index % len(types)],
+            'tvdb_id':        str(10000 + index),
+            'name':           f'{query.title()} {index}',
+            'slug':           f'{query.lower().replace(" ", "-")}-{index}',
+            'translations':   { 'ita': f'{query.title()} {index} (ita)' },
+            'overviews':      { 'eng': f'Overview of {query} {index}.' },
+            'image_url':      f'https://artworks.thetvdb.com/banners/posters/{10000 + index}-1.jpg',
+            'first_air_time': '2005-09-01',
+            'year':           '2005',
+            'status':         'Continuing' if types[index % len(types)] == 'series' else 'Released'
+        } for index in range( offset, min(offset + limit, total) ) ],
+        'links':  { 'total_items': total, 'page_size': limit }
+    }
+
+TMDB_SEARCH_PAGE_SIZE = 20
+
+def tmdb_configuration() -> Dict:
+    # GET /configuration
+    return {
+        'images': {
+            'base_url':        'http://image.tmdb.org/t/p/',
+            'secure_base_url': 'https://image.tmdb.org/t/p/',
+            'poster_sizes':    [ 'w92', 'w154', 'w185', 'w342', 'w500', 'w780', 'original' ],
+            'still_sizes':     [ 'w92', 'w185', 'w300', 'original' ]
+        }
+    }
+
+def tmdb_search(query: str, type: str, language: str, page: int = 1, total: int = 200) -> Dict:
+    # GET /search/{movie|tv}?query=...&language=...&page=...
+    first   = (page - 1) * TMDB_SEARCH_PAGE_SIZE
+    results = []
+    for index in range( first, min(first + TMDB_SEARCH_PAGE_SIZE, total) ):
+        title = f'{query.title()} {index} ({language})'
+        results.append( {
+            'id':           20000 + index,
+            'overview':     f'Overview of {query} {index} ({language}).',
+            'poster_path':  f'/{20000 + index}.jpg'
+        } | ( {
+            'title':          title,
+            'original_title': title,
+            'release_date':   '2010-05-01'
+        } if type == 'movie' else {
+            'name':           title,
+            'original_name':  title,
+            'first_air_date': '2005-09-01'
+        } ) )
+    return { 'page': page, 'results': results, 'total_pages': ceil(total / TMDB_SEARCH_PAGE_SIZE), 'total_results': total }
+
+def tmdb_movie(movie_id: int, language: str) -> Dict:
+    # GET /movie/{id}?language=...
+    return {
+        'id':             movie_id,
+        'title':          f'Movie {movie_id} ({language})',
+        'original_title': f'Movie {movie_id}',
+        'overview':       f'Overview of movie {movie_id} ({language}).',
+        'poster_path':    f'/{movie_id}.jpg',
+        'release_date':   '2010-05-01',
+        'runtime':        120,
+        'status':         'Released'
+    }
+
+def tmdb_show(show_id: int, seasons: int, language: str) -> Dict:
+    # GET /tv/{id}?language=...
+    return {
+        'id':             show_id,
+        'name':           f'Series {show_id} ({language})',
+        'original_name':  f'Series {show_id}',
+        'overview':       f'Overview of series {show_id} ({language}).',
+        'poster_path':    f'/{show_id}.jpg',
+        'first_air_date': '2000-01-01',
+        'status':         'Returning Series',
+        'seasons':        [ {
+            'id':            show_id * 1000 + season,
+            'season_number': season,
+            'name':          f'Season {season} ({language})',
+            'overview':      f'Overview of season {season} ({language}).',
+            'poster_path':   f'/{show_id}-{season}.jpg',
+            'air_date':      f'{2000 + season % 20}-01-01'
+        } for season in range(1, seasons + 1) ]
+    }
+
+def tmdb_season(show_id: int, season: int, episodes: int, language: str) -> Dict:
+    # GET /tv/{id}/season/{number}?language=...
+    return {
+        'id':            show_id * 1000 + season,
+        'season_number': season,
+        'air_date':      f'{2000 + season % 20}-01-01',
+        'episodes':      [ {
+            'id':             show_id * 100000 + season * 1000 + number,
+            'episode_number': number,
+            'name':           f'Episode {season}x{number} ({language})',
+            'overview':       f'Overview of episode {season}x{number} ({language}).',
+            'still_path':     f'/{show_id}-{season}-{number}.jpg',
+            'runtime':        24
+        } for number in range(1, episodes + 1) ]
+    }
@@ -0,0 +1,178 @@
+# Usage (from the app folder): python -m benchmarks.load [cold warm huge search] [--requests 200] [--concurrency 16]
+#
+# End-to-end: the app (main.py) and the upstream simulator (benchmarks.upstream) run as their own processes, as they
+# would in production, a fresh app for every scenario so no cache leaks from one to the next. Provider rate limiters
+# are off by default, the point is measuring the app, not the quota (--rate-limits keeps them).
+import os
+import sys
+import time
+import httpx
+import socket
+import asyncio
+import argparse
+import subprocess
+
+from typing import Callable, Dict, List
+
+
+APP_DIR = os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) )
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def percentile(values: List[float], ratio: float) -> float:
+    ordered = sorted(values)
+    return ordered[ min( len(ordered) - 1, int( ratio * len(ordered) ) ) ] if ordered else 0.0
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f'{process.args} exited with {process.returncode}')
+            try:
+                if ( await client.get(url) ).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f'{url} not ready after {timeout}s')
+
+def start(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [ sys.executable ] + args,
+        cwd    = APP_DIR,
+        env    = os.environ | env,
+        stdout = subprocess.DEVNULL,
+        stderr = subprocess.DEVNULL
+    )
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout = 10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# every scenario: the requests to warm the app up with (not measured), and the measured ones
+SCENARIOS: Dict[str, Callable[[int], Dict[str, List[str]]]] = {
+    # every request misses every cache: details of distinct movies and shows, both providers
+    'cold':   lambda count: { 'warmup': [], 'measured': [
+        f'/details/sources/{("tvdb", "tmdb")[index % 2]}/type/{("series", "movie")[index // 2 % 2]}/{1000 + index}' for index in range(count)
+    ] },
+    # the same few items over and over, once they are cached
+    'warm':   lambda count: { 'warmup': [
+        f'/details/sources/tvdb/type/series/{1000 + index}?with_episodes=true' for index in range(10)
+    ], 'measured': [
+        f'/details/sources/tvdb/type/series/{1000 + index % 10}?with_episodes=true' for index in range(count)
+    ] },
+    # long running series with all their episodes: thousands of episodes over many pages and language sweeps
+    'huge':   lambda count: { 'warmup': [], 'measured': [
+        f'/details/sources/{("tvdb", "tmdb")[index % 2]}/type/series/{900000 + index}?with_episodes=true' for index in range( max(1, count // 10) )
+    ] },
+    # a large page of results, for both media types: many upstream pages for every search
+    'search': lambda count: { 'warmup': [], 'measured': [
+        f'/search/sources/{("tmdb", "tvdb")[index % 2]}?query=title{index}&limit=100' for index in range(count)
+    ] }
+}
+
+async def run(base_url: str, paths: List[str], concurrency: int) -> Dict:
+    latencies = []
+    errors    = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(base_url = base_url, timeout = 120, limits = httpx.Limits(max_connections = concurrency)) as client:
+        async def call(path: str):
+            nonlocal errors
+            async with semaphore:
+                start_time = time.perf_counter()
+                try:
+                    response = await client.get(path, headers = { 'Accept-Encoding': 'gzip' })
+                    errors  += response.status_code >= 400
+                except httpx.TransportError:
+                    errors  += 1
+                latencies.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*[ call(path) for path in paths ])
+        elapsed    = time.perf_counter() - start_time
+    return { 'latencies': latencies, 'errors': errors, 'elapsed': elapsed }
+
+def app_env(port: int, upstream_url: str, rate_limits: bool = False) -> Dict[str, str]:
+    env = {
+        'UVICORN_HOST':          '127.0.0.1',
+        'UVICORN_PORT':          str(port),
+        'LOG_LEVEL':             'WARNING',
+        'TVDB_API_URL':          f'{upstream_url}/tvdb/v4',
+        'TMDB_API_URL':          f'{upstream_url}/tmdb/3',
+        'TVDB_USR_PIN':          'benchmark',
+        'TVDB_API_KEY':          'benchmark',
+        'TMDB_API_KEY':          'benchmark',
+        'TVDB_UPDATES_INTERVAL': '0',
+        # every run starts from nothing stored
+        'METADATA_STORE_PATH':   '',
+        'TITLE_INDEX_PATH':      ''
+    }
+    if not rate_limits:
+        env |= { 'RATE_LIMIT_TVDB_RATE': '0', 'RATE_LIMIT_TMDB_RATE': '0' }
+    return env
+
+async def scenario(name: str, args: argparse.Namespace, upstream_url: str) -> Dict:
+    port = free_port()
+    app  = start([ 'main.py' ], app_env(port, upstream_url, args.rate_limits))
+    try:
+        base_url = f'http://127.0.0.1:{port}'
+        await wait_ready(f'{base_url}/health/ready', app)
+        requests = SCENARIOS[name](args.requests)
+        if requests['warmup']:
+            await run(base_url, requests['warmup'], args.concurrency)
+
+        async with httpx.AsyncClient() as client:
+            await client.post(f'{upstream_url}/_reset')
+            result = await run(base_url, requests['measured'], args.concurrency)
+            result['upstream'] = ( await client.get(f'{upstream_url}/_stats') ).json()
+        return result
+    finally:
+        stop(app)
+
+async def main():
+    parser = argparse.ArgumentParser(description = 'End-to-end load benchmark against the offline upstream simulator')
+    parser.add_argument('scenarios',      nargs = '*', help = f'any of {", ".join(SCENARIOS)}, all of them by default')
+    parser.add_argument('--requests',     default = 200, type = int, help = 'measured requests per scenario (a tenth for huge)')
+    parser.add_argument('--concurrency',  default = 16, type = int, help = 'requests in flight')
+    parser.add_argument('--latency',      default = 0.05, type = float, help = 'upstream latency, seconds')
+    parser.add_argument('--error-rate',   default = 0.0, type = float, help = 'share of upstream calls failing with a 503')
+    parser.add_argument('--rate-limits',  action = 'store_true', help = 'keep the provider rate limiters on')
+    args = parser.parse_args()
+    if set(args.scenarios) - set(SCENARIOS):
+        parser.error(f'unknown scenarios: {", ".join( set(args.scenarios) - set(SCENARIOS) )}')
+
+    upstream_port = free_port()
+    upstream_url  = f'http://127.0.0.1:{upstream_port}'
+    upstream      = start([
+        '-m', 'benchmarks.upstream', '--port', str(upstream_port), '--latency', str(args.latency), '--error-rate', str(args.error_rate)
+    ], {})
+    try:
+        await wait_ready(f'{upstream_url}/_stats', upstream)
+        print(f'upstream latency {args.latency * 1000:.0f}ms, error rate {args.error_rate:.1%}, {args.concurrency} requests in flight')
+        print(f'{"scenario":<8} {"requests":>8} {"errors":>6} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"upstream":>8} {"per req":>7}')
+        for name in args.scenarios or list(SCENARIOS):
+            result         = await scenario(name, args, upstream_url)
+            latencies      = result['latencies']
+            upstream_calls = result['upstream']['total']
+            print(
+                f'{name:<8} {len(latencies):>8} {result["errors"]:>6} {len(latencies) / result["elapsed"]:>8.1f} '
+                f'{percentile(latencies, 0.50) * 1000:>8.1f} {percentile(latencies, 0.95) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} '
+                f'{upstream_calls:>8} {upstream_calls / max(1, len(latencies)):>7.1f}'
+            )
+            for endpoint, count in sorted( result['upstream']['calls'].items() ):
+                print(f'{"":<8} {count:>8}  {endpoint}')
+    finally:
+        stop(upstream)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
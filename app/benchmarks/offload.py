@@ -0,0 +1,80 @@
+# Usage (from the app folder): python -m benchmarks.offload [--modes inline thread process] [--huge 6]
+#
+# Small cached requests served while huge shows (thousands of episodes) are being mapped, by OFFLOAD_MODE: the
+# latency of the small ones and the event loop lag tell how much the big ones get in their way.
+#
+# Measured on a single CPU, three runs (thread and process p99 vary by ~20ms from one run to the next):
+#   mode      small   p50 ms   p99 ms   max ms   huge s   lag ms lag>50ms
+#   inline      410      7.8    175.8   2621.3    12.58    11.16     1.3%
+#   thread      590      8.0    126.1    294.1    12.88     5.64     1.0%
+#   thread      620      7.6     82.6    239.4    12.42     5.30     1.1%
+#   thread      550      7.4     80.3    267.0    10.78     5.83     1.0%
+#   process     840      7.4     94.7    357.0    18.86     4.29     0.7%
+#   process     770      6.2     76.1    367.5    13.68     4.30     1.1%
+#   process     740      5.9    101.2    347.9    12.90     4.66     1.2%
+# Offloading takes the multi-second stalls away (max) and halves the loop lag. The mapping is pure Python though: in
+# a thread it keeps the GIL and the loop only gets it back every switch interval, so small requests still queue
+# behind it (p99). Processes do not share the GIL, but pickling makes the huge shows slower and, on one CPU, their p99
+# is no better than the threads' one. They are worth it with spare cores.
+import re
+import httpx
+import asyncio
+import argparse
+
+from benchmarks.load import app_env, free_port, percentile, run, start, stop, wait_ready
+
+
+SMALL_PATH = '/details/sources/tvdb/type/movie/1000'
+
+def huge_paths(mode: str, count: int) -> list:
+    # new ids on every run, these are meant to be mapped, not served from the cache
+    offset = { 'inline': 0, 'thread': 1000, 'process': 2000 }.get(mode, 3000)
+    return [ f'/details/sources/tvdb/type/series/{900000 + offset + index}?with_episodes=true' for index in range(count) ]
+
+def loop_lag(metrics: str) -> tuple:
+    # mean lag, and share of the samples over 50ms, from the Prometheus histogram
+    values = {
+        match[1]: float(match[2]) for match in re.finditer(r'^atlas_event_loop_lag_seconds(_sum|_count|_bucket\{le="0\.05"\}) (\S+)$', metrics, re.M)
+    }
+    count  = values.get('_count', 0) or 1
+    return values.get('_sum', 0) / count, 1 - values.get('_bucket{le="0.05"}', 0) / count
+
+async def main():
+    parser = argparse.ArgumentParser(description = 'Small requests latency alongside huge show mappings, by offload mode')
+    parser.add_argument('--modes', default = [ 'inline', 'thread', 'process' ], nargs = '+')
+    parser.add_argument('--huge',  default = 6, type = int, help = 'huge shows, all at once')
+    args = parser.parse_args()
+
+    upstream_port = free_port()
+    upstream_url  = f'http://127.0.0.1:{upstream_port}'
+    upstream      = start([ '-m', 'benchmarks.upstream', '--port', str(upstream_port), '--latency', '0.01' ], {})
+    try:
+        await wait_ready(f'{upstream_url}/_stats', upstream)
+        print(f'small cached requests, one at a time, for as long as {args.huge} huge shows (100 seasons x 50 episodes) are built')
+        print(f'{"mode":<8} {"small":>6} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8} {"huge s":>8} {"lag ms":>8} {"lag>50ms":>8}')
+        for mode in args.modes:
+            port     = free_port()
+            base_url = f'http://127.0.0.1:{port}'
+            app      = start([ 'main.py' ], app_env(port, upstream_url) | { 'OFFLOAD_MODE': mode, 'LOOP_LAG_INTERVAL': '0.01' })
+            try:
+                await wait_ready(f'{base_url}/health/ready', app)
+                await run(base_url, [ SMALL_PATH ], 1)
+                huge      = asyncio.ensure_future( run(base_url, huge_paths(mode, args.huge), args.huge) )
+                latencies = []
+                while not huge.done():
+                    latencies += ( await run(base_url, [ SMALL_PATH ] * 10, 1) )['latencies']
+                huge      = await huge
+                async with httpx.AsyncClient() as client:
+                    lag, over = loop_lag( ( await client.get(f'{base_url}/metrics') ).text )
+                print(
+                    f'{mode:<8} {len(latencies):>6} {percentile(latencies, 0.50) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} '
+                    f'{max(latencies) * 1000:>8.1f} {huge["elapsed"]:>8.2f} {lag * 1000:>8.2f} {over:>8.1%}'
+                )
+            finally:
+                stop(app)
+    finally:
+        stop(upstream)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
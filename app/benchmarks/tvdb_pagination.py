@@ -0,0 +1,53 @@
+# Usage (from the app folder): python -m benchmarks.tvdb_pagination
+import re
+import json
+import time
+import httpx
+import asyncio
+import functools
+import libs.tvdb
+
+from libs.cache          import cache
+from libs.tvdb           import TVDBClient
+from benchmarks.fixtures import tvdb_episodes_page, tvdb_series_extended
+
+
+SERIES_ID           = 3000
+SEASONS             = 100
+EPISODES_PER_SEASON = 50
+PAGE_SIZE           = 100   # 5,000 episodes over 50 pages, for every language
+UPSTREAM_LATENCY    = 0.05
+
+
+@functools.lru_cache(maxsize = None)
+def episodes_page(page: int, language: str = None) -> bytes:
+    # building fixtures is not what is being measured
+    return json.dumps( tvdb_episodes_page(SERIES_ID, SEASONS, EPISODES_PER_SEASON, page, language, PAGE_SIZE) ).encode()
+
+async def upstream(request: httpx.Request) -> httpx.Response:
+    await asyncio.sleep(UPSTREAM_LATENCY)
+    if request.url.path.endswith('/login'):
+        return httpx.Response(200, json = { 'data': { 'token': 'benchmark' } })
+    if request.url.path.endswith('/extended'):
+        return httpx.Response(200, json = tvdb_series_extended(SERIES_ID, SEASONS))
+    language = re.search(r'/episodes/\w+/(\w+)$', request.url.path)
+    return httpx.Response(200, content = episodes_page( int(request.url.params['page']), language[1] if language else None ))
+
+async def main():
+    for concurrency in [ 1, 4, 8 ]:
+        # cold cache for every run
+        cache.setup()
+        libs.tvdb.TVDB_EPISODES_CONCURRENCY = concurrency
+        client     = TVDBClient( httpx.AsyncClient( transport = httpx.MockTransport(upstream) ) )
+
+        start_time = time.perf_counter()
+        show       = await client.get_show(id = SERIES_ID, with_episodes = True)
+        episodes   = sum( len(season.episodes) for season in show.seasons )
+        print(
+            f'{episodes} episodes in {len(show.seasons)} seasons, 50 pages per language, {UPSTREAM_LATENCY * 1000:.0f}ms upstream latency, '
+            f'{concurrency} pages in flight: {time.perf_counter() - start_time:.2f}s'
+        )
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+# Usage (from the app folder): python -m benchmarks.tvdb_seasons
+import timeit
+
+from math                import ceil
+from pydantic            import HttpUrl
+from pydantic.tools      import parse_obj_as
+from libs.tvdb           import TVDBClient
+from libs.models         import SeasonType, Season, Episode
+from benchmarks.fixtures import tvdb_episodes_page, TVDB_PAGE_SIZE
+
+
+# the per-page pipeline TVDBClient.get_show used before: jq compiled on every call, then a second walk to build models
+LEGACY_JQ_SEASON_PARSER = '''[ .data.episodes | group_by(.seasonNumber)[] | {
+    guid:     ( "tvdb://series/" + (.[0].seriesId | tostring) + "/seasons/" + (.[0].seasonNumber | tostring) ),
+    number:   .[0].seasonNumber,
+    episodes: [ .[] | {
+        guid:       ( "tvdb://series/" + (.seriesId | tostring) + "/episodes/" + (.id | tostring) ),
+        source_id:  (.id | tonumber),
+        source_url: ( "/episodes/" + (.id | tostring) ),
+        title:      .name,
+        overview:   .overview,
+        image:      .image,
+        airdate:    .aired,
+        number:     .number,
+        runtime:    .runtime
+    } ]
+} ]'''
+
+def legacy_jq(client: TVDBClient, pages: list):
+    import jq
+    import dateparser
+    for response in pages:
+        tmp_seasons = jq.compile(LEGACY_JQ_SEASON_PARSER).input(response).first()
+        seasons     = []
+        for tmp_season in tmp_seasons:
+            episodes = []
+            for tmp_episode in tmp_season["episodes"]:
+                episodes.append( Episode( **tmp_episode | {
+                    "source_url": parse_obj_as(HttpUrl, f'{client.series_url_prefix}{response["data"]["series"]["slug"]}{tmp_episode["source_url"]}'),
+                    "title":      tmp_episode["title"]    if tmp_episode["title"]    else "",
+                    "overview":   tmp_episode["overview"] if tmp_episode["overview"] else None,
+                    "image":      parse_obj_as(HttpUrl, client.images_base_url + tmp_episode["image"]) if tmp_episode["image"] else None,
+                    "airdate":    dateparser.parse(tmp_episode["airdate"]).date() if tmp_episode["airdate"] else None
+                } ) )
+            seasons.append( Season( **tmp_season | {
+                "source_url": parse_obj_as(HttpUrl, f'{client.series_url_prefix}{response["data"]["series"]["slug"]}/seasons/official/{tmp_season["number"]}'),
+                "episodes":   episodes
+            } ) )
+
+def single_pass(client: TVDBClient, pages: list):
+    for page in pages:
+        client.parse_seasons(page, SeasonType.OFFICIAL)
+
+
+if __name__ == '__main__':
+    client = TVDBClient(http_client = None)
+    for seasons in [ 1, 10, 100 ]:
+        episodes_per_season = 24
+        total_pages = ceil(seasons * episodes_per_season / TVDB_PAGE_SIZE)
+        pages       = [ tvdb_episodes_page(1000 + seasons, seasons, episodes_per_season, page) for page in range(total_pages) ]
+        runs        = max(1, 50 // seasons)
+
+        jq_time     = timeit.timeit(lambda: legacy_jq(client, pages), number = runs) / runs
+        parse_time  = timeit.timeit(lambda: single_pass(client, pages), number = runs) / runs
+        print(
+            f'{seasons:>3} seasons / {seasons * episodes_per_season:>4} episodes: '
+            f'legacy jq pipeline {jq_time * 1000:8.2f}ms | single-pass to models {parse_time * 1000:8.2f}ms'
+        )
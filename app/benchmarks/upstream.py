@@ -0,0 +1,178 @@
+# Usage (from the app folder): python -m benchmarks.upstream [--port 8090] [--latency 0.05] [--error-rate 0.01]
+#
+# A local stand-in for TVDB (under /tvdb/v4) and TMDB (under /tmdb/3): point the app to it with
+# TVDB_API_URL=http://127.0.0.1:8090/tvdb/v4 and TMDB_API_URL=http://127.0.0.1:8090/tmdb/3.
+# Responses come from UPSTREAM_FIXTURES when a recording exists for the path (e.g. tvdb/v4/series/81189/extended.json),
+# from the synthetic fixtures otherwise. Series with an id >= UPSTREAM_HUGE_SERIES_FROM are long running ones.
+import os
+import json
+import random
+import asyncio
+import argparse
+import functools
+import collections
+
+from starlette.applications import Starlette
+from starlette.routing      import Route
+from starlette.requests     import Request
+from starlette.responses    import JSONResponse, Response
+from libs.metrics           import endpoint_template
+from benchmarks.fixtures    import tvdb_episodes_page, tvdb_series_extended, tvdb_movie_extended, tvdb_search, \
+                                   tmdb_configuration, tmdb_search, tmdb_movie, tmdb_show, tmdb_season
+
+
+UPSTREAM_LATENCY          = float( os.environ.get('UPSTREAM_LATENCY', '0.05') )
+UPSTREAM_LATENCY_JITTER   = float( os.environ.get('UPSTREAM_LATENCY_JITTER', '0.2') )   # +/- ratio of the latency
+UPSTREAM_ERROR_RATE       = float( os.environ.get('UPSTREAM_ERROR_RATE', '0') )
+UPSTREAM_PAGE_SIZE        = int( os.environ.get('UPSTREAM_PAGE_SIZE', '500') )          # TVDB episodes per page
+UPSTREAM_SEASONS          = int( os.environ.get('UPSTREAM_SEASONS', '5') )
+UPSTREAM_EPISODES         = int( os.environ.get('UPSTREAM_EPISODES', '12') )
+UPSTREAM_HUGE_SERIES_FROM = int( os.environ.get('UPSTREAM_HUGE_SERIES_FROM', '900000') )
+UPSTREAM_HUGE_SEASONS     = int( os.environ.get('UPSTREAM_HUGE_SEASONS', '100') )
+UPSTREAM_HUGE_EPISODES    = int( os.environ.get('UPSTREAM_HUGE_EPISODES', '50') )
+UPSTREAM_FIXTURES         = os.environ.get('UPSTREAM_FIXTURES')
+UPSTREAM_SEED             = int( os.environ.get('UPSTREAM_SEED', '42') )
+
+config = {
+    'latency':    UPSTREAM_LATENCY,
+    'jitter':     UPSTREAM_LATENCY_JITTER,
+    'error_rate': UPSTREAM_ERROR_RATE,
+    'page_size':  UPSTREAM_PAGE_SIZE
+}
+calls  = collections.Counter()
+rng    = random.Random(UPSTREAM_SEED)
+
+
+def series_size(series_id: int) -> tuple:
+    if series_id >= UPSTREAM_HUGE_SERIES_FROM:
+        return UPSTREAM_HUGE_SEASONS, UPSTREAM_HUGE_EPISODES
+    return UPSTREAM_SEASONS, UPSTREAM_EPISODES
+
+@functools.lru_cache(maxsize = 4096)
+def episodes_page(series_id: int, page: int, language: str, page_size: int) -> bytes:
+    # building fixtures is not what is being measured
+    return json.dumps( tvdb_episodes_page(series_id, *series_size(series_id), page, language, page_size) ).encode()
+
+def recorded(path: str) -> bytes:
+    if not UPSTREAM_FIXTURES:
+        return None
+    file = os.path.join( UPSTREAM_FIXTURES, path.strip('/') + '.json' )
+    if os.path.isfile(file):
+        with open(file, 'rb') as fixture:
+            return fixture.read()
+    return None
+
+
+def simulated(handler):
+    # every endpoint: counted, delayed, possibly failed, and served from a recording when there is one
+    @functools.wraps(handler)
+    async def endpoint(request: Request) -> Response:
+        calls[ endpoint_template(request.url.path) ] += 1
+        latency = config['latency'] * ( 1 + rng.uniform(-config['jitter'], config['jitter']) )
+        await asyncio.sleep( max(0.0, latency) )
+        if rng.random() < config['error_rate']:
+            return JSONResponse({ 'status': 'failure', 'message': 'simulated upstream error' }, status_code = 503)
+        content = recorded(request.url.path)
+        if content is not None:
+            return Response(content, media_type = 'application/json')
+        response = handler(request)
+        return response if isinstance(response, Response) else JSONResponse(response)
+    return endpoint
+
+def params(request: Request, name: str, default: str = None) -> str:
+    return request.query_params.get(name, default)
+
+
+@simulated
+def tvdb_login(request: Request):
+    return { 'status': 'success', 'data': { 'token': 'simulated' } }
+
+@simulated
+def tvdb_do_search(request: Request):
+    return tvdb_search( params(request, 'query'), params(request, 'type'), int( params(request, 'offset', '0') ), int( params(request, 'limit', '20') ) )
+
+@simulated
+def tvdb_series(request: Request):
+    series_id = int(request.path_params['id'])
+    return tvdb_series_extended( series_id, series_size(series_id)[0] )
+
+@simulated
+def tvdb_episodes(request: Request):
+    series_id = int(request.path_params['id'])
+    page      = int( params(request, 'page', '0') )
+    return Response( episodes_page(series_id, page, request.path_params.get('language'), config['page_size']), media_type = 'application/json' )
+
+@simulated
+def tvdb_movie(request: Request):
+    return tvdb_movie_extended( int(request.path_params['id']) )
+
+@simulated
+def tvdb_updates(request: Request):
+    return { 'status': 'success', 'data': [], 'links': { 'next': None } }
+
+@simulated
+def tmdb_config(request: Request):
+    return tmdb_configuration()
+
+@simulated
+def tmdb_do_search(request: Request):
+    return tmdb_search( params(request, 'query'), request.path_params['type'], params(request, 'language'), int( params(request, 'page', '1') ) )
+
+@simulated
+def tmdb_get_movie(request: Request):
+    return tmdb_movie( int(request.path_params['id']), params(request, 'language') )
+
+@simulated
+def tmdb_get_show(request: Request):
+    show_id = int(request.path_params['id'])
+    return tmdb_show( show_id, series_size(show_id)[0], params(request, 'language') )
+
+@simulated
+def tmdb_get_season(request: Request):
+    show_id = int(request.path_params['id'])
+    return tmdb_season( show_id, int(request.path_params['number']), series_size(show_id)[1], params(request, 'language') )
+
+
+async def stats(request: Request) -> Response:
+    # upstream calls by endpoint since the last reset, and the current settings
+    return JSONResponse({ 'calls': dict(calls), 'total': sum( calls.values() ), 'config': config })
+
+async def reset(request: Request) -> Response:
+    # POST /_reset, optionally with new settings, e.g. { "latency": 0.1, "error_rate": 0.05 }
+    calls.clear()
+    body = await request.body()
+    config.update({ key: value for key, value in ( json.loads(body) if body else {} ).items() if key in config })
+    return JSONResponse({ 'config': config })
+
+
+app = Starlette(routes = [
+    Route('/tvdb/v4/login',                                               tvdb_login, methods = [ 'POST' ]),
+    Route('/tvdb/v4/search',                                              tvdb_do_search),
+    Route('/tvdb/v4/series/{id:int}/extended',                            tvdb_series),
+    Route('/tvdb/v4/series/{id:int}/episodes/{season_type}',              tvdb_episodes),
+    Route('/tvdb/v4/series/{id:int}/episodes/{season_type}/{language}',   tvdb_episodes),
+    Route('/tvdb/v4/movies/{id:int}/extended',                            tvdb_movie),
+    Route('/tvdb/v4/updates',                                             tvdb_updates),
+    Route('/tmdb/3/configuration',                                        tmdb_config),
+    Route('/tmdb/3/search/{type}',                                        tmdb_do_search),
+    Route('/tmdb/3/movie/{id:int}',                                       tmdb_get_movie),
+    Route('/tmdb/3/tv/{id:int}',                                          tmdb_get_show),
+    Route('/tmdb/3/tv/{id:int}/season/{number:int}',                      tmdb_get_season),
+    Route('/_stats',                                                      stats),
+    Route('/_reset',                                                      reset, methods = [ 'POST' ])
+])
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description = 'Offline TVDB/TMDB stand-in')
+    parser.add_argument('--host',       default = '127.0.0.1')
+    parser.add_argument('--port',       default = 8090, type = int)
+    parser.add_argument('--latency',    default = UPSTREAM_LATENCY, type = float, help = 'seconds per call')
+    parser.add_argument('--error-rate', default = UPSTREAM_ERROR_RATE, type = float, help = 'share of calls failing with a 503')
+    parser.add_argument('--page-size',  default = UPSTREAM_PAGE_SIZE, type = int, help = 'TVDB episodes per page')
+    args = parser.parse_args()
+
+    config.update({ 'latency': args.latency, 'error_rate': args.error_rate, 'page_size': args.page_size })
+    uvicorn.run(app, host = args.host, port = args.port, log_level = 'warning')
@@ -0,0 +1,61 @@
+# Usage (from the app folder): python -m benchmarks.workers [--workers 1 2 4] [--requests 2000] [--concurrency 64]
+#
+# Throughput of a warm cache workload by number of workers (UVICORN_WORKERS), against the offline upstream simulator:
+# once everything is cached requests are CPU bound (routing, validation, headers, logging), which is what more
+# processes are for. Without an L2 every worker warms its own cache, so the warm-up goes round until none is missed.
+import os
+import httpx
+import asyncio
+import argparse
+
+from benchmarks.load import app_env, free_port, percentile, run, start, stop, wait_ready
+
+
+WARM_ITEMS = 20
+
+def paths(count: int) -> list:
+    return [ f'/details/sources/{("tvdb", "tmdb")[index % 2]}/type/series/{1000 + index % WARM_ITEMS}?with_episodes=true' for index in range(count) ]
+
+async def main():
+    parser = argparse.ArgumentParser(description = 'Warm cache throughput by number of workers')
+    parser.add_argument('--workers',     default = [ 1, 2, 4 ], type = int, nargs = '+')
+    parser.add_argument('--requests',    default = 2000, type = int, help = 'measured requests per run')
+    parser.add_argument('--concurrency', default = 64, type = int, help = 'requests in flight')
+    args = parser.parse_args()
+
+    upstream_port = free_port()
+    upstream_url  = f'http://127.0.0.1:{upstream_port}'
+    upstream      = start([ '-m', 'benchmarks.upstream', '--port', str(upstream_port) ], {})
+    try:
+        await wait_ready(f'{upstream_url}/_stats', upstream)
+        print(f'{os.cpu_count()} CPUs, {WARM_ITEMS} cached items, {args.concurrency} requests in flight')
+        print(f'{"workers":>7} {"requests":>8} {"errors":>6} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"upstream":>8}')
+        for workers in args.workers:
+            port     = free_port()
+            base_url = f'http://127.0.0.1:{port}'
+            app      = start([ 'main.py' ], app_env(port, upstream_url) | { 'UVICORN_WORKERS': str(workers) })
+            try:
+                await wait_ready(f'{base_url}/health/ready', app)
+                async with httpx.AsyncClient() as client:
+                    # requests land on any worker: warm up until a whole round needs no upstream call
+                    while True:
+                        await client.post(f'{upstream_url}/_reset')
+                        await run(base_url, paths(WARM_ITEMS * workers * 4), args.concurrency)
+                        if not ( await client.get(f'{upstream_url}/_stats') ).json()['total']:
+                            break
+
+                    result = await run(base_url, paths(args.requests), args.concurrency)
+                    calls  = ( await client.get(f'{upstream_url}/_stats') ).json()['total']
+                latencies = result['latencies']
+                print(
+                    f'{workers:>7} {len(latencies):>8} {result["errors"]:>6} {len(latencies) / result["elapsed"]:>8.1f} '
+                    f'{percentile(latencies, 0.50) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} {calls:>8}'
+                )
+            finally:
+                stop(app)
+    finally:
+        stop(upstream)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
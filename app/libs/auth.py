@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import base64
+import asyncio
+import logging
+
+from cashews.ttl       import ttl_to_seconds
+from typing            import Awaitable, Callable, Dict, Optional
+from libs.cache        import cache
+from libs.singleflight import SingleFlight
+
+
+# used when the token does not tell its own expiration, refreshed in background once within the margin of it
+# (or halfway through its validity, when shorter)
+AUTH_TOKEN_TTL            = ttl_to_seconds( os.environ.get('AUTH_TOKEN_TTL', '7d') )
+AUTH_TOKEN_REFRESH_MARGIN = ttl_to_seconds( os.environ.get('AUTH_TOKEN_REFRESH_MARGIN', '1d') )
+# tokens are shared by the workers through the cache, one of them logs in while the others wait up to this long
+AUTH_LOGIN_LOCK_TIMEOUT   = ttl_to_seconds( os.environ.get('AUTH_LOGIN_LOCK_TIMEOUT', '10s') )
+AUTH_LOGIN_POLL_INTERVAL  = 0.1
+
+
+def jwt_expiration(token: str) -> Optional[float]:
+    # the "exp" claim, the signature is none of our business
+    try:
+        payload = token.split('.')[1]
+        return float( json.loads( base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)) )['exp'] )
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenManager:
+    def __init__(self, name: str, login: Callable[[], Awaitable[str]], base_headers: Dict[str, str] = None):
+        self.name         = name
+        self.login        = login
+        self.base_headers = base_headers or {}
+        self.current      = None
+        self.expires      = 0.0
+        self.refresh_at   = 0.0
+        self.rejected     = None
+        self.flight       = SingleFlight(f'{name}:login')
+        self.refresh_task = None
+        self.token_key    = f'auth:{name}:token'
+        self.lock_key     = f'auth:{name}:login'
+
+    @staticmethod
+    def refresh_time(shared: Dict) -> float:
+        # short lived tokens are refreshed halfway through, not on every call
+        return shared['expires'] - min( AUTH_TOKEN_REFRESH_MARGIN, (shared['expires'] - shared['issued']) / 2 )
+
+    async def shared_token(self) -> Optional[Dict]:
+        # the token another worker (or this one) logged in with, unless it is due for a refresh or was rejected
+        shared = await cache.get_shared(self.token_key)
+        if shared and shared['token'] != self.rejected and self.refresh_time(shared) > time.time():
+            return shared
+        return None
+
+    async def shared_login(self) -> Dict:
+        # a single worker logs in at a time, the others wait for its token and only log in themselves if it never comes
+        locked = await cache.set_if_missing(self.lock_key, os.getpid(), expire = AUTH_LOGIN_LOCK_TIMEOUT)
+        if not locked:
+            deadline = time.monotonic() + AUTH_LOGIN_LOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                await asyncio.sleep(AUTH_LOGIN_POLL_INTERVAL)
+                shared = await self.shared_token()
+                if shared:
+                    return shared
+            logging.warning(f'[{self.name}] - No token from the worker logging in after {AUTH_LOGIN_LOCK_TIMEOUT}s, logging in')
+
+        try:
+            token  = await self.login()
+            issued = time.time()
+            shared = { 'token': token, 'issued': issued, 'expires': jwt_expiration(token) or issued + AUTH_TOKEN_TTL }
+            await cache.set(self.token_key, shared, expire = max(1, shared['expires'] - issued))
+            logging.info(f'[{self.name}] - Logged in, token valid for {(shared["expires"] - issued) / 3600:.1f}h')
+            return shared
+        finally:
+            # never someone else's lock: the worker that took it may still be logging in
+            if locked:
+                await cache.delete(self.lock_key)
+
+    async def refresh(self) -> Dict[str, str]:
+        # one login at a time, whoever asks meanwhile waits for the same one
+        async def do_login() -> Dict[str, str]:
+            shared          = await self.shared_token() or await self.shared_login()
+            self.expires    = shared['expires']
+            self.refresh_at = self.refresh_time(shared)
+            self.current    = self.base_headers | { 'Authorization': f'Bearer {shared["token"]}' }
+            return self.current
+        return await self.flight.do('login', do_login)
+
+    async def headers(self) -> Dict[str, str]:
+        # the very same dict every time, until the token changes
+        now = time.time()
+        if self.current is None or now >= self.expires:
+            return await self.refresh()
+        if now >= self.refresh_at and (self.refresh_task is None or self.refresh_task.done()):
+            self.refresh_task = asyncio.ensure_future( self.refresh_early() )
+        return self.current
+
+    async def refresh_early(self):
+        # the current token is still good meanwhile, a failure here is only worth a retry on the next call
+        try:
+            await self.refresh()
+        except Exception as e:
+            logging.warning(f'[{self.name}] - Early token refresh failed ({type(e).__name__}), keeping the current one')
+
+    def invalidate(self, headers: Dict[str, str]):
+        # the upstream rejected these credentials: drop them, unless someone already replaced them
+        if self.current is not None and self.current.get('Authorization') == headers.get('Authorization'):
+            logging.warning(f'[{self.name}] - Token rejected upstream, logging in again')
+            self.rejected = headers['Authorization'].removeprefix('Bearer ')
+            self.current  = None
@@ -0,0 +1,95 @@
+import re
+import os
+import time
+import logging
+
+from collections  import deque
+from typing       import Dict, Optional, Tuple
+from libs.metrics import registry, Counter, Gauge
+
+
+# over the last BREAKER_WINDOW calls of an endpoint family, at least BREAKER_MIN_CALLS and BREAKER_ERROR_RATE of them
+# failed: calls fail fast for BREAKER_OPEN_TIME, then up to BREAKER_HALF_OPEN_PROBES calls test the upstream again
+BREAKER_WINDOW           = int( os.environ.get('BREAKER_WINDOW', '20') )
+BREAKER_MIN_CALLS        = int( os.environ.get('BREAKER_MIN_CALLS', '10') )
+BREAKER_ERROR_RATE       = float( os.environ.get('BREAKER_ERROR_RATE', '0.5') )
+BREAKER_OPEN_TIME        = float( os.environ.get('BREAKER_OPEN_TIME', '30') )
+BREAKER_HALF_OPEN_PROBES = int( os.environ.get('BREAKER_HALF_OPEN_PROBES', '1') )
+
+CLOSED    = 'closed'
+HALF_OPEN = 'half_open'
+OPEN      = 'open'
+STATES    = { CLOSED: 0, HALF_OPEN: 1, OPEN: 2 }
+
+API_VERSION_REGEX = re.compile(r'^v?\d+$')
+
+BREAKER_REJECTED = registry.register( Counter(
+    'atlas_circuit_breaker_rejected_total', 'Upstream calls failed fast by an open circuit breaker', [ 'provider', 'family' ]
+) )
+
+
+class CircuitBreaker:
+    def __init__(self, provider: str, family: str):
+        self.provider    = provider
+        self.family      = family
+        self.state       = CLOSED
+        self.outcomes    = deque(maxlen = BREAKER_WINDOW)
+        self.opened_at   = 0.0
+        self.probes      = 0
+
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + BREAKER_OPEN_TIME - time.monotonic())
+
+    def transition(self, state: str):
+        if state != self.state:
+            log = logging.info if state == CLOSED else logging.warning
+            log(f'[CircuitBreaker] - {self.provider} {self.family} circuit is now {state.replace("_", "-")}')
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if state == CLOSED:
+            self.outcomes.clear()
+        self.probes = 0
+
+    def allow(self) -> bool:
+        if self.state == OPEN and self.retry_in() <= 0:
+            self.transition(HALF_OPEN)
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and self.probes < BREAKER_HALF_OPEN_PROBES:
+            self.probes += 1
+            return True
+        BREAKER_REJECTED.inc(provider = self.provider, family = self.family)
+        return False
+
+    def record(self, success: Optional[bool]):
+        # None: the call never completed (e.g. cancelled), it only gives its probe slot back
+        if self.state == HALF_OPEN:
+            if success is None:
+                self.probes = max(0, self.probes - 1)
+            else:
+                self.transition(CLOSED if success else OPEN)
+            return
+        if success is None or self.state == OPEN:
+            return
+
+        self.outcomes.append(success)
+        failures = self.outcomes.count(False)
+        if len(self.outcomes) >= BREAKER_MIN_CALLS and failures / len(self.outcomes) >= BREAKER_ERROR_RATE:
+            self.transition(OPEN)
+
+
+breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+def get_breaker(provider: str, endpoint: str) -> CircuitBreaker:
+    # endpoint families share their fate upstream: /v4/series/{id}/extended and /v4/series/{id}/episodes/... -> series
+    family = next( (segment for segment in endpoint.strip('/').split('/') if not API_VERSION_REGEX.match(segment)), '/' )
+    if (provider, family) not in breakers:
+        breakers[(provider, family)] = CircuitBreaker(provider, family)
+    return breakers[(provider, family)]
+
+
+registry.register( Gauge(
+    'atlas_circuit_breaker_state', 'Circuit breaker state by upstream endpoint family (0 closed, 1 half-open, 2 open)', [ 'provider', 'family' ],
+    collect = lambda: { key: STATES[breaker.state] for key, breaker in breakers.items() }
+) )
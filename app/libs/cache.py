@@ -0,0 +1,320 @@
+import os
+import time
+import inspect
+import asyncio
+import logging
+import functools
+
+from cashews           import Cache
+from cashews.ttl       import ttl_to_seconds
+from fastapi           import HTTPException
+from contextvars       import ContextVar
+from typing            import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from libs.retry        import start_request_budget
+from libs.ratelimit    import BACKGROUND, request_priority
+from libs.metrics      import registry, CACHE_REQUESTS, Gauge
+from libs.singleflight import get_key
+
+
+# L1: bounded in-process memory, L2: any cashews backend shared between workers/restarts
+# e.g. CACHE_L2_URL="redis://redis:6379/1" or CACHE_L2_URL="disk://?directory=/var/cache/atlas" (SQLite based)
+CACHE_L1_SIZE           = int( os.environ.get('CACHE_L1_SIZE', '30720') )
+CACHE_L1_CHECK_INTERVAL = int( os.environ.get('CACHE_L1_CHECK_INTERVAL', '10') )
+CACHE_L1_MAX_TTL        = ttl_to_seconds( os.environ.get('CACHE_L1_MAX_TTL', '1h') ) # only applies when an L2 is configured
+CACHE_L2_URL            = os.environ.get('CACHE_L2_URL')
+CACHE_L2_TIMEOUT        = float( os.environ.get('CACHE_L2_TIMEOUT', '0.5') )
+CACHE_L2_RETRY_INTERVAL = float( os.environ.get('CACHE_L2_RETRY_INTERVAL', '30') )
+
+# soft TTL: past it entries are still served, but refreshed in background until the hard TTL drops them
+CACHE_SOFT_TTL_RATIO      = float( os.environ.get('CACHE_SOFT_TTL_RATIO', '0.75') )
+CACHE_REFRESH_CONCURRENCY = int( os.environ.get('CACHE_REFRESH_CONCURRENCY', '4') )
+CACHE_REFRESH_QUEUE_SIZE  = int( os.environ.get('CACHE_REFRESH_QUEUE_SIZE', '256') )
+CACHE_HOT_SWEEP_INTERVAL  = float( os.environ.get('CACHE_HOT_SWEEP_INTERVAL', '60') )
+CACHE_HOT_THRESHOLD       = int( os.environ.get('CACHE_HOT_THRESHOLD', '10') )
+CACHE_HOT_KEYS_MAX        = int( os.environ.get('CACHE_HOT_KEYS_MAX', '1024') )
+# how long past their hard TTL values are kept, to be served when their upstream is down
+CACHE_FALLBACK_TTL        = ttl_to_seconds( os.environ.get('CACHE_FALLBACK_TTL', '7d') )
+
+NOT_FOUND = object()
+
+# [ oldest created, earliest soft expiration ] of the cached values read by the current caller, when it asked to know
+# (see libs.responses), values read while building a cached value themselves are not accounted for
+freshness: ContextVar[Optional[List[float]]] = ContextVar('freshness', default = None)
+
+
+def upstream_unavailable(e: HTTPException) -> bool:
+    # server side failures, timeouts and open circuits, not something wrong with the request itself
+    return e.status_code >= 500 or e.status_code == 429
+
+def note_freshness(created: float, soft_ttl: float):
+    tracked = freshness.get()
+    if tracked is not None:
+        tracked[0] = min(tracked[0], created)
+        tracked[1] = min(tracked[1], created + soft_ttl)
+
+
+class TieredCache:
+    def __init__(self):
+        self.l1            = Cache(name = 'l1')
+        self.l2            = None
+        self.l2_down_until = 0.0
+
+    def setup(self, l2_url: str = CACHE_L2_URL):
+        self.l1.setup(f'mem://?check_interval={CACHE_L1_CHECK_INTERVAL}&size={CACHE_L1_SIZE}')
+        if l2_url:
+            self.l2 = Cache(name = 'l2')
+            self.l2.setup(l2_url)
+        return self
+
+    @property
+    def l2_available(self) -> bool:
+        return self.l2 is not None and time.monotonic() >= self.l2_down_until
+
+    async def call_l2(self, command: str, *args, **kwargs) -> Any:
+        # an unreachable L2 must never slow requests down: short timeout, then L1 only for a while
+        if not self.l2_available:
+            return None
+        try:
+            return await asyncio.wait_for( getattr(self.l2, command)(*args, **kwargs), CACHE_L2_TIMEOUT )
+        except Exception as e:
+            logging.warning(
+                f'[Cache] - L2 backend unreachable ({type(e).__name__}), falling back to L1 only for {CACHE_L2_RETRY_INTERVAL}s'
+            )
+            self.l2_down_until = time.monotonic() + CACHE_L2_RETRY_INTERVAL
+            return None
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        value = await self.l1.get(key, default = NOT_FOUND)
+        if value is not NOT_FOUND:
+            return value
+
+        value = await self.call_l2('get', key, default = NOT_FOUND)
+        if value is None or value is NOT_FOUND:
+            return default
+        # promote to L1, without outliving the L2 entry
+        expire = await self.call_l2('get_expire', key)
+        await self.l1.set(key, value, expire = self.l1_expire(expire if expire and expire > 0 else None))
+        return value
+
+    def l1_expire(self, expire: Optional[float]) -> Optional[float]:
+        # with a shared L2 the local copy is kept short, so that workers converge on the shared entry
+        if self.l2 is None or not CACHE_L1_MAX_TTL:
+            return expire
+        return min(expire, CACHE_L1_MAX_TTL) if expire else CACHE_L1_MAX_TTL
+
+    async def set(self, key: str, value: Any, expire: float = None):
+        await self.l1.set(key, value, expire = self.l1_expire(expire))
+        await self.call_l2('set', key, value, expire = expire)
+
+    async def get_shared(self, key: str, default: Any = None) -> Any:
+        # the L2 first, for values other workers may just have replaced, the local copy only when there is no L2
+        if self.l2_available:
+            value = await self.call_l2('get', key, default = NOT_FOUND)
+            if value is not None:
+                return default if value is NOT_FOUND else value
+        return await self.l1.get(key, default = default)
+
+    async def set_if_missing(self, key: str, value: Any, expire: float = None) -> bool:
+        # an atomic claim across workers through the L2, within this process only without it
+        if self.l2_available:
+            claimed = await self.call_l2('set', key, value, expire = expire, exist = False)
+            if claimed is not None:
+                return bool(claimed)
+        return bool( await self.l1.set(key, value, expire = expire, exist = False) )
+
+    async def get_expire(self, key: str) -> Optional[int]:
+        expire = await self.call_l2('get_expire', key) if self.l2 else None
+        if expire is None:
+            expire = await self.l1.get_expire(key)
+        return expire if expire and expire > 0 else None
+
+    async def delete(self, key: str):
+        await self.l1.delete(key)
+        await self.call_l2('delete', key)
+
+    async def close(self):
+        await self.l1.close()
+        if self.l2:
+            await self.l2.close()
+
+
+class CacheEntry:
+    __slots__ = ('value', 'created')
+
+    def __init__(self, value: Any, created: float = None):
+        self.value   = value
+        self.created = time.time() if created is None else created
+
+    def __getstate__(self):
+        return (self.value, self.created)
+
+    def __setstate__(self, state):
+        self.value, self.created = state
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.created
+
+
+class BackgroundRefresher:
+    def __init__(
+        self,
+        concurrency:    int   = CACHE_REFRESH_CONCURRENCY,
+        queue_size:     int   = CACHE_REFRESH_QUEUE_SIZE,
+        sweep_interval: float = CACHE_HOT_SWEEP_INTERVAL
+    ):
+        self.concurrency    = concurrency
+        self.queue_size     = queue_size
+        self.sweep_interval = sweep_interval
+        self.queue          = None
+        self.pending        = set()
+        self.workers        = []
+        # key -> [hits since last sweep, refresh callable, soft ttl]
+        self.hot_keys: Dict[str, list] = {}
+
+    def start(self):
+        if self.workers:
+            return
+        self.queue   = asyncio.Queue(maxsize = self.queue_size)
+        self.workers = [ asyncio.ensure_future( self.worker() ) for _ in range(self.concurrency) ]
+        self.workers.append( asyncio.ensure_future( self.sweeper() ) )
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions = True)
+        self.workers = []
+        self.pending.clear()
+
+    def schedule(self, key: str, refresh: Callable[[], Awaitable]) -> bool:
+        self.start()
+        if key in self.pending:
+            return False
+        try:
+            self.queue.put_nowait( (key, refresh) )
+        except asyncio.QueueFull:
+            logging.debug(f'[Cache] - Refresh queue full, skipping background refresh: {key}')
+            return False
+        self.pending.add(key)
+        return True
+
+    def track(self, key: str, refresh: Callable[[], Awaitable], soft_ttl: float):
+        if key in self.hot_keys:
+            self.hot_keys[key][0] += 1
+        elif len(self.hot_keys) < CACHE_HOT_KEYS_MAX:
+            self.hot_keys[key] = [ 1, refresh, soft_ttl ]
+
+    async def worker(self):
+        # refreshes have no one waiting for them, interactive upstream calls go first
+        request_priority.set(BACKGROUND)
+        while True:
+            key, refresh = await self.queue.get()
+            # refreshes run detached from any incoming request, so they get their own budget
+            start_request_budget()
+            try:
+                await refresh()
+            except Exception as e:
+                logging.warning(f'[Cache] - Background refresh failed ({type(e).__name__}): {key}')
+            finally:
+                self.pending.discard(key)
+                self.queue.task_done()
+
+    async def sweeper(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            hot_keys, self.hot_keys = self.hot_keys, {}
+            for key, (hits, refresh, soft_ttl) in hot_keys.items():
+                if hits < CACHE_HOT_THRESHOLD:
+                    continue
+                entry = await cache.get(key)
+                # refresh hot entries before they turn stale, so their readers never see one
+                if isinstance(entry, CacheEntry) and entry.age + self.sweep_interval >= soft_ttl:
+                    self.schedule(key, refresh)
+
+
+cache     = TieredCache()
+refresher = BackgroundRefresher()
+
+registry.register( Gauge(
+    'atlas_cache_refresh_queue', 'Background cache refreshes waiting or running',
+    collect = lambda: { (): len(refresher.pending) }
+) )
+
+def get_ttl(name: str, default: str, env_prefix: str = 'CACHE_TTL') -> float:
+    # per function override, e.g. CACHE_TTL_TVDBCLIENT_GET_SHOW=12h or CACHE_SOFT_TTL_TVDBCLIENT_GET_SHOW=6h
+    env_name = f'{env_prefix}_' + name.replace('.', '_').strip('_').upper()
+    return ttl_to_seconds( os.environ.get(env_name, default) )
+
+# validators and parsed bodies of the last upstream responses, and what was built from them: kept long since
+# revalidating them is cheap
+UPSTREAM_CACHE_TTL = get_ttl('upstream', '7d')
+
+async def versioned(name: str, key: str, versions: Iterable[Optional[str]], build: Callable[[], Any]) -> Any:
+    # Reuse what was built from the very same upstream payloads (e.g. all of them revalidated with a 304) instead of
+    # building it again, payloads without a version always get a new build
+    versions = tuple(versions)
+    key      = f'versioned:{name}:{key}'
+    if all(versions):
+        stored = await cache.get(key)
+        if isinstance(stored, CacheEntry) and stored.value[0] == versions:
+            CACHE_REQUESTS.inc(function = f'versioned:{name}', result = 'hit')
+            return stored.value[1]
+        CACHE_REQUESTS.inc(function = f'versioned:{name}', result = 'miss')
+
+    result = build()
+    if all(versions):
+        await cache.set(key, CacheEntry( (versions, result) ), expire = UPSTREAM_CACHE_TTL)
+    return result
+
+def noself_cache(ttl: str, soft_ttl: str = None):
+    def decorator(func: Callable[..., Awaitable]):
+        prefix    = f'{func.__module__}:{func.__qualname__}'
+        signature = inspect.signature(func)
+        hard_ttl  = get_ttl(func.__qualname__, ttl)
+        func_soft = get_ttl(func.__qualname__, soft_ttl or str( int(hard_ttl * CACHE_SOFT_TTL_RATIO) ), 'CACHE_SOFT_TTL')
+
+        async def refresh(key: str, *args, **kwargs) -> Any:
+            token = freshness.set(None)
+            try:
+                result = await func(*args, **kwargs)
+            finally:
+                freshness.reset(token)
+            # kept past its hard TTL only as a last resort, for when the upstream is unavailable
+            await cache.set(key, CacheEntry(result), expire = hard_ttl + CACHE_FALLBACK_TTL)
+            return result
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key   = f'{prefix}:{get_key(signature, *args, **kwargs)}'
+            entry = await cache.get(key, default = NOT_FOUND)
+            if not isinstance(entry, CacheEntry) or entry.age >= hard_ttl:
+                CACHE_REQUESTS.inc(function = func.__qualname__, result = 'miss')
+                note_freshness(time.time(), func_soft)
+                try:
+                    return await refresh(key, *args, **kwargs)
+                except HTTPException as e:
+                    if not isinstance(entry, CacheEntry) or not upstream_unavailable(e):
+                        raise
+                    # the last known value, marked stale by its age, beats an error
+                    logging.warning(f'[Cache] - Upstream unavailable ({e.status_code}), serving an expired value: {key}')
+                    CACHE_REQUESTS.inc(function = func.__qualname__, result = 'fallback')
+                    note_freshness(entry.created, func_soft)
+                    return entry.value
+
+            do_refresh = functools.partial(refresh, key, *args, **kwargs)
+            refresher.track(key, do_refresh, func_soft)
+            note_freshness(entry.created, func_soft)
+            if entry.age >= func_soft:
+                # stale-while-revalidate: serve the soft-expired value now, refresh it in background
+                CACHE_REQUESTS.inc(function = func.__qualname__, result = 'stale')
+                refresher.schedule(key, do_refresh)
+            else:
+                CACHE_REQUESTS.inc(function = func.__qualname__, result = 'hit')
+            return entry.value
+
+        async def invalidate(*args, **kwargs):
+            await cache.delete( f'{prefix}:{get_key(signature, *args, **kwargs)}' )
+
+        wrapper.invalidate = invalidate
+        return wrapper
+    return decorator
@@ -0,0 +1,46 @@
+import re
+import logging
+import warnings
+
+from datetime import date
+from typing   import Optional
+
+
+# YYYY-MM-DD optionally followed by a time part (e.g. TVDB "first_air_time", TMDB dates, ISO timestamps)
+ISO_DATE_PATTERN = re.compile(r'^(\d{4})-(\d{2})-(\d{2})(?:[T ].*)?$')
+YEAR_PATTERN     = re.compile(r'^\d{4}$')
+
+dateparser = None
+
+
+def parse_date(value: Optional[str]) -> Optional[date]:
+    if not value:
+        return None
+    value = value.strip()
+
+    match = ISO_DATE_PATTERN.match(value)
+    if match:
+        try:
+            return date( int(match[1]), int(match[2]), int(match[3]) )
+        except ValueError:
+            pass
+    elif YEAR_PATTERN.match(value):
+        return date(int(value), 1, 1)
+
+    return parse_date_slow(value)
+
+def parse_date_slow(value: str) -> Optional[date]:
+    global dateparser
+    if dateparser is None:
+        # WORKAROUND for https://github.com/scrapinghub/dateparser/issues/1013
+        warnings.filterwarnings(
+            "ignore",
+            message = "The localize method is no longer necessary, as this time zone supports the fold attribute",
+        )
+        import dateparser
+
+    parsed = dateparser.parse(value)
+    if not parsed:
+        logging.warning(f'[Dates] - Unable to parse date: {value}')
+        return None
+    return parsed.date()
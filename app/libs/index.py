@@ -0,0 +1,310 @@
+import re
+import os
+import gzip
+import json
+import fcntl
+import heapq
+import bisect
+import asyncio
+import logging
+import tempfile
+import itertools
+import unicodedata
+
+from collections    import Counter, OrderedDict
+from typing         import Dict, Iterable, List, Optional, Set, Tuple, Union
+from libs.models    import MediaType, Movie, Show, SupportedProviders
+from libs.metrics   import registry, Gauge
+from libs.offload   import offload
+from libs.responses import dumps
+
+
+# every movie and show the providers returned, searchable by any of their titles without going upstream
+TITLE_INDEX_PATH           = os.environ.get('TITLE_INDEX_PATH', 'title_index.json.gz')   # empty: not persisted
+TITLE_INDEX_MAX_ENTRIES    = int( os.environ.get('TITLE_INDEX_MAX_ENTRIES', '200000') )
+TITLE_INDEX_SAVE_INTERVAL  = float( os.environ.get('TITLE_INDEX_SAVE_INTERVAL', '300') )
+TITLE_INDEX_MIN_SIMILARITY = float( os.environ.get('TITLE_INDEX_MIN_SIMILARITY', '0.3') )
+# fuzzy matches are only scored for the titles sharing the most trigrams with the query, and words shorter than
+# TITLE_INDEX_SHORT_PREFIX (type-ahead) only expand to as many titles
+TITLE_INDEX_MAX_CANDIDATES = int( os.environ.get('TITLE_INDEX_MAX_CANDIDATES', '1000') )
+TITLE_INDEX_SHORT_PREFIX   = 3
+
+NON_ALNUM_REGEX = re.compile(r'[^\w]+')
+
+Key = Tuple[str, str]
+
+
+def normalize(title: str) -> str:
+    # accents folded, case folded, punctuation gone: "L'Attacco dei Giganti!" -> "l attacco dei giganti"
+    folded = ''.join( char for char in unicodedata.normalize('NFKD', title) if not unicodedata.combining(char) ).casefold()
+    return ' '.join( NON_ALNUM_REGEX.sub(' ', folded).replace('_', ' ').split() )
+
+def trigrams(title: str) -> Set[str]:
+    padded = f'  {title} '
+    return { padded[index:index + 3] for index in range( len(padded) - 2 ) }
+
+
+class IndexEntry:
+    __slots__ = ('source', 'type', 'media', 'titles', 'normalized')
+
+    def __init__(self, source: str, type: str, media: Union[Movie, Show], titles: List[str]):
+        self.source     = source
+        self.type       = type
+        self.media      = media
+        self.titles     = titles
+        self.normalized = { normalize(title) for title in titles } - { '' }
+
+
+class Postings:
+    # words and trigrams of the titles of a single source and media type: searches never look at the others
+    __slots__ = ('tokens', 'trigrams', 'sorted_tokens')
+
+    def __init__(self):
+        self.tokens:   Dict[str, Set[Key]] = {}
+        self.trigrams: Dict[str, Set[Key]] = {}
+        # the same tokens, sorted, for prefix lookups
+        self.sorted_tokens: List[str] = []
+
+    def post(self, key: Key, entry: IndexEntry):
+        for title in entry.normalized:
+            for token in title.split():
+                if token not in self.tokens:
+                    self.tokens[token] = set()
+                    bisect.insort(self.sorted_tokens, token)
+                self.tokens[token].add(key)
+            for trigram in trigrams(title):
+                self.trigrams.setdefault(trigram, set()).add(key)
+
+    def unpost(self, key: Key, entry: IndexEntry):
+        for title in entry.normalized:
+            for token in title.split():
+                keys = self.tokens.get(token)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.tokens[token]
+                        del self.sorted_tokens[ bisect.bisect_left(self.sorted_tokens, token) ]
+            for trigram in trigrams(title):
+                keys = self.trigrams.get(trigram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.trigrams[trigram]
+
+    def prefixed(self, token: str) -> Set[Key]:
+        # the word itself first, then the longer ones: a short prefix (e.g. "t") stops at the candidates cap
+        if len(token) >= TITLE_INDEX_SHORT_PREFIX:
+            keys = set( self.tokens.get(token, ()) )
+            for index in range( bisect.bisect_right(self.sorted_tokens, token), len(self.sorted_tokens) ):
+                if not self.sorted_tokens[index].startswith(token):
+                    break
+                keys |= self.tokens[ self.sorted_tokens[index] ]
+            return keys
+
+        keys = set( itertools.islice(self.tokens.get(token, ()), TITLE_INDEX_MAX_CANDIDATES) )
+        for index in range( bisect.bisect_right(self.sorted_tokens, token), len(self.sorted_tokens) ):
+            if len(keys) >= TITLE_INDEX_MAX_CANDIDATES or not self.sorted_tokens[index].startswith(token):
+                break
+            keys.update( itertools.islice(self.tokens[ self.sorted_tokens[index] ], TITLE_INDEX_MAX_CANDIDATES - len(keys)) )
+        return keys
+
+    def similar(self, query_trigrams: Set[str]) -> Counter:
+        # trigrams shared with the query, by title: candidates come from the rarest trigrams, the most common ones
+        # (e.g. "  t") only add to the count of those already found instead of bringing in half the index
+        counts = Counter()
+        for trigram in sorted( query_trigrams, key = lambda trigram: len( self.trigrams.get(trigram, ()) ) ):
+            keys = self.trigrams.get(trigram, ())
+            if len(counts) < TITLE_INDEX_MAX_CANDIDATES and len(keys) <= TITLE_INDEX_MAX_CANDIDATES:
+                counts.update(keys)
+            else:
+                for key in counts:
+                    if key in keys:
+                        counts[key] += 1
+        return counts
+
+
+class TitleIndex:
+    def __init__(self, max_entries: int = TITLE_INDEX_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[Key, IndexEntry] = OrderedDict()
+        self.postings: Dict[Tuple[str, str], Postings] = {}
+        self.dirty       = False
+
+    def partition(self, source: str, type: str) -> Postings:
+        if (source, type) not in self.postings:
+            self.postings[(source, type)] = Postings()
+        return self.postings[(source, type)]
+
+    def post(self, key: Key, entry: IndexEntry):
+        self.partition(entry.source, entry.type).post(key, entry)
+
+    def unpost(self, key: Key, entry: IndexEntry):
+        self.partition(entry.source, entry.type).unpost(key, entry)
+
+    def add(self, source: SupportedProviders, media: Union[Movie, Show], aliases: Iterable[Optional[str]] = ()):
+        # the latest version of the media wins, titles seen for it before are kept (e.g. the other languages)
+        if media is None or not getattr(media, 'title', None):
+            return
+        source = SupportedProviders(source).value
+        type   = MediaType.MOVIE.value if isinstance(media, Movie) else MediaType.SERIES.value
+        key    = (source, media.guid)
+        # no episodes in here, only what a search result carries
+        media  = media.copy(update = { 'seasons': [] }) if isinstance(media, Show) and media.seasons else media
+
+        previous = self.entries.get(key)
+        titles   = list( dict.fromkeys( [ media.title ] + [ alias for alias in aliases if alias ] + (previous.titles if previous else []) ) )
+        entry    = IndexEntry(source, type, media, titles)
+        if previous is not None:
+            self.unpost(key, previous)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.post(key, entry)
+        self.dirty = True
+
+        while len(self.entries) > self.max_entries:
+            evicted_key, evicted = self.entries.popitem(last = False)
+            self.unpost(evicted_key, evicted)
+
+    def search(
+        self,
+        query:  str,
+        source: SupportedProviders,
+        type:   MediaType = None,
+        page:   int       = 1,
+        limit:  int       = 20
+    ) -> Dict[str, List[Union[Movie, Show]]]:
+        # only the postings of the requested source and type are looked at, and only the requested page is ranked
+        normalized = normalize(query)
+        source     = SupportedProviders(source).value
+        results    = { MediaType.MOVIE.value: [], MediaType.SERIES.value: [] }
+        for media_type in results if type is None else [ MediaType(type).value ]:
+            postings = self.postings.get( (source, media_type) )
+            if normalized and postings is not None:
+                ranked = self.rank(postings, normalized, page * limit)
+                results[media_type] = [ self.entries[key].media for key in ranked[(page - 1) * limit:] ]
+        return { 'movies': results[MediaType.MOVIE.value], 'series': results[MediaType.SERIES.value] }
+
+    def rank(self, postings: Postings, normalized: str, count: int) -> List[Key]:
+        # every word a prefix of some title word (type-ahead) ranks first, then titles close enough by trigrams.
+        # Ranked as (-score, title, key), only the best `count` are kept.
+        entries = self.entries
+        matches = sorted( (postings.prefixed(word) for word in normalized.split()), key = len )
+        for keys in matches[1:]:
+            matches[0] &= keys
+        ranked = []
+        for key in matches[0]:
+            entry = entries[key]
+            score = 2.0 + any( title.startswith(normalized) for title in entry.normalized ) + (normalized in entry.normalized)
+            ranked.append( (-score, entry.media.title, key) )
+
+        # fuzzy matches only when the prefix ones do not fill the page
+        if len(ranked) < count and len(normalized) >= 3:
+            query_trigrams = trigrams(normalized)
+            for key, shared in postings.similar(query_trigrams).most_common(TITLE_INDEX_MAX_CANDIDATES):
+                if key in matches[0]:
+                    continue
+                # Jaccard, a title of n characters having (at most) n + 1 trigrams
+                entry      = entries[key]
+                similarity = max(
+                    shared / max( shared, len(query_trigrams) + len(title) + 1 - shared ) for title in entry.normalized
+                )
+                if similarity >= TITLE_INDEX_MIN_SIMILARITY:
+                    ranked.append( (-similarity, entry.media.title, key) )
+
+        return [ key for _, _, key in heapq.nsmallest(count, ranked) ]
+
+    def snapshot(self) -> List[Dict]:
+        return [
+            { 'source': entry.source, 'type': entry.type, 'titles': entry.titles, 'media': entry.media } for entry in self.entries.values()
+        ]
+
+    @staticmethod
+    def write(path: str, snapshot: List[Dict], max_entries: int = TITLE_INDEX_MAX_ENTRIES):
+        # Every worker saves to the same file: one at a time, each one merging what the others saved (its own entries
+        # being the newest ones) instead of dropping it. Written aside then renamed, so a crash never leaves half an
+        # index behind, under a name of its own so that two writers never share it.
+        items = { (item['source'], item['media'].guid): item | { 'media': item['media'].dict() } for item in snapshot }
+        with open(f'{path}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            saved = []
+            if os.path.isfile(path):
+                try:
+                    with gzip.open(path, 'rb') as file:
+                        saved = json.loads( file.read() )
+                except Exception as e:
+                    logging.warning(f'[TitleIndex] - Could not merge the index in {path}, replacing it: {e!r}')
+            merged = {}
+            for item in saved:
+                key = (item['source'], item['media']['guid'])
+                if key in items:
+                    items[key]['titles'] = list( dict.fromkeys(items[key]['titles'] + item['titles']) )
+                else:
+                    merged[key] = item
+            merged.update(items)
+
+            temp_fd, temp_path = tempfile.mkstemp(dir = os.path.dirname(path) or '.', prefix = f'{os.path.basename(path)}.', suffix = '.tmp')
+            try:
+                with os.fdopen(temp_fd, 'wb') as raw, gzip.GzipFile(fileobj = raw, mode = 'wb', compresslevel = 5) as file:
+                    file.write( dumps( list( merged.values() )[-max_entries:] ) )
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+
+    @classmethod
+    def read(cls, path: str) -> 'TitleIndex':
+        # disk content is validated, as anything crossing a boundary
+        index = cls()
+        with gzip.open(path, 'rb') as file:
+            for item in json.loads( file.read() ):
+                model = Movie if item['type'] == MediaType.MOVIE.value else Show
+                index.add(item['source'], model.parse_obj(item['media']), item['titles'])
+        index.dirty = False
+        return index
+
+    def absorb(self, restored: 'TitleIndex'):
+        # adopt a restored index, entries added meanwhile being newer
+        for key, entry in self.entries.items():
+            restored.add(entry.source, entry.media, entry.titles)
+        self.entries, self.postings = restored.entries, restored.postings
+
+    async def load(self, path: str = TITLE_INDEX_PATH):
+        if not path or not os.path.isfile(path):
+            return
+        try:
+            restored = await offload('title_index:load', self.max_entries, TitleIndex.read, path)
+        except Exception as e:
+            logging.warning(f'[TitleIndex] - Could not restore the index from {path}: {e!r}')
+            return
+        self.absorb(restored)
+        logging.info(f'[TitleIndex] - Restored {len(self.entries)} titles from {path}')
+
+    async def save(self, path: str = TITLE_INDEX_PATH):
+        if not path or not self.dirty:
+            return
+        self.dirty = False
+        try:
+            snapshot = self.snapshot()
+            # the file of the other workers is read and merged too, whatever the size of this snapshot
+            await offload('title_index:save', self.max_entries, TitleIndex.write, path, snapshot, self.max_entries)
+        except Exception as e:
+            self.dirty = True
+            logging.warning(f'[TitleIndex] - Could not persist the index to {path}: {e!r}')
+
+    async def keep_saved(self, interval: float = TITLE_INDEX_SAVE_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            await self.save()
+
+
+title_index = TitleIndex()
+
+def indexed(source: SupportedProviders, media: Union[Movie, Show], aliases: Iterable[Optional[str]] = ()) -> Union[Movie, Show]:
+    # for the providers: index what they are returning, along with its titles in the other languages
+    title_index.add(source, media, aliases)
+    return media
+
+registry.register( Gauge(
+    'atlas_title_index_entries', 'Movies and shows searchable in the local title index', [ 'source' ],
+    collect = lambda: Counter( (source,) for source, _ in title_index.entries )
+) )
@@ -0,0 +1,201 @@
+# Usage (from the app folder):
+#   python -m libs.ingest tmdb --type movie [--export PATH_OR_URL] [--min-popularity 5]
+#   python -m libs.ingest tvdb [--since EPOCH] [--all]
+#   python -m libs.ingest ids  --source tvdb --type series IDS_FILE
+#
+# Fills the local metadata store (libs.store) ahead of the requests: from the TMDB daily ID exports (gzipped NDJSON,
+# streamed), from the TVDB updates feed (the stored series changed upstream) or from a plain list of IDs, e.g. those
+# of a library. IDs are handled in chunks, each one fetched through the usual clients and stored in one transaction:
+# memory stays flat whatever the size of the export.
+import os
+import gzip
+import time
+import zlib
+import httpx
+import asyncio
+import logging
+import argparse
+
+from datetime          import datetime, timezone
+from cashews.ttl       import ttl_to_seconds
+from fastapi           import HTTPException
+from typing            import AsyncIterator, Dict, Iterable, List
+from libs.cache        import cache
+from libs.logging      import setup_logging
+from libs.retry        import start_request_budget
+from libs.ratelimit    import BACKGROUND, request_priority
+from libs.models       import BatchDetailsItem, MediaType, SupportedProviders
+from libs.store        import loads, store, tracked
+from libs.tvdb         import TVDBClient
+from libs.tmdb         import TMDBClient
+
+
+INGEST_CHUNK_SIZE    = int( os.environ.get('INGEST_CHUNK_SIZE', '500') )
+INGEST_CONCURRENCY   = int( os.environ.get('INGEST_CONCURRENCY', '8') )
+TMDB_EXPORTS_URL     = os.environ.get('TMDB_EXPORTS_URL', 'http://files.tmdb.org/p/exports')
+TMDB_EXPORT_FILES    = { MediaType.MOVIE: 'movie_ids', MediaType.SERIES: 'tv_series_ids' }
+# the TVDB updates feed is read from where the previous run stopped, or this far back on the first one
+TVDB_INGEST_LOOKBACK = ttl_to_seconds( os.environ.get('TVDB_INGEST_LOOKBACK', '1d') )
+TVDB_INGEST_SINCE    = 'tvdb:updates:since'
+
+
+def export_url(type: MediaType, day: datetime = None) -> str:
+    # published every day around 8 AM UTC, yesterday's one is always there
+    day = day or datetime.fromtimestamp(time.time() - 86400, timezone.utc)
+    return f'{TMDB_EXPORTS_URL}/{TMDB_EXPORT_FILES[type]}_{day:%m_%d_%Y}.json.gz'
+
+async def export_lines(http_client: httpx.AsyncClient, location: str) -> AsyncIterator[bytes]:
+    # gzipped NDJSON, decompressed as it arrives
+    if os.path.isfile(location):
+        with gzip.open(location, 'rb') as file:
+            for line in file:
+                yield line
+        return
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending      = b''
+    async with http_client.stream('GET', location) as response:
+        response.raise_for_status()
+        async for data in response.aiter_raw():
+            *lines, pending = ( pending + decompressor.decompress(data) ).split(b'\n')
+            for line in lines:
+                yield line
+    pending += decompressor.flush()
+    if pending.strip():
+        yield pending
+
+async def export_ids(lines: AsyncIterator[bytes], min_popularity: float = 0, adult: bool = False) -> AsyncIterator[int]:
+    # e.g. {"adult":false,"id":3924,"original_title":"Blondie","popularity":2.4,"video":false}
+    async for line in lines:
+        if not line.strip():
+            continue
+        entry = loads(line)
+        if (adult or not entry.get('adult')) and (entry.get('popularity') or 0) >= min_popularity:
+            yield int(entry['id'])
+
+async def chunked(ids: AsyncIterator[int], size: int = INGEST_CHUNK_SIZE) -> AsyncIterator[List[int]]:
+    chunk = []
+    async for id in ids:
+        chunk.append(id)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def iterate(ids: Iterable[int]) -> AsyncIterator[int]:
+    for id in ids:
+        yield id
+
+
+class Ingestion:
+    def __init__(self, clients: Dict[SupportedProviders, object], refresh: bool = False, concurrency: int = INGEST_CONCURRENCY):
+        self.clients   = clients
+        self.refresh   = refresh
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.stats     = { 'stored': 0, 'skipped': 0, 'failed': 0 }
+
+    async def fetch(self, item: BatchDetailsItem):
+        # one at a time against the rate limiters, as background work: live requests get ahead of it
+        request_priority.set(BACKGROUND)
+        async with self.semaphore:
+            start_request_budget()
+            client = self.clients[item.source]
+            try:
+                if item.type == MediaType.MOVIE:
+                    media, created, fresh_until = await tracked(lambda: client.get_movie(id = item.id))
+                else:
+                    media, created, fresh_until = await tracked(lambda: client.get_show(id = item.id, with_episodes = item.with_episodes))
+                # an expired value served while the upstream is down is not what the store is for
+                if fresh_until > time.time():
+                    return item, media, created
+                logging.warning(f'[Ingest] - Only a stale value available for {item.source.value} {item.type.value} {item.id}')
+            except HTTPException as e:
+                # e.g. ids in the export deleted upstream meanwhile
+                logging.debug(f'[Ingest] - Skipping {item.source.value} {item.type.value} {item.id}: {e.status_code} {e.detail}')
+            except Exception as e:
+                logging.warning(f'[Ingest] - Could not fetch {item.source.value} {item.type.value} {item.id}: {e!r}')
+            return item, None, None
+
+    async def chunk(self, source: SupportedProviders, type: MediaType, ids: List[int]):
+        if not self.refresh:
+            fresh = await store.run(store.known, source, type, ids, True)
+            self.stats['skipped'] += len(fresh)
+            ids   = [ id for id in ids if id not in fresh ]
+        items   = [ BatchDetailsItem(source = source, type = type, id = id, with_episodes = type == MediaType.SERIES) for id in ids ]
+        results = await asyncio.gather(*[ self.fetch(item) for item in items ])
+        records = [ record for record in results if record[1] is not None ]
+        # unlike the write-through of the API, a store failure stops the job
+        await store.run(store.put, records)
+        self.stats['stored'] += len(records)
+        self.stats['failed'] += len(results) - len(records)
+
+    async def ingest(self, source: SupportedProviders, type: MediaType, ids: AsyncIterator[int]):
+        start_time = time.time()
+        async for chunk in chunked(ids):
+            await self.chunk(source, type, chunk)
+            logging.info(
+                f'[Ingest] - {source.value} {type.value}: {self.stats["stored"]} stored, {self.stats["skipped"]} fresh already, '
+                f'{self.stats["failed"]} failed, {time.time() - start_time:.1f}s'
+            )
+
+
+def read_ids(path: str) -> List[int]:
+    with open(path) as file:
+        return [ int(line) for line in ( line.strip() for line in file ) if line and not line.startswith('#') ]
+
+async def main():
+    parser   = argparse.ArgumentParser(description = 'Fill the local metadata store from the providers')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    tmdb     = commands.add_parser('tmdb', help = 'every id in a TMDB daily export')
+    tmdb.add_argument('--type',           default = MediaType.MOVIE.value, choices = [ type.value for type in MediaType ])
+    tmdb.add_argument('--export',         default = None, help = 'export file path or URL, yesterday\'s one by default')
+    tmdb.add_argument('--min-popularity', default = 0.0, type = float, help = 'skip the long tail of the catalog')
+    tmdb.add_argument('--adult',          action = 'store_true', help = 'include adult titles')
+    tvdb     = commands.add_parser('tvdb', help = 'stored series changed on TVDB since the last run')
+    tvdb.add_argument('--since',          default = None, type = int, help = 'epoch to read the updates feed from')
+    tvdb.add_argument('--all',            action = 'store_true', help = 'every changed series, not only the stored ones')
+    ids      = commands.add_parser('ids', help = 'a file with one id per line')
+    ids.add_argument('--source',          required = True, choices = [ source.value for source in SupportedProviders ])
+    ids.add_argument('--type',            required = True, choices = [ type.value for type in MediaType ])
+    ids.add_argument('file')
+    for command in [ tmdb, ids ]:
+        command.add_argument('--refresh', action = 'store_true', help = 'fetch the records still fresh in the store too')
+    args = parser.parse_args()
+
+    setup_logging()
+    if not store.enabled:
+        parser.error('METADATA_STORE_PATH is empty, there is no store to fill')
+    cache.setup()
+    http_client = httpx.AsyncClient(limits = httpx.Limits(max_connections = 50), timeout = httpx.Timeout(60.0), http2 = True)
+    clients     = {
+        SupportedProviders.THE_TV_DB:    TVDBClient(http_client),
+        SupportedProviders.THE_MOVIE_DB: TMDBClient(http_client)
+    }
+    try:
+        if args.command == 'tmdb':
+            type   = MediaType(args.type)
+            export = args.export or export_url(type)
+            logging.info(f'[Ingest] - Reading the TMDB export {export}')
+            await Ingestion(clients, args.refresh).ingest(
+                SupportedProviders.THE_MOVIE_DB, type, export_ids(export_lines(http_client, export), args.min_popularity, args.adult)
+            )
+        elif args.command == 'tvdb':
+            started = int( time.time() )
+            since   = args.since or int( await store.run(store.get_meta, TVDB_INGEST_SINCE) or started - TVDB_INGEST_LOOKBACK )
+            changed = await clients[SupportedProviders.THE_TV_DB].get_updated_series(since)
+            if not args.all:
+                changed = await store.run(store.known, SupportedProviders.THE_TV_DB, MediaType.SERIES, changed)
+            logging.info(f'[Ingest] - {len(changed)} series changed on TVDB since {since}')
+            # changed upstream: stored or not, they are fetched again
+            await Ingestion(clients, refresh = True).ingest(SupportedProviders.THE_TV_DB, MediaType.SERIES, iterate(sorted(changed)))
+            await store.run(store.set_meta, TVDB_INGEST_SINCE, str(started))
+        else:
+            await Ingestion(clients, args.refresh).ingest(SupportedProviders(args.source), MediaType(args.type), iterate(read_ids(args.file)))
+    finally:
+        await http_client.aclose()
+        await cache.close()
+        store.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+import os
+import time
+import asyncio
+import logging
+
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+
+# priority ordered, the first language is the preferred one
+TMDB_LANGUAGES       = [ language.strip() for language in os.environ.get('TMDB_LANGUAGES', 'it-IT,en-US').split(',') ]
+TVDB_LANGUAGES       = [ language.strip() for language in os.environ.get('TVDB_LANGUAGES', 'ita,eng').split(',') ]
+LANGUAGE_HEDGE_DELAY = float( os.environ.get('LANGUAGE_HEDGE_DELAY', '0.25') )
+
+
+async def localized_fetch(
+    fetch:       Callable[[str], Awaitable[Any]],
+    languages:   List[str],
+    is_complete: Callable[[Any], bool],
+    hedge_delay: float = LANGUAGE_HEDGE_DELAY
+) -> Dict[str, Any]:
+    # Fetch the same resource in several languages, by priority. A fallback language is started as soon as the
+    # previous one turns out incomplete, or speculatively once `hedge_delay` passes without an answer.
+    # Returns the results (None on failure) of every language up to the first complete one, lower priority fetches
+    # still running at that point are cancelled.
+    tasks      = []
+    results    = {}
+    errors     = []
+    next_hedge = 0.0
+
+    def start_next():
+        nonlocal next_hedge
+        tasks.append( asyncio.ensure_future( fetch(languages[len(tasks)]) ) )
+        next_hedge = time.monotonic() + hedge_delay
+
+    try:
+        start_next()
+        for index, language in enumerate(languages):
+            task = tasks[index]
+            while not task.done():
+                timeout = max(0.0, next_hedge - time.monotonic()) if len(tasks) < len(languages) else None
+                await asyncio.wait([ task ], timeout = timeout)
+                if not task.done() and len(tasks) < len(languages):
+                    start_next()
+
+            if task.exception():
+                logging.warning(f'[Languages] - Localized fetch failed for language {language}: {task.exception()!r}')
+                errors.append( task.exception() )
+                results[language] = None
+            else:
+                results[language] = task.result()
+                if is_complete(results[language]):
+                    return results
+
+            if index + 1 < len(languages) and len(tasks) == index + 1:
+                start_next()
+    finally:
+        # lower priority fetches nobody waits for anymore: their failures are of no interest, asyncio is told so
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    if errors and not any( result is not None for result in results.values() ):
+        raise errors[0]
+    return results
+
+def first_complete(results: Dict[str, Any], is_complete: Callable[[Any], bool]) -> Any:
+    # the best localized variant: the first complete one, or the first available one
+    available = [ result for result in results.values() if result is not None ]
+    return next( (result for result in available if is_complete(result)), available[0] if available else None )
+
+def merge_localized(variants: Iterable[Optional[Dict]], fields: Iterable[str]) -> Dict:
+    # field by field, the first non empty value by language priority, on top of the preferred variant
+    variants = [ variant for variant in variants if variant ]
+    merged   = dict(variants[0])
+    for field in fields:
+        merged[field] = next( (variant[field] for variant in variants if variant.get(field)), merged.get(field) )
+    return merged
+
+def pick_translation(translations: List[Dict], languages: List[str], field: str, default: Any = None) -> Any:
+    # TVDB "nameTranslations"/"overviewTranslations" style lists
+    by_language = { translation["language"]: translation[field] for translation in translations or [] }
+    return next( (by_language[language] for language in languages if by_language.get(language)), default )
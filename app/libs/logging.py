@@ -2,8 +2,6 @@ import os
 import sys
 import logging
 
-from loguru import logger
-
 
 LOG_LEVEL = logging.getLevelName( os.environ.get("LOG_LEVEL", "DEBUG") )
 JSON_LOGS = True if os.environ.get("JSON_LOGS", "0") == "1" else False
@@ -12,6 +10,9 @@ JSON_LOGS = True if os.environ.get("JSON_LOGS", "0") == "1" else False
 if LOG_LEVEL == logging.DEBUG:
     logging.getLogger("httpx").setLevel(logging.INFO)
 
+# loguru is only loaded by setup_logging(), not by whoever just imports the app
+logger = None
+
 
 class InterceptHandler(logging.Handler):
     def emit(self, record):
@@ -32,6 +33,9 @@ class InterceptHandler(logging.Handler):
 
 
 def setup_logging():
+    global logger
+    from loguru import logger
+
     # intercept everything at the root logger
     logging.root.handlers = [InterceptHandler()]
     logging.root.setLevel(LOG_LEVEL)
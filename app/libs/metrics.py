@@ -0,0 +1,120 @@
+import re
+import bisect
+
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+# Prometheus text exposition format, ref: https://prometheus.io/docs/instrumenting/exposition_formats
+DEFAULT_BUCKETS   = ( 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0 )
+ENDPOINT_ID_REGEX = re.compile(r'/\d+(?=/|$)')
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    labels = [ f'{name}="{str(value)}"' for name, value in zip(names, values) ] + ( [ extra ] if extra else [] )
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+def endpoint_template(path: str) -> str:
+    # keep label cardinality bounded: /series/81189/extended -> /series/{id}/extended
+    return ENDPOINT_ID_REGEX.sub('/{id}', path)
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = (), collect: Callable[[], Dict[Tuple[str, ...], float]] = None):
+        self.name        = name
+        self.description = description
+        self.labels      = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        # optional callback reading the current values at scrape time, for state owned by someone else
+        self.collect     = collect
+
+    def key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple( str(labels.get(name, '')) for name in self.labels )
+
+    def header(self) -> List[str]:
+        return [ f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.type}' ]
+
+    def expose(self) -> List[str]:
+        if self.collect:
+            self.values = self.collect()
+        return self.header() + [ f'{self.name}{format_labels(self.labels, key)} {value}' for key, value in self.values.items() ]
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [ per bucket counts..., +Inf count, sum ]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key    = self.key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [ 0 ] * (len(self.buckets) + 2)
+        series[ bisect.bisect_left(self.buckets, value) ] += 1
+        series[-1] += value
+
+    def expose(self) -> List[str]:
+        lines = self.header()
+        for key, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ( '+Inf', ), series[:-1]):
+                cumulative += count
+                le          = 'le="' + str(bound) + '"'
+                lines.append( f'{self.name}_bucket{format_labels(self.labels, key, le)} {cumulative}' )
+            lines.append( f'{self.name}_sum{format_labels(self.labels, key)} {series[-1]}' )
+            lines.append( f'{self.name}_count{format_labels(self.labels, key)} {cumulative}' )
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        return self.metrics.setdefault(metric.name, metric)
+
+    def expose(self) -> str:
+        return '\n'.join( line for metric in self.metrics.values() for line in metric.expose() ) + '\n'
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.register( Histogram(
+    'atlas_request_duration_seconds', 'Latency of the requests served by the API', [ 'method', 'route', 'status' ]
+) )
+UPSTREAM_LATENCY = registry.register( Histogram(
+    'atlas_upstream_duration_seconds', 'Latency of every single call to an upstream provider', [ 'provider', 'endpoint' ]
+) )
+UPSTREAM_RESPONSES = registry.register( Counter(
+    'atlas_upstream_responses_total', 'Upstream responses by status code, "error" for transport failures', [ 'provider', 'endpoint', 'status' ]
+) )
+UPSTREAM_RETRIES = registry.register( Counter(
+    'atlas_upstream_retries_total', 'Upstream calls retried after a transient failure', [ 'provider', 'endpoint' ]
+) )
+CACHE_REQUESTS = registry.register( Counter(
+    'atlas_cache_requests_total', 'Cached function lookups by result (hit, miss, stale, fallback)', [ 'function', 'result' ]
+) )
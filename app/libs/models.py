@@ -6,6 +6,11 @@ from typing   import List
 from enum     import Enum
 
 
+MOVIE_GUID_REGEX   = re.compile(r'^(tmdb|tvdb):\/\/movie\/\d+$')
+SHOW_GUID_REGEX    = re.compile(r'^(tmdb|tvdb):\/\/series\/\d+$')
+SEASON_GUID_REGEX  = re.compile(r'^(tmdb|tvdb):\/\/series\/\d+\/seasons\/\d+$')
+EPISODE_GUID_REGEX = re.compile(r'^(tmdb|tvdb):\/\/series\/\d+\/episodes\/\d+$')
+
 class SupportedProviders(str, Enum):
     THE_TV_DB    = 'tvdb'
     THE_MOVIE_DB = 'tmdb'
@@ -14,6 +19,11 @@ class MediaType(str, Enum):
     MOVIE  = 'movie'
     SERIES = 'series'
 
+class SearchMode(str, Enum):
+    LOCAL    = 'local'
+    UPSTREAM = 'upstream'
+    HYBRID   = 'hybrid'
+
 class SeasonType(str, Enum):
     DEFAULT   = 'default'
     OFFICIAL  = 'official'
@@ -37,6 +47,8 @@ class ShowStatus(str, Enum):
     ONGOING  = 'Ongoing'
     ENDED    = 'Ended'
 
+# Providers build these with construct(): their data is already normalized, and it is validated once, against the
+# response model, on the way out of the API
 class Media(BaseModel):
     guid:       str
     source_id:  int
@@ -52,7 +64,7 @@ class Movie(Media):
 
     @validator('guid')
     def guid_format(cls, guid):
-        if not re.match(r'^(tmdb|tvdb):\/\/movie\/\d+$', guid):
+        if not MOVIE_GUID_REGEX.match(guid):
             raise ValueError('[Media] - Wrong movie GUID.')
         return guid
 
@@ -62,7 +74,7 @@ class Episode(Media):
 
     @validator('guid')
     def guid_format(cls, guid):
-        if not re.match(r'^(tmdb|tvdb):\/\/series\/\d+\/episodes\/\d+$', guid):
+        if not EPISODE_GUID_REGEX.match(guid):
             raise ValueError('[Media] - Wrong episode GUID.')
         return guid
 
@@ -80,7 +92,7 @@ class Season(BaseModel):
 
     @validator('guid')
     def guid_format(cls, guid):
-        if not re.match(r'^(tmdb|tvdb):\/\/series\/\d+\/seasons\/\d+$', guid):
+        if not SEASON_GUID_REGEX.match(guid):
             raise ValueError('[Media] - Wrong season GUID.')
         return guid
 
@@ -90,10 +102,16 @@ class Show(Media):
 
     @validator('guid')
     def guid_format(cls, guid):
-        if not re.match(r'^(tmdb|tvdb):\/\/series\/\d+$', guid):
+        if not SHOW_GUID_REGEX.match(guid):
             raise ValueError('[Media] - Wrong show GUID.')
         return guid
 
 class SearchResult(BaseModel):
     movies: List[Movie] = []
-    series: List[Show]  = []
\ No newline at end of file
+    series: List[Show]  = []
+
+class BatchDetailsItem(BaseModel):
+    source:        SupportedProviders
+    type:          MediaType
+    id:            int
+    with_episodes: bool = False
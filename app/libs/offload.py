@@ -0,0 +1,74 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+import multiprocessing
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing             import Any, Callable, Optional
+from libs.metrics       import registry, Histogram
+
+
+# CPU heavy stages (provider payloads to models, response bodies) of at least OFFLOAD_MIN_ITEMS items (e.g. episodes)
+# run in an executor, so that the event loop keeps serving everyone else meanwhile: "thread" (no copies, the GIL is
+# released to the loop every switch interval), "process" (true parallelism, arguments and results are pickled)
+# or "inline" (no offloading at all).
+# The mapping is pure Python: in a thread it holds the GIL, and the loop only gets it back every
+# sys.getswitchinterval(). A thread ends the long stalls, but requests served meanwhile are still slowed down.
+# "process" avoids that when there are spare cores. See benchmarks/offload.py for the measurements.
+OFFLOAD_MODE      = os.environ.get('OFFLOAD_MODE', 'thread').lower()
+OFFLOAD_WORKERS   = int( os.environ.get('OFFLOAD_WORKERS', str( min(4, os.cpu_count() or 1) )) )
+OFFLOAD_MIN_ITEMS = int( os.environ.get('OFFLOAD_MIN_ITEMS', '200') )
+# how often the event loop lag is sampled
+LOOP_LAG_INTERVAL = float( os.environ.get('LOOP_LAG_INTERVAL', '0.25') )
+
+LOOP_LAG_BUCKETS  = ( 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5 )
+
+OFFLOAD_LATENCY = registry.register( Histogram(
+    'atlas_offload_seconds', 'CPU heavy stages by where they ran (inline, thread, process), queueing included', [ 'stage', 'mode' ]
+) )
+LOOP_LAG = registry.register( Histogram(
+    'atlas_event_loop_lag_seconds', 'How late the event loop woke up a sleeping task, i.e. how long it was kept busy', buckets = LOOP_LAG_BUCKETS
+) )
+
+executor: Optional[Executor] = None
+
+
+def get_executor() -> Optional[Executor]:
+    global executor
+    if executor is None and OFFLOAD_MODE == 'process':
+        # spawned, not forked: a fork would inherit the event loop, the connection pools and their threads
+        executor = ProcessPoolExecutor(max_workers = OFFLOAD_WORKERS, mp_context = multiprocessing.get_context('spawn'))
+    elif executor is None and OFFLOAD_MODE == 'thread':
+        executor = ThreadPoolExecutor(max_workers = OFFLOAD_WORKERS, thread_name_prefix = 'offload')
+    return executor
+
+def shutdown():
+    global executor
+    if executor is not None:
+        executor.shutdown(wait = False, cancel_futures = True)
+        executor = None
+
+async def offload(stage: str, size: int, function: Callable[..., Any], *args, **kwargs) -> Any:
+    # in process mode `function` and its arguments must be picklable: module functions, class or static methods
+    start_time = time.perf_counter()
+    pool       = get_executor() if size >= OFFLOAD_MIN_ITEMS else None
+    if pool is None:
+        result = function(*args, **kwargs)
+    else:
+        result = await asyncio.get_running_loop().run_in_executor( pool, functools.partial(function, *args, **kwargs) )
+    OFFLOAD_LATENCY.observe(time.perf_counter() - start_time, stage = stage, mode = OFFLOAD_MODE if pool else 'inline')
+    return result
+
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    # a task asking to sleep for `interval`: anything more is time the loop spent on someone else's CPU work
+    loop = asyncio.get_running_loop()
+    while True:
+        start_time = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start_time - interval)
+        LOOP_LAG.observe(lag)
+        if lag >= 1.0:
+            logging.warning(f'[EventLoop] - Blocked for {lag:.2f}s')
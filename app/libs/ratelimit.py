@@ -0,0 +1,123 @@
+import os
+import time
+import asyncio
+import logging
+
+from collections  import deque
+from contextvars  import ContextVar
+from typing       import Deque, Dict
+from libs.metrics import registry, Gauge, Histogram
+
+
+INTERACTIVE = 'interactive'
+BACKGROUND  = 'background'
+
+# requests per second and burst size for every provider, e.g. RATE_LIMIT_TVDB_RATE=20 (0 disables the limiter)
+RATE_LIMIT_DEFAULTS           = { 'TMDB': ( '35', '20' ), 'TVDB': ( '20', '10' ) }
+# with both kinds of work waiting, interactive calls get this many tokens for every background one
+RATE_LIMIT_INTERACTIVE_WEIGHT = int( os.environ.get('RATE_LIMIT_INTERACTIVE_WEIGHT', '4') )
+
+# background jobs (cache refreshes, batches, feeds polling) mark themselves, anything else is someone waiting for it
+request_priority: ContextVar[str] = ContextVar('request_priority', default = INTERACTIVE)
+
+RATE_LIMIT_WAIT = registry.register( Histogram(
+    'atlas_rate_limit_wait_seconds', 'Time upstream calls waited for the provider rate limiter', [ 'provider', 'priority' ]
+) )
+
+
+class RateLimiter:
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name         = name
+        self.rate         = rate
+        self.burst        = max(1, burst)
+        self.tokens       = float(self.burst)
+        self.updated      = time.monotonic()
+        self.paused_until = 0.0
+        self.streak       = 0
+        self.queues: Dict[str, Deque[asyncio.Future]] = { INTERACTIVE: deque(), BACKGROUND: deque() }
+        self.dispatcher   = None
+
+    def refill(self):
+        # nothing accrues while paused: the bucket starts filling again when the pause is over
+        now          = time.monotonic()
+        elapsed      = now - max(self.updated, self.paused_until)
+        if elapsed > 0:
+            self.tokens = min( self.burst, self.tokens + elapsed * self.rate )
+        self.updated = now
+
+    def pause(self, seconds: float):
+        # the upstream said stop (429): nobody goes through until it is over, and no burst right after
+        self.refill()
+        self.tokens       = min(self.tokens, 0.0)
+        self.paused_until = max( self.paused_until, time.monotonic() + seconds )
+        logging.warning(f'[RateLimiter] - {self.name} rate limited upstream, pausing calls for {seconds:.2f}s')
+
+    def depth(self, priority: str) -> int:
+        return sum( 1 for waiter in self.queues[priority] if not waiter.done() )
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+
+        priority   = request_priority.get()
+        start_time = time.monotonic()
+        self.refill()
+        if not any( self.queues.values() ) and self.tokens >= 1 and start_time >= self.paused_until:
+            self.tokens -= 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self.queues[priority].append(waiter)
+            if self.dispatcher is None or self.dispatcher.done():
+                self.dispatcher = asyncio.ensure_future( self.dispatch() )
+            # a cancelled waiter (e.g. its request budget ran out) is simply skipped by the dispatcher
+            await waiter
+        RATE_LIMIT_WAIT.observe(time.monotonic() - start_time, provider = self.name, priority = priority)
+
+    def prune(self) -> bool:
+        # drop the waiters cancelled meanwhile, tells whether someone is still waiting
+        for queue in self.queues.values():
+            while queue and queue[0].done():
+                queue.popleft()
+        return any( self.queues.values() )
+
+    def next_queue(self) -> Deque[asyncio.Future]:
+        # weighted round robin: background work is slowed down by interactive calls, never starved by them
+        interactive, background = self.queues[INTERACTIVE], self.queues[BACKGROUND]
+        if interactive and (not background or self.streak < RATE_LIMIT_INTERACTIVE_WEIGHT):
+            self.streak += 1
+            return interactive
+        self.streak = 0
+        return background
+
+    async def dispatch(self):
+        while self.prune():
+            self.refill()
+            wait = max( self.paused_until - time.monotonic(), (1 - self.tokens) / self.rate if self.tokens < 1 else 0 )
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            waiter = self.next_queue().popleft()
+            if not waiter.done():
+                self.tokens -= 1
+                waiter.set_result(None)
+
+
+limiters: Dict[str, RateLimiter] = {}
+
+def get_limiter(provider: str) -> RateLimiter:
+    if provider not in limiters:
+        rate, burst        = RATE_LIMIT_DEFAULTS.get(provider, ( '0', '1' ))
+        limiters[provider] = RateLimiter(
+            name  = provider,
+            rate  = float( os.environ.get(f'RATE_LIMIT_{provider.upper()}_RATE', rate) ),
+            burst = int( os.environ.get(f'RATE_LIMIT_{provider.upper()}_BURST', burst) )
+        )
+    return limiters[provider]
+
+
+registry.register( Gauge(
+    'atlas_rate_limit_queue_depth', 'Upstream calls waiting for the provider rate limiter', [ 'provider', 'priority' ],
+    collect = lambda: {
+        (name, priority): limiter.depth(priority) for name, limiter in limiters.items() for priority in limiter.queues
+    }
+) )
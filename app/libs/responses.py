@@ -0,0 +1,175 @@
+import os
+import json
+import gzip
+import math
+import time
+import hashlib
+
+from pydantic            import BaseModel
+from typing              import Any, Awaitable, Callable, Dict, Iterable, Tuple, Type
+from fastapi.encoders    import jsonable_encoder
+from libs.cache          import CACHE_SOFT_TTL_RATIO, CacheEntry, NOT_FOUND, freshness, get_ttl, refresher
+from libs.metrics        import CACHE_REQUESTS
+from libs.offload        import offload
+from libs.singleflight   import SingleFlight
+from starlette.requests  import Request
+from starlette.responses import Response
+from starlette.status    import HTTP_304_NOT_MODIFIED
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# encoded response bodies, ready to be sent as they are, e.g. CACHE_TTL_RESPONSE=30m
+RESPONSE_CACHE_TTL      = get_ttl('response', '1h')
+RESPONSE_CACHE_SOFT_TTL = get_ttl('response', str( int(RESPONSE_CACHE_TTL * CACHE_SOFT_TTL_RATIO) ), 'CACHE_SOFT_TTL')
+# bodies built from already stale data (e.g. served while the upstream is down) are rebuilt much sooner
+RESPONSE_STALE_SOFT_TTL = get_ttl('response', '30s', 'CACHE_STALE_SOFT_TTL')
+# compressed variants are stored next to the plain body, in order of preference
+RESPONSE_ENCODINGS      = [ encoding.strip() for encoding in os.environ.get('RESPONSE_ENCODINGS', 'br,gzip').split(',') if encoding.strip() ]
+RESPONSE_MIN_COMPRESS   = int( os.environ.get('RESPONSE_MIN_COMPRESS', '1024') )
+RESPONSE_GZIP_LEVEL     = int( os.environ.get('RESPONSE_GZIP_LEVEL', '6') )
+RESPONSE_BROTLI_QUALITY = int( os.environ.get('RESPONSE_BROTLI_QUALITY', '5') )
+
+COMPRESSORS = {
+    'gzip': lambda content: gzip.compress(content, compresslevel = RESPONSE_GZIP_LEVEL),
+    'br':   lambda content: brotli.compress(content, quality = RESPONSE_BROTLI_QUALITY)
+}
+if brotli is None:
+    COMPRESSORS.pop('br')
+
+# concurrent misses of the same body validate and encode it once
+encodings_flight = SingleFlight('libs.responses:cached_response')
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        # dates, enums and str subclasses (e.g. HttpUrl) are all handled natively
+        return orjson.dumps(content)
+    return json.dumps( jsonable_encoder(content), separators = (',', ':') ).encode()
+
+def validate(response_model: Type[BaseModel], result: Any) -> BaseModel:
+    # providers build trusted models, this is the public boundary where they get validated, nested models included
+    if isinstance(result, BaseModel):
+        return response_model.parse_obj( result.dict() )
+    return response_model.parse_obj( response_model.construct(**result).dict() )
+
+def encode(content: bytes) -> Dict[str, bytes]:
+    # tiny bodies are not worth the compression, nor the cache space
+    variants = { 'identity': content }
+    if len(content) >= RESPONSE_MIN_COMPRESS:
+        for encoding in RESPONSE_ENCODINGS:
+            if encoding in COMPRESSORS:
+                variants[encoding] = COMPRESSORS[encoding](content)
+    return variants
+
+def make_etags(content: bytes, encodings: Iterable[str]) -> Dict[str, str]:
+    # strong validators: one per representation, all derived from the plain body
+    digest = hashlib.blake2b(content, digest_size = 16).hexdigest()
+    return { encoding: f'"{digest}"' if encoding == 'identity' else f'"{digest}-{encoding}"' for encoding in encodings }
+
+def etag_matches(if_none_match: str, etags: Iterable[str]) -> bool:
+    # If-None-Match uses the weak comparison, any representation of the same body is a match
+    if if_none_match.strip() == '*':
+        return True
+    tags = { tag.strip().removeprefix('W/') for tag in if_none_match.split(',') }
+    return any( etag in tags for etag in etags )
+
+def accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    encodings = {}
+    for item in accept_encoding.split(','):
+        encoding, _, params = item.strip().partition(';')
+        try:
+            quality = float( params.strip()[2:] ) if params.strip().startswith('q=') else 1.0
+        except ValueError:
+            quality = 0.0
+        if encoding:
+            encodings[encoding.strip().lower()] = quality
+    return encodings
+
+def make_response(request: Request, body: Dict) -> Response:
+    accepted = accepted_encodings( request.headers.get('Accept-Encoding', '') )
+    encoding = next(
+        (encoding for encoding in RESPONSE_ENCODINGS if encoding in body['variants'] and accepted.get(encoding, accepted.get('*', 0)) > 0),
+        'identity'
+    )
+    # Age is the one of the upstream data, the body is fresh as long as both itself and that data are
+    now     = time.time()
+    headers = {
+        'ETag':          body['etags'][encoding],
+        'Vary':          'Accept-Encoding',
+        'Age':           str( int( max(0, now - body['created']) ) ),
+        'Cache-Control': f'public, max-age={int( max(0, body["fresh_until"] - body["created"]) )}'
+    }
+    if body['stale']:
+        headers['Warning'] = '110 - "Response is Stale"'
+    if etag_matches( request.headers.get('If-None-Match', ''), body['etags'].values() ):
+        return Response(status_code = HTTP_304_NOT_MODIFIED, headers = headers)
+
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return Response(content = body['variants'][encoding], media_type = 'application/json', headers = headers)
+
+def render(response_model: Type[BaseModel], result: Any) -> Tuple[Dict[str, bytes], Dict[str, str]]:
+    # validation, serialization and compression: the whole CPU bill of a body, in one place to be offloaded
+    content  = dumps( validate(response_model, result).dict() )
+    variants = encode(content)
+    return variants, make_etags(content, variants)
+
+def payload_size(result: Any) -> int:
+    # episodes are what makes a body big
+    return sum( len(season.episodes or []) for season in getattr(result, 'seasons', None) or [] )
+
+def response_key(route: str, **params) -> str:
+    return f'response:{route}:' + ':'.join( f'{name}={value}' for name, value in params.items() )
+
+async def cached_response(
+    request:        Request,
+    key:            str,
+    response_model: Type[BaseModel],
+    produce:        Callable[[], Awaitable[Any]]
+) -> Response:
+    # Serve a route from its already encoded (and compressed) body: on a hit nothing is rebuilt nor serialized, and
+    # clients already holding it only get a 304. Soft-expired bodies are still served while they are rebuilt in
+    # background, as for noself_cache.
+    cache = request.state.cache
+
+    async def refresh() -> Dict:
+        # track how old, and for how long fresh, are the cached provider values the body is built from
+        now     = time.time()
+        tracked = [ now, math.inf ]
+        token   = freshness.set(tracked)
+        try:
+            result = await produce()
+        finally:
+            freshness.reset(token)
+
+        variants, etags = await offload('response', payload_size(result), render, response_model, result)
+        body            = {
+            'variants':    variants,
+            'etags':       etags,
+            'created':     tracked[0],
+            'fresh_until': min(tracked[1], now + RESPONSE_CACHE_SOFT_TTL),
+            'stale':       tracked[1] <= now
+        }
+        await cache.set(key, CacheEntry(body), expire = RESPONSE_CACHE_TTL)
+        return body
+
+    entry = await cache.get(key, default = NOT_FOUND)
+    if not isinstance(entry, CacheEntry):
+        CACHE_REQUESTS.inc(function = 'response', result = 'miss')
+        return make_response(request, await encodings_flight.do(key, refresh))
+
+    if entry.age >= (RESPONSE_STALE_SOFT_TTL if entry.value['stale'] else RESPONSE_CACHE_SOFT_TTL):
+        CACHE_REQUESTS.inc(function = 'response', result = 'stale')
+        refresher.schedule(key, refresh)
+    else:
+        CACHE_REQUESTS.inc(function = 'response', result = 'hit')
+    return make_response(request, entry.value)
@@ -0,0 +1,67 @@
+import os
+import time
+import random
+import email.utils
+
+from contextvars import ContextVar
+from typing      import Optional
+
+
+RETRY_MAX_RETRIES    = int( os.environ.get('RETRY_MAX_RETRIES', '6') )
+RETRY_BASE_DELAY     = float( os.environ.get('RETRY_BASE_DELAY', '0.5') )
+RETRY_MAX_DELAY      = float( os.environ.get('RETRY_MAX_DELAY', '8') )
+RETRY_REQUEST_BUDGET = float( os.environ.get('RETRY_REQUEST_BUDGET', '30') )
+
+# 429 and 503 may carry a Retry-After header, the others are plain transient gateway failures
+RETRYABLE_STATUS_CODES = { 429, 500, 502, 503, 504 }
+IDEMPOTENT_METHODS     = { 'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE' }
+
+# absolute (monotonic) deadline shared by every upstream call made on behalf of the same incoming request
+request_deadline: ContextVar[Optional[float]] = ContextVar('request_deadline', default = None)
+
+
+def start_request_budget(budget: float = None):
+    budget = RETRY_REQUEST_BUDGET if budget is None else budget
+    return request_deadline.set(time.monotonic() + budget if budget > 0 else None)
+
+def remaining_budget() -> Optional[float]:
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    # Ref: https://www.rfc-editor.org/rfc/rfc9110#field.retry-after
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_date.timestamp() - time.time())
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_retries: int   = RETRY_MAX_RETRIES,
+        base_delay:  float = RETRY_BASE_DELAY,
+        max_delay:   float = RETRY_MAX_DELAY
+    ):
+        self.max_retries = max_retries
+        self.base_delay  = base_delay
+        self.max_delay   = max_delay
+
+    def is_retryable(self, method: str, status_code: int = None, idempotent: bool = None) -> bool:
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        if not idempotent:
+            return False
+        # status_code is None for transport errors (connection reset, timeouts, ...)
+        return status_code is None or status_code in RETRYABLE_STATUS_CODES
+
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        # "full jitter" exponential backoff, the upstream hint always wins when it asks for more
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after) if retry_after is not None else delay
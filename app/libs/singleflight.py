@@ -0,0 +1,96 @@
+import asyncio
+import inspect
+import logging
+import functools
+import contextvars
+
+from typing         import Any, Awaitable, Callable, Dict, Optional
+from libs.metrics   import registry, Counter, Gauge
+from libs.ratelimit import INTERACTIVE, request_priority
+from libs.retry     import request_deadline
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name      = name
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self.contexts:  Dict[str, contextvars.Context] = {}
+        self.calls     = 0
+        self.leaders   = 0
+        self.collapsed = 0
+
+    async def do(self, key: str, func: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        self.calls += 1
+        task = self.in_flight.get(key)
+        if task:
+            self.collapsed += 1
+            logging.debug(f'[SingleFlight] - Joining in-flight call: {key}')
+            self.contexts[key].run(self.join, request_deadline.get(), request_priority.get())
+        else:
+            self.leaders += 1
+            # a context of its own, not a copy of the first caller's one: only its budget and priority are taken,
+            # for every waiter joining later to extend them
+            context = contextvars.Context()
+            context.run(request_deadline.set, request_deadline.get())
+            context.run(request_priority.set, request_priority.get())
+            task    = asyncio.get_running_loop().create_task( func(*args, **kwargs), context = context )
+            self.in_flight[key], self.contexts[key] = task, context
+            task.add_done_callback( functools.partial(self.land, key) )
+        # the shared task must survive the cancellation of any single waiter (e.g. a client disconnecting)
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def join(deadline: Optional[float], priority: str):
+        # runs in the shared call's context (never while it is running): the most generous budget and priority win
+        current = request_deadline.get()
+        if current is not None and (deadline is None or deadline > current):
+            request_deadline.set(deadline)
+        if priority == INTERACTIVE:
+            request_priority.set(INTERACTIVE)
+
+    def land(self, key: str, task: asyncio.Task):
+        self.in_flight.pop(key, None)
+        self.contexts.pop(key, None)
+        # retrieved even when every waiter went away meanwhile, no "Task exception was never retrieved"
+        task.cancelled() or task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'calls':     self.calls,
+            'leaders':   self.leaders,
+            'collapsed': self.collapsed,
+            'in_flight': len(self.in_flight)
+        }
+
+
+groups: Dict[str, SingleFlight] = {}
+
+def get_key(signature: inspect.Signature, *args, **kwargs) -> str:
+    # same arguments the cache keys on: self is skipped, defaults are applied
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    return ':'.join(f'{name}={value}' for name, value in list(bound.arguments.items())[1:])
+
+def single_flight(func: Callable[..., Awaitable]):
+    name      = f'{func.__module__}:{func.__qualname__}'
+    group     = groups.setdefault(name, SingleFlight(name))
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await group.do(get_key(signature, *args, **kwargs), func, *args, **kwargs)
+
+    return wrapper
+
+def stats() -> Dict[str, Dict[str, int]]:
+    return { name: group.stats() for name, group in groups.items() }
+
+
+registry.register( Gauge(
+    'atlas_single_flight_in_flight', 'Upstream lookups currently in flight', [ 'function' ],
+    collect = lambda: { (name,): len(group.in_flight) for name, group in groups.items() }
+) )
+registry.register( Counter(
+    'atlas_single_flight_collapsed_total', 'Lookups that joined an identical in-flight one', [ 'function' ],
+    collect = lambda: { (name,): group.collapsed for name, group in groups.items() }
+) )
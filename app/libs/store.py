@@ -0,0 +1,294 @@
+import os
+import time
+import json
+import sqlite3
+import asyncio
+import logging
+import threading
+
+from datetime           import date
+from cashews.ttl        import ttl_to_seconds
+from concurrent.futures import ThreadPoolExecutor
+from typing             import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple, Type, Union
+from libs.models        import BatchDetailsItem, Episode, MediaType, Movie, Season, Show, SupportedProviders
+from libs.cache         import freshness, note_freshness
+from libs.metrics       import registry, Counter
+from libs.responses     import dumps
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# movies and shows as the providers last returned them, on disk: detail lookups are served from here first, the
+# providers being the fallback (and the source of write-through updates). Empty: no store at all.
+METADATA_STORE_PATH    = os.environ.get('METADATA_STORE_PATH', 'metadata.sqlite3')
+# older records are not served anymore, they get fetched again (changes not announced by any feed are caught up)
+METADATA_STORE_MAX_AGE = ttl_to_seconds( os.environ.get('METADATA_STORE_MAX_AGE', '7d') )
+METADATA_STORE_THREADS = int( os.environ.get('METADATA_STORE_THREADS', '2') )
+# how long a write waits for another process (worker, ingestion job) holding the database lock
+METADATA_STORE_TIMEOUT = float( os.environ.get('METADATA_STORE_TIMEOUT', '10') )
+
+# WITHOUT ROWID: records are clustered by their primary key, a show is a single range scan per table
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS movies (
+    source TEXT NOT NULL, id INTEGER NOT NULL, stored REAL NOT NULL, body BLOB NOT NULL,
+    PRIMARY KEY (source, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS shows (
+    source TEXT NOT NULL, id INTEGER NOT NULL, stored REAL NOT NULL, with_episodes INTEGER NOT NULL, body BLOB NOT NULL,
+    PRIMARY KEY (source, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS seasons (
+    source TEXT NOT NULL, show_id INTEGER NOT NULL, number INTEGER NOT NULL, body BLOB NOT NULL,
+    PRIMARY KEY (source, show_id, number)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS episodes (
+    source TEXT NOT NULL, show_id INTEGER NOT NULL, id INTEGER NOT NULL, season INTEGER NOT NULL, position INTEGER NOT NULL,
+    body BLOB NOT NULL,
+    PRIMARY KEY (source, show_id, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT NOT NULL PRIMARY KEY, value TEXT
+) WITHOUT ROWID;
+'''
+# bumped whenever SCHEMA changes, older databases get what changed dropped
+SCHEMA_VERSION = 1
+MIGRATIONS     = {
+    # episodes were keyed by number, dropping those sharing it (specials, double episodes): fetched again
+    1: 'DROP TABLE IF EXISTS episodes; UPDATE shows SET with_episodes = 0;'
+}
+
+STORE_LOOKUPS = registry.register( Counter(
+    'atlas_store_lookups_total', 'Detail lookups in the local metadata store by result (hit, miss, stale, error)', [ 'type', 'result' ]
+) )
+
+Media  = Union[Movie, Show]
+# what gets stored: the record, and when the oldest provider value it was built from was created
+Record = Tuple[BatchDetailsItem, Media, float]
+
+
+def loads(body: bytes) -> Dict:
+    return orjson.loads(body) if orjson is not None else json.loads(body)
+
+def restore(model: Type, body: bytes, **fields):
+    # stored from already normalized models: rebuilt without validation, the API validates them on the way out anyway
+    values = loads(body) | fields
+    if values.get('airdate'):
+        values['airdate'] = date.fromisoformat(values['airdate'])
+    return model.construct(**values)
+
+async def tracked(produce: Callable[[], Awaitable[Media]]) -> Tuple[Media, float, float]:
+    # the result, how old are the cached provider values it is built from, and until when they are fresh
+    # (see libs.cache.noself_cache): values served stale or as a fallback are not worth storing
+    now     = time.time()
+    values  = [ now, float('inf') ]
+    token   = freshness.set(values)
+    try:
+        result = await produce()
+    finally:
+        freshness.reset(token)
+    return result, values[0], values[1]
+
+
+class MetadataStore:
+    # One SQLite database shared by every worker and by the ingestion job (WAL: readers never wait for the writer).
+    # Calls are blocking, the async ones run them in a small thread pool with a connection per thread.
+    def __init__(self, path: str = METADATA_STORE_PATH, max_age: float = METADATA_STORE_MAX_AGE):
+        self.path     = path
+        self.max_age  = max_age
+        self.local    = threading.local()
+        self.executor = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            # autocommit: transactions are opened explicitly, reads do not hold any
+            connection = sqlite3.connect(self.path, timeout = METADATA_STORE_TIMEOUT, isolation_level = None, check_same_thread = False)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            self.migrate(connection)
+            self.local.connection = connection
+        return connection
+
+    @staticmethod
+    def migrate(connection: sqlite3.Connection):
+        version, = connection.execute('PRAGMA user_version').fetchone()
+        if version >= SCHEMA_VERSION:
+            return
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # another process may have been quicker, and the very first schema had no version (0) either
+            version, = connection.execute('PRAGMA user_version').fetchone()
+            existing = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'shows'").fetchone()
+            if existing and version < SCHEMA_VERSION:
+                for step in range(version + 1, SCHEMA_VERSION + 1):
+                    for statement in MIGRATIONS.get(step, '').split(';'):
+                        if statement.strip():
+                            connection.execute(statement)
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    connection.execute(statement)
+            connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def get(self, item: BatchDetailsItem) -> Tuple[Optional[Media], float]:
+        # the record, if any, and when it was created
+        db     = self.connection()
+        source = SupportedProviders(item.source).value
+        if item.type == MediaType.MOVIE:
+            row = db.execute('SELECT stored, body FROM movies WHERE source = ? AND id = ?', (source, item.id)).fetchone()
+            if row is None:
+                return None, 0.0
+            return restore(Movie, row[1]), row[0]
+
+        row = db.execute('SELECT stored, with_episodes, body FROM shows WHERE source = ? AND id = ?', (source, item.id)).fetchone()
+        # a show stored without its episodes is no answer to a request for them
+        if row is None or (item.with_episodes and not row[1]):
+            return None, 0.0
+        episodes = {}
+        if item.with_episodes:
+            for season, body in db.execute('SELECT season, body FROM episodes WHERE source = ? AND show_id = ? ORDER BY season, position', (source, item.id)):
+                episodes.setdefault(season, []).append( restore(Episode, body) )
+        seasons = [
+            restore(Season, body, episodes = episodes.get(number, []))
+            for number, body in db.execute('SELECT number, body FROM seasons WHERE source = ? AND show_id = ? ORDER BY number', (source, item.id))
+        ]
+        return restore(Show, row[2], seasons = seasons), row[0]
+
+    def put(self, records: Iterable[Record]):
+        # all in one transaction: a show is never half written, and bulk loads pay a single commit. Records are
+        # dated as the provider values they come from, not as the time they are written.
+        db  = self.connection()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            for item, media, stored in records:
+                source = SupportedProviders(item.source).value
+                if item.type == MediaType.MOVIE:
+                    db.execute('INSERT OR REPLACE INTO movies VALUES (?, ?, ?, ?)', (source, item.id, stored, dumps( media.dict() )))
+                    continue
+                if not item.with_episodes:
+                    # a fresh record with the episodes already holds everything this one has
+                    previous = db.execute('SELECT stored, with_episodes FROM shows WHERE source = ? AND id = ?', (source, item.id)).fetchone()
+                    if previous and previous[1] and previous[0] >= stored and now - previous[0] < self.max_age:
+                        continue
+                db.execute('DELETE FROM episodes WHERE source = ? AND show_id = ?', (source, item.id))
+                # keyed by id, in the order they came: numbers are not unique within a season
+                db.executemany('INSERT OR REPLACE INTO episodes VALUES (?, ?, ?, ?, ?, ?)', [
+                    (source, item.id, episode.source_id, season.number, position, dumps( episode.dict() ))
+                    for season in media.seasons for position, episode in enumerate(season.episodes)
+                ])
+                db.execute('DELETE FROM seasons WHERE source = ? AND show_id = ?', (source, item.id))
+                db.executemany('INSERT INTO seasons VALUES (?, ?, ?, ?)', [
+                    (source, item.id, season.number, dumps( season.dict(exclude = { 'episodes' }) )) for season in media.seasons
+                ])
+                db.execute('INSERT OR REPLACE INTO shows VALUES (?, ?, ?, ?, ?)', (
+                    source, item.id, stored, item.with_episodes, dumps( media.dict(exclude = { 'seasons' }) )
+                ))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def forget(self, source: SupportedProviders, type: MediaType, ids: Iterable[int]):
+        # records changed upstream: ageing them is enough, the next lookup fetches them again
+        db    = self.connection()
+        table = 'movies' if type == MediaType.MOVIE else 'shows'
+        db.executemany(f'UPDATE {table} SET stored = 0 WHERE source = ? AND id = ?', [ (SupportedProviders(source).value, id) for id in ids ])
+
+    def known(self, source: SupportedProviders, type: MediaType, ids: Iterable[int], fresh: bool = False) -> Set[int]:
+        # which of the ids are stored (and still fresh, optionally)
+        db      = self.connection()
+        table   = 'movies' if type == MediaType.MOVIE else 'shows'
+        ids     = list(ids)
+        known   = set()
+        horizon = time.time() - self.max_age if fresh else -1
+        # in batches, SQLite caps the number of parameters of a statement
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            known.update( id for id, in db.execute(
+                f'SELECT id FROM {table} WHERE source = ? AND stored > ? AND id IN ({",".join("?" * len(batch))})',
+                (SupportedProviders(source).value, horizon, *batch)
+            ) )
+        return known
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.connection().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        self.connection().execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    def count(self) -> Dict[Tuple[str, str], int]:
+        # full scans: for the ingestion job, not for the metrics endpoint
+        counts = {}
+        for table, type in [ ('movies', MediaType.MOVIE), ('shows', MediaType.SERIES) ]:
+            for source, total in self.connection().execute(f'SELECT source, COUNT(*) FROM {table} GROUP BY source'):
+                counts[ (source, type.value) ] = total
+        return counts
+
+    async def run(self, function, *args):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers = METADATA_STORE_THREADS, thread_name_prefix = 'store')
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def read(self, item: BatchDetailsItem) -> Optional[Media]:
+        # never in the way: a broken store just means going upstream
+        if not self.enabled:
+            return None
+        try:
+            media, stored = await self.run(self.get, item)
+        except Exception as e:
+            STORE_LOOKUPS.inc(type = item.type.value, result = 'error')
+            logging.warning(f'[MetadataStore] - Lookup of {item.source.value} {item.type.value} {item.id} failed: {e!r}')
+            return None
+        fresh = time.time() - stored < self.max_age
+        STORE_LOOKUPS.inc(type = item.type.value, result = 'miss' if media is None else 'hit' if fresh else 'stale')
+        if media is None or not fresh:
+            return None
+        # cached responses built from it are as old as the record, and fresh only as long as it is
+        note_freshness(stored, self.max_age)
+        return media
+
+    async def fetch(self, item: BatchDetailsItem, produce: Callable[[], Awaitable[Media]]) -> Media:
+        # write-through of what the providers returned, unless it came from stale cached values (e.g. a fallback
+        # while the upstream is down): stored, it would look fresh for another METADATA_STORE_MAX_AGE
+        result, created, fresh_until = await tracked(produce)
+        note_freshness(created, fresh_until - created)
+        if fresh_until > time.time():
+            await self.write([ (item, result, created) ])
+        return result
+
+    async def write(self, records: List[Record]):
+        if not self.enabled or not records:
+            return
+        try:
+            await self.run(self.put, records)
+        except Exception as e:
+            logging.warning(f'[MetadataStore] - Could not store {len(records)} records: {e!r}')
+
+    async def open(self):
+        # the database is created on first use, e.g. during the warm-up
+        if self.enabled:
+            await self.run(self.connection)
+
+    async def expire(self, source: SupportedProviders, type: MediaType, ids: Iterable[int]):
+        if self.enabled:
+            await self.run(self.forget, source, type, list(ids))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait = True)
+            self.executor = None
+
+
+store = MetadataStore()
@@ -1,18 +1,30 @@
 import os
-import jq
 import httpx
 import asyncio
 import logging
-import dateparser
 
-from fastapi          import HTTPException
-from typing           import Dict, List
-from pydantic         import HttpUrl
-from pydantic.tools   import parse_obj_as
-from cashews          import noself_cache
-from libs.utils       import async_ext_api_call
-from libs.models      import Episode, MediaType, Media, Movie, SearchResult, Show, Season, MovieStatus, ShowStatus
-from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
+from math              import ceil
+from fastapi           import HTTPException
+from typing            import Callable, Dict, List, Optional, Tuple
+from pydantic          import HttpUrl
+from pydantic.tools    import parse_obj_as
+from libs.cache        import noself_cache, versioned
+from libs.utils        import SEARCH_DEFAULT_LIMIT, async_ext_api_call, conditional_api_call, fetch_pages
+from libs.dates        import parse_date
+from libs.languages    import TMDB_LANGUAGES, localized_fetch, merge_localized
+from libs.singleflight import single_flight
+from libs.offload      import offload
+from libs.index        import indexed
+from libs.models       import Episode, MediaType, Movie, SearchResult, Show, Season, MovieStatus, ShowStatus, SupportedProviders
+from starlette.status  import HTTP_422_UNPROCESSABLE_ENTITY
+
+
+TMDB_SEARCH_PAGE_SIZE   = 20
+TMDB_SEARCH_MAX_PAGES   = int( os.environ.get('TMDB_SEARCH_MAX_PAGES', '5') )
+TMDB_SEARCH_CONCURRENCY = int( os.environ.get('TMDB_SEARCH_CONCURRENCY', '3') )
+
+# a season is good enough in a language once all its episodes have a name there, and this share of them an overview
+TMDB_SEASON_MIN_OVERVIEWS = float( os.environ.get('TMDB_SEASON_MIN_OVERVIEWS', '0.5') )
 
 
 class TMDBClient:
@@ -20,7 +32,7 @@ class TMDBClient:
 
     def __init__(self, http_client: httpx.AsyncClient):
         # Ref: https://developers.themoviedb.org/3 (v3)
-        self.api_url     = 'https://api.themoviedb.org/3'
+        self.api_url     = os.environ.get('TMDB_API_URL', 'https://api.themoviedb.org/3').rstrip('/')
         self.api_key     = os.environ.get('TMDB_API_KEY')
         self.api_headers = {
             'Accept':          'application/json',
@@ -29,6 +41,7 @@ class TMDBClient:
         self.http_client = http_client
 
     @noself_cache(ttl = "1d")
+    @single_flight
     async def __get_configs(self) -> Dict:
         api_endpoint = f'/configuration'
         response = await async_ext_api_call(
@@ -43,16 +56,16 @@ class TMDBClient:
         )
         return {"images": response["images"]}
 
-    @noself_cache(ttl = "1d")
-    async def do_search(self, query: str, type: MediaType = None) -> SearchResult:
-        async def do_search_by_type(query: str, type: MediaType, language: str = 'it-IT', page: int = 1) -> List:
-            if not type in [MediaType.MOVIE, MediaType.SERIES]:
-                detail = '[TMDB] - Unsupported media type requested.'
-                logging.error(detail)
-                raise HTTPException(status_code = HTTP_422_UNPROCESSABLE_ENTITY, detail = detail)
+    async def warm_up(self):
+        # every mapping needs the images configuration, loaded before the first request does
+        await self.__get_configs()
 
+    @noself_cache(ttl = "1d")
+    @single_flight
+    async def do_search(self, query: str, type: MediaType = None, page: int = 1, limit: int = SEARCH_DEFAULT_LIMIT) -> SearchResult:
+        async def get_search_page(type: MediaType, language: str, page: int) -> Dict:
             api_endpoint = f'/search/{"movie" if type == MediaType.MOVIE else "tv"}'
-            response = await async_ext_api_call(
+            return await async_ext_api_call(
                 http_client = self.http_client,
                 url         = parse_obj_as(HttpUrl, self.api_url + api_endpoint),
                 method      = httpx.AsyncClient.get,
@@ -66,37 +79,64 @@ class TMDBClient:
                     'include_adult': False
                 }
             )
-            if page == 1 and response["total_results"] == 0 and language != 'en-US':
-                return await do_search_by_type(query = query, type = type, language = 'en-US', page = page)
-
-            search_result = []
-            api_configs   = await self.__get_configs()
-            for item in response["results"]:
-                media = Media(
-                    guid       = f'tvdb://{type.value}/{item["id"]}',
-                    source_id  = item["id"],
-                    source_url = parse_obj_as(HttpUrl,  f'{self.source_base_url}{"movie" if type == MediaType.MOVIE else "tv"}{item["id"]}'),
-                    title      = item["title"]          if type == MediaType.MOVIE  and item["title"]          else \
-                                 item["original_title"] if type == MediaType.MOVIE  and item["original_title"] else \
-                                 item["name"]           if type == MediaType.SERIES and item["name"]           else \
-                                 item["original_name"]  if type == MediaType.SERIES and item["original_name"]  else None,
-                    overview   = item["overview"]       if item["overview"]        else None,
-                    image      = parse_obj_as(HttpUrl,  f'{api_configs["images"]["secure_base_url"]}{api_configs["images"]["poster_sizes"][-1]}{item["poster_path"]}') \
-                                 if item["poster_path"] else None,
-                    airdate    = dateparser.parse(item["release_date"]).date()   if type == MediaType.MOVIE  and item["release_date"]   else \
-                                 dateparser.parse(item["first_air_date"]).date() if type == MediaType.SERIES and item["first_air_date"] else None
-                )
-                if   type == MediaType.MOVIE:
-                    search_result.append( Movie( **media.dict() ) )
-                elif type == MediaType.SERIES:
-                    search_result.append( Show( **media.dict() ) )
-
-            if page == 1 and int(response["total_pages"]) > 1:
-                requests      = [do_search_by_type(query = query, type = type, language = language, page = i) for i in range(2, int(response["total_pages"]) + 1)]
-                all_pages     = await asyncio.gather(*requests)
-                search_result = search_result + [item for single_page in all_pages for item in single_page]
-
-            return search_result
+
+        async def do_search_by_type(query: str, type: MediaType) -> List:
+            if not type in [MediaType.MOVIE, MediaType.SERIES]:
+                detail = '[TMDB] - Unsupported media type requested.'
+                logging.error(detail)
+                raise HTTPException(status_code = HTTP_422_UNPROCESSABLE_ENTITY, detail = detail)
+
+            # map the requested window of results onto TMDB pages, never going past the upstream pages ceiling
+            first_result = (page - 1) * limit
+            first_page   = first_result // TMDB_SEARCH_PAGE_SIZE + 1
+            last_page    = min( ceil( (first_result + limit) / TMDB_SEARCH_PAGE_SIZE ), first_page + TMDB_SEARCH_MAX_PAGES - 1 )
+
+            # the first language with any result wins, the following pages are fetched in that language only
+            responses = await localized_fetch(
+                fetch       = lambda language: get_search_page(type, language, first_page),
+                languages   = TMDB_LANGUAGES,
+                is_complete = lambda search_page: search_page["total_results"] > 0
+            )
+            language, response = next(
+                ( (language, search_page) for language, search_page in responses.items() if search_page and search_page["total_results"] > 0 ),
+                next( (language, search_page) for language, search_page in responses.items() if search_page )
+            )
+
+            api_configs = await self.__get_configs()
+
+            async def parse_search_page(page: int) -> List:
+                search_page   = response if page == first_page else await get_search_page(type, language, page)
+                search_result = []
+                for item in search_page["results"]:
+                    media = dict(
+                        guid       = f'tvdb://{type.value}/{item["id"]}',
+                        source_id  = item["id"],
+                        source_url = f'{self.source_base_url}{"movie" if type == MediaType.MOVIE else "tv"}{item["id"]}',
+                        title      = item["title"]          if type == MediaType.MOVIE  and item["title"]          else \
+                                     item["original_title"] if type == MediaType.MOVIE  and item["original_title"] else \
+                                     item["name"]           if type == MediaType.SERIES and item["name"]           else \
+                                     item["original_name"]  if type == MediaType.SERIES and item["original_name"]  else None,
+                        overview   = item["overview"]       if item["overview"]        else None,
+                        image      = f'{api_configs["images"]["secure_base_url"]}{api_configs["images"]["poster_sizes"][-1]}{item["poster_path"]}' \
+                                     if item["poster_path"] else None,
+                        airdate    = parse_date(item["release_date"])   if type == MediaType.MOVIE  and item["release_date"]   else \
+                                     parse_date(item["first_air_date"]) if type == MediaType.SERIES and item["first_air_date"] else None
+                    )
+                    # the original title too, for the local index
+                    aliases = [ item.get("original_title") if type == MediaType.MOVIE else item.get("original_name") ]
+                    if   type == MediaType.MOVIE:
+                        search_result.append( indexed(SupportedProviders.THE_MOVIE_DB, Movie.construct( **media ), aliases) )
+                    elif type == MediaType.SERIES:
+                        search_result.append( indexed(SupportedProviders.THE_MOVIE_DB, Show.construct( **media ), aliases) )
+                return search_result
+
+            offset        = first_result - (first_page - 1) * TMDB_SEARCH_PAGE_SIZE
+            search_result = await fetch_pages(
+                fetch_page  = parse_search_page,
+                pages       = range( first_page, min(last_page, int(response["total_pages"])) + 1 ),
+                concurrency = TMDB_SEARCH_CONCURRENCY
+            )
+            return search_result[offset:offset + limit]
 
         if not type:
             results = await asyncio.gather(*[
@@ -113,107 +153,144 @@ class TMDBClient:
             'series': await do_search_by_type(query = query, type = type) if type == MediaType.SERIES else []
         }
 
-    @noself_cache(ttl = "1d")
-    async def get_movie(self, id: int, language: str = 'it-IT') -> Movie:
-        api_endpoint = f'/movie/{id}'
-        response = await async_ext_api_call(
-            http_client = self.http_client,
-            url         = parse_obj_as(HttpUrl, self.api_url + api_endpoint),
-            method      = httpx.AsyncClient.get,
-            caller      = "TMDB",
-            headers     = self.api_headers,
-            params      = {
-                'api_key':  self.api_key,
-                'language': language
-            }
-        )
-        api_configs    = await self.__get_configs()
-        return Movie(
-            guid       = f'tvdb://movie/{response["id"]}',
-            source_id  = int(response["id"]),
-            source_url = parse_obj_as(HttpUrl, f'{self.source_base_url}movie/{response["id"]}'),
-            title      = response["title"]           if response["title"]          else \
-                         response["original_title"]  if response["original_title"] else None,
-            overview   = response["overview"]        if response["overview"]       else None,
-            image      = parse_obj_as(HttpUrl,  f'{api_configs["images"]["secure_base_url"]}{api_configs["images"]["poster_sizes"][-1]}{response["poster_path"]}') \
-                         if response["poster_path"]  else None,
-            airdate    = dateparser.parse(response["release_date"]).date()  if   response["release_date"] else None,
-            runtime    = int(response["runtime"])    if response["runtime"] else None,
-            status     = MovieStatus.RUMORED         if response["status"] == 'Rumored'         else \
-                         MovieStatus.ANNOUNCED       if response["status"] == 'Planned'         else \
-                         MovieStatus.PRE_PRODUCTION  if response["status"] == 'In Production'   else \
-                         MovieStatus.POST_PRODUCTION if response["status"] == 'Post Production' else \
-                         MovieStatus.RELEASED        if response["status"] == 'Released'        else \
-                         MovieStatus.CANCELED        if response["status"] == 'Canceled'        else None
-        )
+    async def get_localized(self, api_endpoint: str, is_complete: Callable[[Dict], bool]) -> Tuple[List[Dict], List[Optional[str]]]:
+        # the same resource in every configured language needed to fill it, by priority (None where it failed),
+        # along with the upstream version of each of them
+        versions = {}
 
-    @noself_cache(ttl = "1d")
-    async def get_show(self, id: int, language: str = 'it-IT', with_episodes: bool = False) -> Show:
-        async def get_episodes(show_id: int, number: int, language: str, api_configs: dict = None) -> List[Episode]:
-            api_endpoint = f'/tv/{show_id}/season/{number}'
-            response = await async_ext_api_call(
+        async def get_language(language: str) -> Dict:
+            response, versions[language] = await conditional_api_call(
                 http_client = self.http_client,
                 url         = parse_obj_as(HttpUrl, self.api_url + api_endpoint),
                 method      = httpx.AsyncClient.get,
                 caller      = "TMDB",
+                cache_key   = f'{api_endpoint}:{language}',
                 headers     = self.api_headers,
                 params      = {
                     'api_key':  self.api_key,
                     'language': language
                 }
             )
-            # ensure episodes are ordered by number
-            response["episodes"] = sorted( response["episodes"], key = lambda ep: int(ep["episode_number"]) )
+            return response
+
+        responses = await localized_fetch(fetch = get_language, languages = TMDB_LANGUAGES, is_complete = is_complete)
+        return list( responses.values() ), [ versions.get(language) for language in responses ]
+
+    @noself_cache(ttl = "1d")
+    @single_flight
+    async def get_movie(self, id: int) -> Movie:
+        responses, versions = await self.get_localized(
+            api_endpoint = f'/movie/{id}',
+            is_complete  = lambda movie: movie["title"] and movie["overview"]
+        )
+        api_configs = await self.__get_configs()
+
+        def to_movie() -> Movie:
+            response = merge_localized(responses, ['title', 'overview'])
+            return indexed(SupportedProviders.THE_MOVIE_DB, Movie.construct(
+                guid       = f'tvdb://movie/{response["id"]}',
+                source_id  = int(response["id"]),
+                source_url = f'{self.source_base_url}movie/{response["id"]}',
+                title      = response["title"]           if response["title"]          else \
+                             response["original_title"]  if response["original_title"] else None,
+                overview   = response["overview"]        if response["overview"]       else None,
+                image      = f'{api_configs["images"]["secure_base_url"]}{api_configs["images"]["poster_sizes"][-1]}{response["poster_path"]}' \
+                             if response["poster_path"]  else None,
+                airdate    = parse_date(response["release_date"]) if response["release_date"] else None,
+                runtime    = int(response["runtime"])    if response["runtime"] else None,
+                status     = MovieStatus.RUMORED         if response["status"] == 'Rumored'         else \
+                             MovieStatus.ANNOUNCED       if response["status"] == 'Planned'         else \
+                             MovieStatus.PRE_PRODUCTION  if response["status"] == 'In Production'   else \
+                             MovieStatus.POST_PRODUCTION if response["status"] == 'Post Production' else \
+                             MovieStatus.RELEASED        if response["status"] == 'Released'        else \
+                             MovieStatus.CANCELED        if response["status"] == 'Canceled'        else None
+            ), self.aliases(responses, 'title') )
+
+        # images are built from the configuration too
+        images = f'{api_configs["images"]["secure_base_url"]}{api_configs["images"]["poster_sizes"][-1]}'
+        return await versioned('TMDBClient.get_movie', str(id), versions + [ images ], to_movie)
+
+    @staticmethod
+    def season_is_complete(season: Dict) -> bool:
+        # one untranslated overview is the norm on a real season, not a reason to fetch it again in every fallback
+        episodes = season["episodes"]
+        return all( episode["name"] for episode in episodes ) and \
+               sum( 1 for episode in episodes if episode["overview"] ) >= TMDB_SEASON_MIN_OVERVIEWS * len(episodes)
+
+    @staticmethod
+    def aliases(responses: List[Dict], field: str) -> List[str]:
+        # the title in every language fetched, and the original one, for the local index
+        return [ variant.get(field) for variant in responses if variant ] + \
+               [ variant.get(f'original_{field}') for variant in responses if variant ]
+
+    @classmethod
+    def parse_episodes(cls, show_id: int, number: int, responses: List[Dict], api_configs: Dict) -> List[Episode]:
+        # translations are merged episode by episode, matching them by id
+        variants = [ { episode["id"]: episode for episode in variant["episodes"] } for variant in responses if variant ]
+        response = dict( next( variant for variant in responses if variant ) ) # a copy, upstream bodies may be cached
+        response["episodes"] = [
+            merge_localized([ variant.get(episode["id"]) for variant in variants ], ['name', 'overview']) for episode in response["episodes"]
+        ]
+        # ensure episodes are ordered by number
+        response["episodes"] = sorted( response["episodes"], key = lambda ep: int(ep["episode_number"]) )
 
+        episodes      = []
+        episode_count = 1
+        for episode in response["episodes"]:
+            episodes.append( Episode.construct(
+                guid       = f'tvdb://series/{show_id}/episodes/{episode["id"]}',
+                source_id  = episode["id"],
+                source_url = f'{cls.source_base_url}tv/{show_id}/season/{number}/{episode["episode_number"]}' \
+                             if "episode_number" in episode   and episode["episode_number"]       else None,
+                title      = episode["name"]     if "name"     in episode and episode["name"]     else None,
+                overview   = episode["overview"] if "overview" in episode and episode["overview"] else None,
+                image      = f'{api_configs["images"]["secure_base_url"]}{api_configs["images"]["still_sizes"][-1]}{episode["still_path"]}' \
+                             if "still_path" in episode  and episode["still_path"] else None,
+                airdate    = parse_date(response["air_date"]) \
+                             if "air_date"   in response and response["air_date"]  else None,
+                number     = episode_count,
+                runtime    = int(episode["runtime"]) if "runtime" in episode and episode["runtime"] else None
+            ) )
+            episode_count += 1
+
+        return episodes
+
+    @noself_cache(ttl = "1d")
+    @single_flight
+    async def get_show(self, id: int, with_episodes: bool = False) -> Show:
+        async def get_episodes(show_id: int, number: int, api_configs: dict = None) -> List[Episode]:
+            responses, _ = await self.get_localized(
+                api_endpoint = f'/tv/{show_id}/season/{number}',
+                is_complete  = self.season_is_complete
+            )
             if not api_configs:
                 api_configs = await self.__get_configs()
+            # every variant gets merged and mapped: big seasons are done off the event loop
+            return await offload(
+                'tmdb:episodes', sum( len(variant["episodes"]) for variant in responses if variant ),
+                self.parse_episodes, show_id, number, responses, api_configs
+            )
 
-            episodes      = []
-            episode_count = 1
-            for episode in response["episodes"]:
-                episodes.append( Episode(
-                    guid       = f'tvdb://series/{show_id}/episodes/{episode["id"]}',
-                    source_id  = episode["id"],
-                    source_url = parse_obj_as(HttpUrl, f'{self.source_base_url}tv/{show_id}/season/{number}/{episode["episode_number"]}') \
-                                 if "episode_number" in episode   and episode["episode_number"]       else None,
-                    title      = episode["name"]     if "name"     in episode and episode["name"]     else None,
-                    overview   = episode["overview"] if "overview" in episode and episode["overview"] else None,
-                    image      = parse_obj_as(HttpUrl,  f'{api_configs["images"]["secure_base_url"]}{api_configs["images"]["still_sizes"][-1]}{episode["still_path"]}') \
-                                 if "still_path" in episode  and episode["still_path"] else None,
-                    airdate    = dateparser.parse(response["air_date"]).date() \
-                                 if "air_date"   in response and response["air_date"]  else None,
-                    number     = episode_count,
-                    runtime    = int(episode["runtime"]) if "runtime" in episode and episode["runtime"] else None
-                ) )
-                episode_count += 1
-
-            return episodes
-
-        api_endpoint = f'/tv/{id}'
-        response = await async_ext_api_call(
-            http_client = self.http_client,
-            url         = parse_obj_as(HttpUrl, self.api_url + api_endpoint),
-            method      = httpx.AsyncClient.get,
-            caller      = "TMDB",
-            headers     = self.api_headers,
-            params      = {
-                'api_key':  self.api_key,
-                'language': language
-            }
+        responses, _ = await self.get_localized(
+            api_endpoint = f'/tv/{id}',
+            is_complete  = lambda show: show["name"] and show["overview"]
         )
+        variants    = [ { season["season_number"]: season for season in variant["seasons"] } for variant in responses if variant ]
+        response    = merge_localized(responses, ['name', 'overview'])
         api_configs = await self.__get_configs()
 
         seasons = []
         for season in response["seasons"]:
-            seasons.append( Season(
+            season = merge_localized([ variant.get(season["season_number"]) for variant in variants ], ['name', 'overview'])
+            seasons.append( Season.construct(
                 guid       = f'tvdb://series/{id}/seasons/{season["id"]}',
                 source_id  = int(season["id"])  if "id" in season and season["id"]             else None,
-                source_url = parse_obj_as(HttpUrl, f'{self.source_base_url}tv/{id}/season/{season["season_number"]}'),
+                source_url = f'{self.source_base_url}tv/{id}/season/{season["season_number"]}',
                 title      = season["name"]     if "name" in season and season["name"]         else None,
                 overview   = season["overview"] if "overview" in season and season["overview"] else None,
-                image      = parse_obj_as(HttpUrl, f'{api_configs["images"]["secure_base_url"]}{api_configs["images"]["poster_sizes"][-1]}{season["poster_path"]}') \
+                image      = f'{api_configs["images"]["secure_base_url"]}{api_configs["images"]["poster_sizes"][-1]}{season["poster_path"]}' \
                             if "poster_path"    in season and season["poster_path"]            else None,
-                airdate    = dateparser.parse(season["air_date"]).date() \
+                airdate    = parse_date(season["air_date"]) \
                             if "air_date"       in season and season["air_date"]               else None,
                 number     = int(season["season_number"]),
                 episodes   = []
@@ -222,24 +299,24 @@ class TMDBClient:
         seasons = sorted( seasons, key = lambda sn: int(sn.number) )
 
         if with_episodes:
-            episodes = [ get_episodes(show_id = id, number = season.number, language = language, api_configs = api_configs) for season in seasons ]
+            episodes = [ get_episodes(show_id = id, number = season.number, api_configs = api_configs) for season in seasons ]
             episodes = await asyncio.gather(*episodes)
             for index, season in enumerate(seasons):
                 season.episodes = episodes[index]
 
-        return Show(
+        return indexed(SupportedProviders.THE_MOVIE_DB, Show.construct(
             guid       = f'tvdb://series/{response["id"]}',
             source_id  = int(response["id"]),
-            source_url = parse_obj_as(HttpUrl, f'{self.source_base_url}tv/{response["id"]}'),
+            source_url = f'{self.source_base_url}tv/{response["id"]}',
             title      = response["name"]            if "name"          in response and response["name"]          else \
                          response["original_name"]   if "original_name" in response and response["original_name"] else None,
             overview   = response["overview"]        if "overview"      in response and response["overview"]      else None,
-            image      = parse_obj_as(HttpUrl,  f'{api_configs["images"]["secure_base_url"]}{api_configs["images"]["poster_sizes"][-1]}{response["poster_path"]}') \
+            image      = f'{api_configs["images"]["secure_base_url"]}{api_configs["images"]["poster_sizes"][-1]}{response["poster_path"]}' \
                          if "poster_path"    in response and response["poster_path"]    else None,
-            airdate    = dateparser.parse(response["first_air_date"]).date() \
+            airdate    = parse_date(response["first_air_date"]) \
                          if "first_air_date" in response and response["first_air_date"] else None,
             status     = ShowStatus.UPCOMING if "status" in response and response["status"] == 'In Production'    else \
                          ShowStatus.ONGOING  if "status" in response and response["status"] == 'Returning Series' else \
                          ShowStatus.ENDED    if "status" in response and response["status"] == 'Ended'            else None,
             seasons    = seasons
-        )
+        ), self.aliases(responses, 'name') )
@@ -1,19 +1,28 @@
-from ast import Param
 import os
-import jq
 import httpx
 import asyncio
-import dateparser
+import logging
 
-from typing           import List
-from pydantic         import HttpUrl
-from pydantic.tools   import parse_obj_as
-from math             import ceil
-from cashews          import noself_cache
-from libs.utils       import async_ext_api_call
-from libs.models      import MediaType, Media, Movie, Show, Season, Episode, \
-                             SearchResult, MovieStatus, ShowStatus, SeasonType
-from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
+from typing            import Awaitable, Callable, Dict, Iterable, List, Set, Tuple
+from pydantic          import HttpUrl
+from pydantic.tools    import parse_obj_as
+from math              import ceil
+from libs.cache        import noself_cache, versioned
+from libs.utils        import SEARCH_DEFAULT_LIMIT, async_ext_api_call, conditional_api_call
+from libs.dates        import parse_date
+from libs.languages    import TVDB_LANGUAGES, pick_translation
+from libs.singleflight import single_flight
+from libs.auth         import TokenManager
+from libs.offload      import offload
+from libs.index        import indexed
+from libs.models       import MediaType, Movie, Show, Season, Episode, \
+                              SearchResult, MovieStatus, ShowStatus, SeasonType, SupportedProviders
+from starlette.status  import HTTP_422_UNPROCESSABLE_ENTITY
+
+
+TVDB_EPISODES_CONCURRENCY = int( os.environ.get('TVDB_EPISODES_CONCURRENCY', '4') )
+TVDB_TRANSLATED_FIELDS    = [ 'title', 'overview' ]
+TVDB_UPDATES_MAX_PAGES    = int( os.environ.get('TVDB_UPDATES_MAX_PAGES', '20') )
 
 
 class TVDBClient:
@@ -23,7 +32,7 @@ class TVDBClient:
 
     def __init__(self, http_client: httpx.AsyncClient):
         # Ref: https://thetvdb.github.io/v4-api (v4.6.2)
-        self.api_url     = 'https://api4.thetvdb.com/v4'
+        self.api_url     = os.environ.get('TVDB_API_URL', 'https://api4.thetvdb.com/v4').rstrip('/')
         self.usr_pin     = os.environ.get('TVDB_USR_PIN')
         self.api_key     = os.environ.get('TVDB_API_KEY')
         self.api_headers = {
@@ -31,9 +40,10 @@ class TVDBClient:
             'Content-Type':    'application/json',
         }
         self.http_client = http_client
+        # the token is kept in memory and renewed before it expires, see libs.auth
+        self.auth        = TokenManager('TVDB', login = self.login, base_headers = self.api_headers)
 
-    @noself_cache(ttl = "7d")
-    async def get_auth_token(self):
+    async def login(self) -> str:
         api_endpoint = '/login'
         payload = {
             'pin':    self.usr_pin,
@@ -44,27 +54,31 @@ class TVDBClient:
             url         = parse_obj_as(HttpUrl, self.api_url + api_endpoint),
             method      = httpx.AsyncClient.post,
             caller      = "TVDB",
+            idempotent  = True, # logging in has no side effects, safe to replay
             headers     = self.api_headers,
             json        = payload
         )
         return response['data']['token']
 
-    async def get_auth_headers(self):
-        return self.api_headers | { 'Authorization': f'Bearer { await self.get_auth_token() }' }
+    async def warm_up(self):
+        # logged in before the first request needs it
+        await self.auth.headers()
 
     @noself_cache(ttl = "1d")
-    async def do_search(self, query: str, type: MediaType = None) -> SearchResult:
+    @single_flight
+    async def do_search(self, query: str, type: MediaType = None, page: int = 1, limit: int = SEARCH_DEFAULT_LIMIT) -> SearchResult:
         api_endpoint = '/search'
         response = await async_ext_api_call(
             http_client = self.http_client,
             url         = parse_obj_as(HttpUrl, self.api_url + api_endpoint),
             method      = httpx.AsyncClient.get,
             caller      = "TVDB",
-            headers     = await self.get_auth_headers(),
+            auth        = self.auth,
             params      = {
                 'query'   : query,
-                'type'    : type.value
-            } if type else {'query': query}
+                'offset'  : (page - 1) * limit,
+                'limit'   : limit
+            } | ({ 'type': type.value } if type else {})
         )
 
         search_result = {
@@ -75,23 +89,22 @@ class TVDBClient:
             if not item["type"] in ["movie", "series"]:
                 continue
 
-            media = Media(
+            media = dict(
                 guid      = f'tvdb://{item["type"]}/{item["tvdb_id"]}',
                 source_id = int(item["tvdb_id"]),
-                title     = item["translations"]["ita"] if "translations" in item and "ita" in item["translations"]  else \
-                            item["translations"]["eng"] if "translations" in item and "eng" in item["translations"]  else item["name"],
-                overview  = item["overviews"]["ita"]    if "overviews"    in item and "ita" in item["overviews"]     else \
-                            item["overviews"]["eng"]    if "overviews"    in item and "eng" in item["overviews"]     else \
-                            item["overview"]            if "overview"     in item else None,
-                image     = parse_obj_as(HttpUrl, item["thumbnail"]) if "thumbnail" in item and item["thumbnail"] else parse_obj_as(HttpUrl, item["image_url"]),
-                airdate   = dateparser.parse(item["first_air_time"]).date()  if "first_air_time" in item and item["first_air_time"] else \
-                            dateparser.parse("01/01/" + item["year"]).date() if "year"           in item and item["year"]           else None
+                title     = next( (item["translations"][language] for language in TVDB_LANGUAGES if language in (item.get("translations") or {})), item["name"] ),
+                overview  = next( (item["overviews"][language]    for language in TVDB_LANGUAGES if language in (item.get("overviews") or {})),    item.get("overview") ),
+                image     = item["thumbnail"] if "thumbnail" in item and item["thumbnail"] else item["image_url"],
+                airdate   = parse_date(item["first_air_time"]) if "first_air_time" in item and item["first_air_time"] else \
+                            parse_date(item["year"])           if "year"           in item and item["year"]           else None
             )
+            # every title it is known by, for the local index
+            aliases = [ item["name"] ] + [ (item.get("translations") or {}).get(language) for language in TVDB_LANGUAGES ]
 
             if item["type"] == "movie":
-                search_result["movies"].append(Movie(
-                    **media.dict() | {
-                        'source_url': parse_obj_as(HttpUrl, f'{self.movies_url_prefix}{item["slug"]}') if "slug" in item and item["slug"] else None,
+                search_result["movies"].append( indexed(SupportedProviders.THE_TV_DB, Movie.construct(
+                    **media | {
+                        'source_url': f'{self.movies_url_prefix}{item["slug"]}' if "slug" in item and item["slug"] else None,
                         'status':     (
                             MovieStatus.ANNOUNCED       if item["status"].lower() in MovieStatus.ANNOUNCED.value.lower()       else \
                             MovieStatus.PRE_PRODUCTION  if item["status"].lower() in MovieStatus.PRE_PRODUCTION.value.lower()  else \
@@ -100,11 +113,11 @@ class TVDBClient:
                             MovieStatus.RELEASED        if item["status"].lower() in MovieStatus.RELEASED.value.lower()        else None
                         ) if "status" in item and item["status"] else None
                     }
-                ) )
+                ), aliases ) )
             else:
-                search_result["series"].append(Show(
-                    **media.dict() | {
-                        'source_url': parse_obj_as(HttpUrl, f'{self.series_url_prefix}{item["slug"]}') if "slug" in item and item["slug"] else None,
+                search_result["series"].append( indexed(SupportedProviders.THE_TV_DB, Show.construct(
+                    **media | {
+                        'source_url': f'{self.series_url_prefix}{item["slug"]}' if "slug" in item and item["slug"] else None,
                         'status':     (
                             ShowStatus.UPCOMING if item["status"].lower() in ShowStatus.UPCOMING.value.lower() else \
                             ShowStatus.ONGOING  if item["status"].lower() in ShowStatus.ONGOING.value.lower()  else \
@@ -112,210 +125,330 @@ class TVDBClient:
                             ShowStatus.ENDED    if item["status"].lower() in ShowStatus.ENDED.value.lower()    else None
                         ) if "status" in item  and item["status"] else None
                     }
-                ) )
+                ), aliases ) )
 
         return search_result
 
+    async def get_updated_series(self, since: int) -> Set[int]:
+        # series changed upstream since the given epoch, their episodes' changes included
+        api_endpoint = '/updates'
+        series       = set()
+        for page in range(TVDB_UPDATES_MAX_PAGES):
+            response = await async_ext_api_call(
+                http_client = self.http_client,
+                url         = parse_obj_as(HttpUrl, self.api_url + api_endpoint),
+                method      = httpx.AsyncClient.get,
+                caller      = "TVDB",
+                auth        = self.auth,
+                params      = {
+                    'since': since,
+                    'page':  page
+                }
+            )
+            for update in response["data"] or []:
+                if update.get("entityType") == "series":
+                    series.add( int(update["recordId"]) )
+                elif update.get("seriesId"):
+                    series.add( int(update["seriesId"]) )
+            if not response.get("links", {}).get("next"):
+                break
+        else:
+            logging.warning(f'[TVDB] - More than {TVDB_UPDATES_MAX_PAGES} pages of updates since {since}, the rest is left to the cache TTLs')
+        return series
+
     @noself_cache(ttl = "1d")
+    @single_flight
     async def get_movie(self, id: int) -> Movie:
         api_endpoint = f'/movies/{id}/extended'
-        response = await async_ext_api_call(
+        response, version = await conditional_api_call(
             http_client = self.http_client,
             url         = parse_obj_as(HttpUrl, self.api_url + api_endpoint),
             method      = httpx.AsyncClient.get,
             caller      = "TVDB",
-            headers     = await self.get_auth_headers(),
+            auth        = self.auth,
             params      = {
                 'meta':  'translations',
                 'short': 'true'
             }
         )
-        return Movie(
-            guid       = f'tvdb://movie/{response["data"]["id"]}',
-            source_id  = int(response["data"]["id"]),
-            source_url = parse_obj_as(HttpUrl, f'{self.movies_url_prefix}{response["data"]["slug"]}') if 'slug' in response["data"] else None,
-            title      = next(
-                (translation for translation in response["data"]["translations"]["nameTranslations"] if translation["language"] == "ita"),
-                next(
-                    (translation for translation in response["data"]["translations"]["nameTranslations"] if translation["language"] == "eng"),
-                    {"name": response["data"]["name"]}
-                )
-            )["name"],
-            overview   = next(
-                (translation for translation in response["data"]["translations"]["overviewTranslations"] if translation["language"] == "ita"),
-                next(
-                    (translation for translation in response["data"]["translations"]["overviewTranslations"] if translation["language"] == "eng"),
-                    {"overview": None}
+
+        def to_movie() -> Movie:
+            return indexed(SupportedProviders.THE_TV_DB, Movie.construct(
+                guid       = f'tvdb://movie/{response["data"]["id"]}',
+                source_id  = int(response["data"]["id"]),
+                source_url = f'{self.movies_url_prefix}{response["data"]["slug"]}' if 'slug' in response["data"] else None,
+                title      = pick_translation(response["data"]["translations"]["nameTranslations"],     TVDB_LANGUAGES, "name",     response["data"]["name"]),
+                overview   = pick_translation(response["data"]["translations"]["overviewTranslations"], TVDB_LANGUAGES, "overview"),
+                image      = response["data"]["image"] if 'image' in response["data"] else None,
+                airdate    = parse_date(response["data"]["first_release"]["date"]) if 'date' in response["data"]["first_release"] else None,
+                runtime    = response["data"]["runtime"] if response["data"]["runtime"] else None,
+                status     = MovieStatus.ANNOUNCED       if response["data"]["status"]["id"] == 1 else \
+                             MovieStatus.PRE_PRODUCTION  if response["data"]["status"]["id"] == 2 else \
+                             MovieStatus.POST_PRODUCTION if response["data"]["status"]["id"] == 3 else \
+                             MovieStatus.COMPLETED       if response["data"]["status"]["id"] == 4 else \
+                             MovieStatus.RELEASED        if response["data"]["status"]["id"] == 5 else None
+            ), self.aliases(response) )
+
+        return await versioned('TVDBClient.get_movie', str(id), [ version ], to_movie)
+
+    @staticmethod
+    def aliases(response: Dict) -> List[str]:
+        # the name in the languages of interest, for the local index
+        return [ response["data"]["name"] ] + [
+            translation["name"] for translation in response["data"]["translations"]["nameTranslations"] if translation.get("language") in TVDB_LANGUAGES
+        ]
+
+    @classmethod
+    def parse_seasons(
+        cls,
+        response:    Dict,
+        season_type: SeasonType,
+        seasons:     Dict[int, Season]               = None,
+        offered:     Dict[str, Dict[str, List[str]]] = None
+    ) -> Dict[int, Season]:
+        # single pass over an episodes page: raw JSON straight to models, merged into the season number index,
+        # optionally noting the languages every episode has translations for
+        series_url = f'{cls.series_url_prefix}{response["data"]["series"]["slug"]}' if "series" in response["data"] else None
+        seasons    = {} if seasons is None else seasons
+        for episode in response["data"]["episodes"]:
+            number = episode["seasonNumber"]
+            season = seasons.get(number)
+            if season is None:
+                season = seasons[number] = Season.construct(
+                    guid       = f'tvdb://series/{episode["seriesId"]}/seasons/{number}',
+                    source_url = f'{series_url}/seasons/{season_type.value.lower()}/{number}' if series_url else None,
+                    number     = number,
+                    episodes   = []
                 )
-            )["overview"],
-            image      = parse_obj_as(HttpUrl, response["data"]["image"]) if 'image' in response["data"] else None,
-            airdate    = dateparser.parse(response["data"]["first_release"]["date"]).date() if 'date' in response["data"]["first_release"] else None,
-            runtime    = response["data"]["runtime"] if response["data"]["runtime"] else None,
-            status     = MovieStatus.ANNOUNCED       if response["data"]["status"]["id"] == 1 else \
-                         MovieStatus.PRE_PRODUCTION  if response["data"]["status"]["id"] == 2 else \
-                         MovieStatus.POST_PRODUCTION if response["data"]["status"]["id"] == 3 else \
-                         MovieStatus.COMPLETED       if response["data"]["status"]["id"] == 4 else \
-                         MovieStatus.RELEASED        if response["data"]["status"]["id"] == 5 else None
-        )
+            guid = f'tvdb://series/{episode["seriesId"]}/episodes/{episode["id"]}'
+            if offered is not None:
+                offered[guid] = { 'title': episode.get("nameTranslations"), 'overview': episode.get("overviewTranslations") }
+            season.episodes.append( Episode.construct(
+                guid       = guid,
+                source_id  = int(episode["id"]),
+                source_url = f'{series_url}/episodes/{episode["id"]}' if series_url else None,
+                title      = episode["name"]     if episode["name"]     else "",
+                overview   = episode["overview"] if episode["overview"] else None,
+                image      = (
+                                 episode["image"] if episode["image"].startswith(cls.images_base_url) else cls.images_base_url + episode["image"]
+                             ) if episode["image"] else None,
+                airdate    = parse_date(episode["aired"]) if episode["aired"] else None,
+                number     = episode["number"],
+                runtime    = episode["runtime"]
+            ) )
+
+        return seasons
+
+    @classmethod
+    def parse_episodes_page(cls, response: Dict, season_type: SeasonType) -> Tuple[Dict[int, Season], Dict[str, Dict[str, List[str]]]]:
+        # a page on its own, as run by an executor: merged back into the show on the event loop
+        offered = {}
+        return cls.parse_seasons(response, season_type, offered = offered), offered
+
+    @staticmethod
+    def merge_seasons(seasons: Dict[int, Season], page_seasons: Dict[int, Season]):
+        for number, season in page_seasons.items():
+            if number in seasons:
+                seasons[number].episodes.extend(season.episodes)
+            else:
+                seasons[number] = season
+
+    @staticmethod
+    def parse_translations(response: Dict, translations: Dict[str, Dict[str, str]] = None) -> Dict[str, Dict[str, str]]:
+        # a language sweep only feeds the overlay: episode GUID -> non empty localized fields, no models involved
+        translations = {} if translations is None else translations
+        for episode in response["data"]["episodes"]:
+            fields = { field: episode[key] for field, key in [ ('title', 'name'), ('overview', 'overview') ] if episode.get(key) }
+            if fields:
+                translations[f'tvdb://series/{episode["seriesId"]}/episodes/{episode["id"]}'] = fields
+        return translations
+
+    @staticmethod
+    def sort_seasons(seasons: Dict[int, Season]) -> List[Season]:
+        # pages may arrive in any order: sort once, after the last one
+        for season in seasons.values():
+            season.episodes.sort(key = lambda ep: ep.number)
+        return [ seasons[number] for number in sorted(seasons) ]
+
+    @staticmethod
+    def needed_languages(seasons: Iterable[Season], offered: Dict[str, Dict[str, List[str]]], languages: List[str], original: str = None) -> List[str]:
+        # The default sweep already holds the original language, a language sweep is worth it only when, for some field,
+        # it is the first one by priority offering a value. Episodes not telling which translations they have (None)
+        # may need any language up to the original one.
+        needed = set()
+        for season in seasons:
+            for episode in season.episodes:
+                for field in TVDB_TRANSLATED_FIELDS:
+                    for language in languages:
+                        if language == original:
+                            if getattr(episode, field):
+                                break
+                            continue
+                        episode_offers = offered.get(episode.guid, {}).get(field)
+                        if episode_offers is None or language in episode_offers:
+                            needed.add(language)
+                            if episode_offers is not None:
+                                break
+        return [ language for language in languages if language in needed ]
+
+    @staticmethod
+    def overlay_translations(seasons: Iterable[Season], translations: Dict[str, Dict[str, Dict[str, str]]], languages: List[str], original: str = None):
+        # single pass, by language priority the first value wins, the original language one being already in place
+        for season in seasons:
+            for episode in season.episodes:
+                for field in TVDB_TRANSLATED_FIELDS:
+                    for language in languages:
+                        if language == original:
+                            if getattr(episode, field):
+                                break
+                            continue
+                        value = translations.get(language, {}).get(episode.guid, {}).get(field)
+                        if value:
+                            setattr(episode, field, value)
+                            break
 
     @noself_cache(ttl = "1d")
+    @single_flight
     async def get_show(self, id: int, season_type: SeasonType = SeasonType.OFFICIAL, with_episodes: bool = False) -> Show:
-        async def get_seasons(show_id: int, season_type: SeasonType, language: str = None, page: int = 0) -> List[Season]:
-            jq_season_parser = '''[ .data.episodes | group_by(.seasonNumber)[] | {
-                guid:     ( "tvdb://series/" + (.[0].seriesId | tostring) + "/seasons/" + (.[0].seasonNumber | tostring) ),
-                number:   .[0].seasonNumber,
-                episodes: [ .[] | {
-                    guid:       ( "tvdb://series/" + (.seriesId | tostring) + "/episodes/" + (.id | tostring) ),
-                    source_id:  (.id | tonumber),
-                    source_url: ( "/episodes/" + (.id | tostring) ),
-                    title:      .name,
-                    overview:   .overview,
-                    image:      .image,
-                    airdate:    .aired,
-                    number:     .number,
-                    runtime:    .runtime
-                } ]
-            } ]'''
-
-            api_endpoint = f'/series/{id}/episodes/{season_type}'
+        async def get_episodes(show_id: int, season_type: SeasonType, parse_page: Callable[[Dict], Awaitable], language: str = None):
+            api_endpoint = f'/series/{show_id}/episodes/{season_type.value}'
             if language:
                 api_endpoint += f'/{language}'
 
-            response = await async_ext_api_call(
-                http_client = self.http_client,
-                url         = parse_obj_as(HttpUrl, self.api_url + api_endpoint),
-                method      = httpx.AsyncClient.get,
-                caller      = "TVDB",
-                headers     = await self.get_auth_headers(),
-                params      = {
-                    'page': page
-                }
-            )
-            tmp_seasons = jq.compile(jq_season_parser).input(response).first()
+            async def get_page(page: int) -> Dict:
+                async with semaphore:
+                    return await async_ext_api_call(
+                        http_client = self.http_client,
+                        url         = parse_obj_as(HttpUrl, self.api_url + api_endpoint),
+                        method      = httpx.AsyncClient.get,
+                        caller      = "TVDB",
+                        auth        = self.auth,
+                        params      = {
+                            'page': page
+                        }
+                    )
 
-            seasons = []
-            for tmp_season in tmp_seasons:
-                episodes = []
-                for tmp_episode in tmp_season["episodes"]:
-                    episodes.append( Episode( **tmp_episode | {
-                        "source_url": parse_obj_as(HttpUrl, f'{self.series_url_prefix}{response["data"]["series"]["slug"]}{tmp_episode["source_url"]}') \
-                                      if "series" in response["data"] else None,
-                        "title":      tmp_episode["title"]    if tmp_episode["title"]    else "",
-                        "overview":   tmp_episode["overview"] if tmp_episode["overview"] else None,
-                        "image":      parse_obj_as(
-                                          HttpUrl, tmp_episode["image"] if tmp_episode["image"].startswith(self.images_base_url) else self.images_base_url + tmp_episode["image"]
-                                      ) if tmp_episode["image"] else None,
-                        "airdate":    dateparser.parse(tmp_episode["airdate"]).date() if tmp_episode["airdate"] else None
-                    } ) )
-                seasons.append( Season( **tmp_season | {
-                    "source_url": parse_obj_as(
-                                      HttpUrl, f'{self.series_url_prefix}{response["data"]["series"]["slug"]}/seasons/{season_type.value.lower()}/{tmp_season["number"]}'
-                                  ) if "series" in response["data"] else None,
-                    "episodes":   episodes
-                } ) )
-
-            if page == 0 and (response["links"]["total_items"] / response["links"]["page_size"]) > 1:
-                requests = []
-                for i in range( 1, ceil(response["links"]["total_items"] / response["links"]["page_size"]) ):
-                    requests.append( self.get_seasons(id = id, season_type = season_type, language = language, page = i) )
-                all_pages = await asyncio.gather(*requests)
-                all_pages = seasons + [item for single_page in all_pages for item in single_page]
-
-                seasons = []
-                for tmp_season in all_pages:
-                    index = next((i for i, season in enumerate(seasons) if season.guid == tmp_season.guid), None)
-                    if not index:
-                        seasons.append(tmp_season)
-                    else:
-                        seasons[index].episodes += tmp_season.episodes
-
-                # order seasons and episodes by number
-                for season in seasons:
-                    season.episodes = sorted(season.episodes, key = lambda ep: ep.number)
-                seasons = sorted(seasons, key = lambda sn: sn.number)
-
-            return seasons
+            # the first page tells how many others there are, those are parsed as they arrive
+            response = await get_page(0)
+            await parse_page(response)
+            pages    = [
+                asyncio.ensure_future( get_page(page) ) for page in range( 1, ceil(response["links"]["total_items"] / response["links"]["page_size"]) )
+            ]
+            try:
+                for next_page in asyncio.as_completed(pages):
+                    await parse_page(await next_page)
+            finally:
+                # a page failed (or the caller went away): the others are of no use anymore, and not to be waited for
+                for page in pages:
+                    if not page.done():
+                        page.cancel()
+                    page.add_done_callback(lambda page: page.cancelled() or page.exception())
+
+        async def get_seasons(show_id: int, season_type: SeasonType, offered: Dict[str, Dict[str, List[str]]] = None) -> List[Season]:
+            seasons = {}
+
+            async def parse_page(page: Dict):
+                # big pages are parsed off the event loop, while the next ones are still being downloaded
+                page_seasons, page_offered = await offload(
+                    'tvdb:episodes', len(page["data"]["episodes"]), self.parse_episodes_page, page, season_type
+                )
+                self.merge_seasons(seasons, page_seasons)
+                if offered is not None:
+                    offered.update(page_offered)
+
+            await get_episodes(show_id, season_type, parse_page)
+            return self.sort_seasons(seasons)
+
+        async def get_translations(show_id: int, season_type: SeasonType, language: str) -> Dict[str, Dict[str, str]]:
+            translations = {}
+
+            async def parse_page(page: Dict):
+                translations.update( await offload('tvdb:translations', len(page["data"]["episodes"]), self.parse_translations, page) )
+
+            await get_episodes(show_id, season_type, parse_page, language)
+            return translations
 
         api_endpoint = f'/series/{id}/extended'
-        response = await async_ext_api_call(
+        response, version = await conditional_api_call(
             http_client = self.http_client,
             url         = parse_obj_as(HttpUrl, self.api_url + api_endpoint),
             method      = httpx.AsyncClient.get,
             caller      = "TVDB",
-            headers     = await self.get_auth_headers(),
+            auth        = self.auth,
             params      = {
                 'meta':  'translations',
                 'short': 'true'
             }
         )
 
-        seasons = []
-        for season in response["data"]["seasons"]:
-            if not season["type"]["type"].lower() == season_type.value.lower():
-                continue
-            seasons.append( Season(
-                guid       = f'tvdb://series/{id}/seasons/{season["id"]}',
-                source_id  = int(season["id"]),
-                source_url = parse_obj_as(HttpUrl, f'{self.series_url_prefix}{response["data"]["slug"]}/seasons/{season_type.value.lower()}/{season["number"]}'),
-                image      = parse_obj_as(HttpUrl, season["image"]) \
-                             if "image" in season and season["image"] else None,
-                number     = int(season["number"]),
-                episodes   = []
-            ) )
-        # ensure seasons are ordered by number
-        seasons = sorted( seasons, key = lambda sn: int(sn.number) )
+        def to_show() -> Show:
+            seasons = []
+            for season in response["data"]["seasons"]:
+                if not season["type"]["type"].lower() == season_type.value.lower():
+                    continue
+                seasons.append( Season.construct(
+                    guid       = f'tvdb://series/{id}/seasons/{season["id"]}',
+                    source_id  = int(season["id"]),
+                    source_url = f'{self.series_url_prefix}{response["data"]["slug"]}/seasons/{season_type.value.lower()}/{season["number"]}',
+                    image      = season["image"] \
+                                 if "image" in season and season["image"] else None,
+                    number     = int(season["number"]),
+                    episodes   = []
+                ) )
+            # ensure seasons are ordered by number
+            seasons = sorted( seasons, key = lambda sn: int(sn.number) )
+
+            return indexed(SupportedProviders.THE_TV_DB, Show.construct(
+                guid       = f'tvdb://series/{response["data"]["id"]}',
+                source_id  = int(response["data"]["id"]),
+                source_url = f'{self.series_url_prefix}{response["data"]["slug"]}' if 'slug' in response["data"] else None,
+                title      = pick_translation(response["data"]["translations"]["nameTranslations"],     TVDB_LANGUAGES, "name",     response["data"]["name"]),
+                overview   = pick_translation(response["data"]["translations"]["overviewTranslations"], TVDB_LANGUAGES, "overview"),
+                image      = response["data"]["image"] if 'image' in response["data"] else None,
+                airdate    = parse_date(response["data"]["firstAired"]) if response["data"]["firstAired"] else None,
+                status     = ShowStatus.UPCOMING if response["data"]["status"]["id"] == 3 else \
+                             ShowStatus.ONGOING  if response["data"]["status"]["id"] == 1 else \
+                             ShowStatus.ENDED    if response["data"]["status"]["id"] == 2 else None,
+                seasons    = seasons
+            ), self.aliases(response) )
+
+        show = await versioned('TVDBClient.get_show', f'{id}:{season_type.value}', [ version ], to_show)
 
         if with_episodes:
-            translations   = await asyncio.gather(*[
-                get_seasons(show_id = id, season_type = season_type),
-                get_seasons(show_id = id, season_type = season_type, language = 'ita'),
-                get_seasons(show_id = id, season_type = season_type, language = 'eng')
-            ])
-            ep_seasons_def = translations[0]
-            ep_seasons_ita = translations[1]
-            ep_seasons_eng = translations[2]
-            for s_index, season in enumerate(seasons):
-                season.episodes = next(
-                    (ep_season for ep_season in ep_seasons_def if ep_season.source_url == season.source_url),
-                    season
-                ).episodes
-                if not season.airdate and season.episodes[0].airdate:
+            # the built show may be shared with other callers, the episodes go to a copy of it
+            show      = show.copy(deep = True)
+            # shared by every episodes sweep of this show
+            semaphore = asyncio.Semaphore(TVDB_EPISODES_CONCURRENCY)
+            original  = response["data"].get("originalLanguage")
+            offered   = {}
+            sweeps    = {}
+            try:
+                # the default sweep comes in the original language: unless that is the preferred one, the preferred
+                # variant is almost always needed and starts right away, the fallbacks wait to know what is missing
+                if TVDB_LANGUAGES and TVDB_LANGUAGES[0] != original:
+                    sweeps[TVDB_LANGUAGES[0]] = asyncio.ensure_future( get_translations(id, season_type, TVDB_LANGUAGES[0]) )
+                ep_seasons_def = await get_seasons(show_id = id, season_type = season_type, offered = offered)
+                for language in self.needed_languages(ep_seasons_def, offered, TVDB_LANGUAGES, original):
+                    if language not in sweeps:
+                        sweeps[language] = asyncio.ensure_future( get_translations(id, season_type, language) )
+                results = await asyncio.gather(*sweeps.values(), return_exceptions = True)
+            finally:
+                for sweep in sweeps.values():
+                    if not sweep.done():
+                        sweep.cancel()
+
+            translations = {}
+            for language, result in zip(sweeps, results):
+                if isinstance(result, Exception):
+                    logging.warning(f'[TVDB] - Episode translations sweep failed for language {language}: {result!r}')
+                else:
+                    translations[language] = result
+            self.overlay_translations(ep_seasons_def, translations, TVDB_LANGUAGES, original)
+
+            ep_seasons_def = { ep_season.number: ep_season for ep_season in ep_seasons_def }
+            for season in show.seasons:
+                season.episodes = ep_seasons_def[season.number].episodes if season.number in ep_seasons_def else []
+                if not season.airdate and season.episodes and season.episodes[0].airdate:
                     season.airdate = season.episodes[0].airdate
-                for e_index, episode in enumerate(season.episodes):
-                    if ep_seasons_ita[s_index].episodes[e_index].guid == episode.guid:
-                        if ep_seasons_ita[s_index].episodes[e_index].title:
-                            episode.title = ep_seasons_ita[s_index].episodes[e_index].title
-                        elif ep_seasons_eng[s_index].episodes[e_index].title and \
-                             ep_seasons_eng[s_index].episodes[e_index].guid == episode.guid:
-                            episode.title = ep_seasons_eng[s_index].episodes[e_index].title
-                        if ep_seasons_ita[s_index].episodes[e_index].overview:
-                            episode.overview = ep_seasons_ita[s_index].episodes[e_index].overview
-                        elif ep_seasons_eng[s_index].episodes[e_index].overview and \
-                             ep_seasons_eng[s_index].episodes[e_index].guid == episode.guid:
-                            episode.overview = ep_seasons_eng[s_index].episodes[e_index].overview
-
-        return Show(
-            guid       = f'tvdb://series/{response["data"]["id"]}',
-            source_id  = int(response["data"]["id"]),
-            source_url = parse_obj_as(HttpUrl, f'{self.series_url_prefix}{response["data"]["slug"]}') if 'slug' in response["data"] else None,
-            title      = next(
-                (translation for translation in response["data"]["translations"]["nameTranslations"] if translation["language"] == "ita"),
-                next(
-                    (translation for translation in response["data"]["translations"]["nameTranslations"] if translation["language"] == "eng"),
-                    {"name": response["data"]["name"]}
-                )
-            )["name"],
-            overview   = next(
-                (translation for translation in response["data"]["translations"]["overviewTranslations"] if translation["language"] == "ita"),
-                next(
-                    (translation for translation in response["data"]["translations"]["overviewTranslations"] if translation["language"] == "eng"),
-                    {"overview": None}
-                )
-            )["overview"],
-            image      = parse_obj_as(HttpUrl, response["data"]["image"]) if 'image' in response["data"] else None,
-            airdate    = dateparser.parse(response["data"]["firstAired"]).date() if response["data"]["firstAired"] else None,
-            status     = ShowStatus.UPCOMING if response["data"]["status"]["id"] == 3 else \
-                         ShowStatus.ONGOING  if response["data"]["status"]["id"] == 1 else \
-                         ShowStatus.ENDED    if response["data"]["status"]["id"] == 2 else None,
-            seasons    = seasons
-        )
+
+        return show
@@ -0,0 +1,82 @@
+import os
+import time
+import asyncio
+import logging
+
+from cashews.ttl    import ttl_to_seconds
+from libs.cache     import cache
+from libs.retry     import start_request_budget
+from libs.ratelimit import BACKGROUND, request_priority
+from libs.responses import response_key
+from libs.store     import store
+from libs.models    import BatchDetailsItem, MediaType, SupportedProviders
+from libs.tvdb      import TVDBClient
+
+
+# how often the TVDB changes feed is polled (0 disables it), the last poll time is shared through the cache
+TVDB_UPDATES_INTERVAL    = ttl_to_seconds( os.environ.get('TVDB_UPDATES_INTERVAL', '15m') )
+TVDB_UPDATES_CONCURRENCY = int( os.environ.get('TVDB_UPDATES_CONCURRENCY', '16') )
+TVDB_UPDATES_SINCE_KEY   = 'tvdb:updates:since'
+TVDB_UPDATES_LEASE_KEY   = 'tvdb:updates:lease'
+
+
+class TVDBUpdatesWatcher:
+    def __init__(self, client: TVDBClient, interval: float = TVDB_UPDATES_INTERVAL):
+        self.client   = client
+        self.interval = interval
+        self.task     = None
+
+    def start(self):
+        if self.interval and self.task is None:
+            self.task = asyncio.ensure_future( self.watch() )
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions = True)
+            self.task = None
+
+    async def invalidate(self, id: int):
+        # routes only ask for the default season type, with or without episodes
+        for with_episodes in [ False, True ]:
+            await TVDBClient.get_show.invalidate(self.client, id = id, with_episodes = with_episodes)
+            await cache.delete( response_key('details', **BatchDetailsItem(
+                source        = SupportedProviders.THE_TV_DB,
+                type          = MediaType.SERIES,
+                id            = id,
+                with_episodes = with_episodes
+            ).dict()) )
+
+    async def sync(self) -> int:
+        started = int( time.time() )
+        since   = await cache.get(TVDB_UPDATES_SINCE_KEY)
+        if since is None:
+            # first run ever: whatever is cached already is left to its TTL
+            await cache.set(TVDB_UPDATES_SINCE_KEY, started)
+            return 0
+
+        series    = list( await self.client.get_updated_series(since) )
+        semaphore = asyncio.Semaphore(TVDB_UPDATES_CONCURRENCY)
+
+        async def invalidate(id: int):
+            async with semaphore:
+                await self.invalidate(id)
+
+        await asyncio.gather(*[ invalidate(id) for id in series ])
+        # stored records are aged too, the next lookups fetch them again
+        await store.expire(SupportedProviders.THE_TV_DB, MediaType.SERIES, series)
+        await cache.set(TVDB_UPDATES_SINCE_KEY, started)
+        return len(series)
+
+    async def watch(self):
+        request_priority.set(BACKGROUND)
+        while True:
+            # polls run detached from any incoming request, so they get their own budget
+            start_request_budget()
+            try:
+                # with many workers a single one polls in every interval, the lease expiring just before the next one
+                if await cache.set_if_missing(TVDB_UPDATES_LEASE_KEY, os.getpid(), expire = self.interval * 0.9):
+                    logging.info(f'[TVDB] - Series changed upstream, cache invalidated: {await self.sync()}')
+            except Exception as e:
+                logging.warning(f'[TVDB] - Polling the updates feed failed ({type(e).__name__}), retrying in {self.interval}s')
+            await asyncio.sleep(self.interval)
@@ -1,63 +1,247 @@
+import os
 import sys
-import httpx
-import random
 import time
+import httpx
+import asyncio
 import logging
 import urllib.parse
 
+from math             import ceil
 from pydantic         import HttpUrl
-from typing           import Callable
+from typing           import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
 from json             import JSONDecodeError
 from fastapi          import HTTPException
-from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
+from libs.retry       import RetryPolicy, remaining_budget, parse_retry_after
+from libs.ratelimit   import get_limiter
+from libs.breaker     import get_breaker
+from libs.auth        import TokenManager
+from libs.cache       import UPSTREAM_CACHE_TTL, CacheEntry, cache
+from libs.metrics     import UPSTREAM_LATENCY, UPSTREAM_RESPONSES, UPSTREAM_RETRIES, endpoint_template
+from starlette.status import HTTP_304_NOT_MODIFIED, \
+                             HTTP_401_UNAUTHORIZED, \
+                             HTTP_429_TOO_MANY_REQUESTS, \
+                             HTTP_500_INTERNAL_SERVER_ERROR, \
+                             HTTP_503_SERVICE_UNAVAILABLE, \
+                             HTTP_504_GATEWAY_TIMEOUT
+
+
+SEARCH_DEFAULT_LIMIT = int( os.environ.get('SEARCH_DEFAULT_LIMIT', '20') )
+SEARCH_MAX_LIMIT     = int( os.environ.get('SEARCH_MAX_LIMIT', '100') )
+
+# credentials are no part of what is requested: never in a cache key, and rotating them keeps the stored validators
+UPSTREAM_CACHE_KEY_EXCLUDED = { 'api_key', 'apikey', 'token', 'access_token' }
+
+NOT_MODIFIED         = object()
+default_retry_policy = RetryPolicy()
 
 async def async_ext_api_call(
-    http_client: httpx.AsyncClient,
-    url:         HttpUrl,
-    method:      Callable[..., httpx.Response],
-    caller:      str,
-    max_retries: int = 6,
+    http_client:  httpx.AsyncClient,
+    url:          HttpUrl,
+    method:       Callable[..., httpx.Response],
+    caller:       str,
+    max_retries:  int          = None,
+    idempotent:   bool         = None,
+    retry_policy: RetryPolicy  = None,
+    validators:   Dict         = None,
+    auth:         TokenManager = None,
     **kwargs
 ):
-    tries = max_retries + 1
-    response = { }
+    # with `validators` the call is conditional: the stored ETag/Last-Modified are sent along, NOT_MODIFIED is
+    # returned on a 304, otherwise the dict is updated with the validators of the new response.
+    # With `auth` its headers are used, and a request they get rejected for (401) is replayed once with new ones.
+    retry_policy = retry_policy or default_retry_policy
+    max_retries  = retry_policy.max_retries if max_retries is None else max_retries
+    method_name  = method.__name__.upper()
+    endpoint     = endpoint_template( httpx.URL(str(url)).path )
+    limiter      = get_limiter(caller)
+    breaker      = get_breaker(caller, endpoint)
+    attempt      = 0
+
+    headers = kwargs.get('headers') or {}
+    if validators:
+        headers = dict(headers) | {
+            header: validators[key] for header, key in [ ('If-None-Match', 'etag'), ('If-Modified-Since', 'last_modified') ] if validators.get(key)
+        }
+    kwargs['headers'] = headers
+    replayed          = False
 
-    while tries:
+    if len(kwargs.get('params', [ ])) > 0:
+        url_encoded=f'{url}?{"&".join(["=".join([key, urllib.parse.quote(str(value).encode("utf-8"))]) for key, value in kwargs["params"].items()])}'
+    else:
+        url_encoded=url
+
+    while True:
+        budget = remaining_budget()
+        if budget is not None and budget <= 0:
+            logging.error(f'[{caller}] - Request budget exhausted before calling external API endpoint: {url}')
+            raise HTTPException(status_code = HTTP_504_GATEWAY_TIMEOUT)
+
+        # every attempt, retries included, goes through the provider rate limiter
         try:
-            if len(kwargs.get('params', [ ])) > 0:
-                url_encoded=f'{url}?{"&".join(["=".join([key, urllib.parse.quote(str(value).encode("utf-8"))]) for key, value in kwargs["params"].items()])}'
-                logging.debug(f'[{caller}] - An external API endpoint is beeing called: {url_encoded}')
-            else:
-                logging.debug(f'[{caller}] - An external API endpoint is beeing called: {url}')
+            await asyncio.wait_for( limiter.acquire(), budget )
+        except asyncio.TimeoutError:
+            logging.error(f'[{caller}] - Request budget exhausted while waiting for the rate limiter: {url}')
+            raise HTTPException(status_code = HTTP_504_GATEWAY_TIMEOUT)
 
-            api_call = await method(http_client, url=url, **kwargs)
-            api_call.raise_for_status()
-            response = api_call.json()
+        # never let a single attempt outlive the budget of the incoming request
+        budget = remaining_budget()
+        if budget is not None:
+            kwargs['timeout'] = max(0.001, budget)
+        # a login, when needed, goes through its own breaker and limiter, never holding this breaker's probe
+        if auth is not None:
+            auth_headers      = await auth.headers()
+            kwargs['headers'] = auth_headers | headers if headers else auth_headers
+
+        # a provider known to be down is not retried. Asked right before the call: a half-open breaker hands out
+        # a single probe, whoever takes it must report back
+        if not breaker.allow():
+            logging.error(f'[{caller}] - Circuit open, failing fast for {breaker.retry_in():.0f}s: {url}')
+            raise HTTPException(
+                status_code = HTTP_503_SERVICE_UNAVAILABLE,
+                detail      = f'[{caller}] - Upstream temporarily unavailable',
+                headers     = { 'Retry-After': str( ceil( breaker.retry_in() ) ) }
+            )
+
+        retry_after = None
+        start_time  = time.perf_counter()
+        try:
+            logging.debug(f'[{caller}] - An external API endpoint is beeing called: {url_encoded}')
 
-            break
+            success = None
+            try:
+                api_call = await method(http_client, url=url, **kwargs)
+                success  = api_call.status_code < 500
+            except httpx.RequestError:
+                success  = False
+                raise
+            finally:
+                UPSTREAM_LATENCY.observe(time.perf_counter() - start_time, provider = caller, endpoint = endpoint)
+                breaker.record(success)
+            UPSTREAM_RESPONSES.inc(provider = caller, endpoint = endpoint, status = api_call.status_code)
+            if validators is not None and api_call.status_code == HTTP_304_NOT_MODIFIED:
+                return NOT_MODIFIED
+            api_call.raise_for_status()
+            if validators is not None:
+                validators.clear()
+                validators.update({
+                    key: api_call.headers[header] for header, key in [ ('ETag', 'etag'), ('Last-Modified', 'last_modified') ] if header in api_call.headers
+                })
+            return api_call.json()
         except (httpx.DecodingError, JSONDecodeError):
             logging.error(f'[{caller}] - Error while parsing external API results: {url}')
-            exception = HTTPException(status_code = HTTP_500_INTERNAL_SERVER_ERROR)
+            raise HTTPException(status_code = HTTP_500_INTERNAL_SERVER_ERROR)
         except httpx.RequestError:
+            UPSTREAM_RESPONSES.inc(provider = caller, endpoint = endpoint, status = 'error')
             error_details = sys.exc_info()
             logging.error(
-                f'[{caller}] - Error while calling external API endpoint ({max_retries - tries + 2}/{max_retries}): {error_details[0]}'
+                f'[{caller}] - Error while calling external API endpoint ({attempt + 1}/{max_retries + 1}): {error_details[0]}'
             )
             exception = HTTPException(status_code = HTTP_500_INTERNAL_SERVER_ERROR)
+            retryable = retry_policy.is_retryable(method_name, idempotent = idempotent)
         except httpx.HTTPStatusError as e:
-            message = response['Error'] if 'Error' in response else None
+            if e.response.status_code == HTTP_401_UNAUTHORIZED and auth is not None and not replayed:
+                # most likely a token rolled over or revoked: a new one, then the very same request again
+                auth.invalidate(kwargs['headers'])
+                replayed = True
+                continue
+            try:
+                message = e.response.json().get('Error')
+            except (httpx.DecodingError, JSONDecodeError, AttributeError):
+                message = None
             logging.error(
-                f'[{caller}] - Error was returned by external API with code ({max_retries - tries + 2}/{max_retries}): {e.response.status_code}'
+                f'[{caller}] - Error was returned by external API with code ({attempt + 1}/{max_retries + 1}): {e.response.status_code}'
             )
-            exception = HTTPException(status_code = e.response.status_code, detail = message)
+            exception   = HTTPException(status_code = e.response.status_code, detail = message)
+            retryable   = retry_policy.is_retryable(method_name, e.response.status_code, idempotent)
+            retry_after = parse_retry_after( e.response.headers.get('Retry-After') )
+            if e.response.status_code == HTTP_429_TOO_MANY_REQUESTS:
+                limiter.pause(retry_after if retry_after is not None else retry_policy.base_delay)
+
+        if not retryable or attempt >= max_retries:
+            raise exception
 
-        tries -= 1
+        sleep_time = retry_policy.backoff(attempt, retry_after)
+        budget     = remaining_budget()
+        if budget is not None and sleep_time >= budget:
+            logging.error(f'[{caller}] - Not enough request budget left to retry ({budget:.2f}s < {sleep_time:.2f}s): {url}')
+            raise exception
+
+        UPSTREAM_RETRIES.inc(provider = caller, endpoint = endpoint)
+        await asyncio.sleep(sleep_time)
+        attempt += 1
+
+async def conditional_api_call(
+    http_client:  httpx.AsyncClient,
+    url:          HttpUrl,
+    method:       Callable[..., httpx.Response],
+    caller:       str,
+    cache_key:    str = None,
+    **kwargs
+) -> Tuple[Any, Optional[str]]:
+    # Revalidate the last response of the same call instead of downloading it again. Returns the parsed body along
+    # with its version (the upstream ETag, or Last-Modified), None when the upstream gives no validators.
+    # The last response is stored under `cache_key`, by default the url and its params (credentials left out).
+    cache_key  = cache_key or f'{url}:' + ':'.join(
+        f'{name}={value}' for name, value in (kwargs.get('params') or {}).items() if name not in UPSTREAM_CACHE_KEY_EXCLUDED
+    )
+    key        = f'upstream:{caller}:{cache_key}'
+    stored     = await cache.get(key)
+    stored     = stored.value if isinstance(stored, CacheEntry) else None
+    validators = dict(stored['validators']) if stored else {}
 
-        if tries > 0:
-            sleep_time = random.randint(1, 1000)
-            time.sleep((2 ** (max_retries - tries - 1) * 1000 + sleep_time) / 1000)
+    response = await async_ext_api_call(http_client, url, method, caller, validators = validators, **kwargs)
+    if response is NOT_MODIFIED:
+        logging.debug(f'[{caller}] - External API resource not modified: {url}')
+        return stored['response'], stored['version']
 
-    if tries == 0:
-        raise exception
+    version = validators.get('etag') or validators.get('last_modified')
+    if version:
+        await cache.set(key, CacheEntry({ 'validators': validators, 'version': version, 'response': response }), expire = UPSTREAM_CACHE_TTL)
+    return response, version
+
+async def fetch_pages(
+    fetch_page:  Callable[[int], Awaitable[List]],
+    pages:       Iterable[int],
+    concurrency: int
+) -> List:
+    # at most `concurrency` pages in flight, the next one starts as soon as any of them is done; results in page order
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_bounded(page: int) -> List:
+        async with semaphore:
+            return await fetch_page(page)
+
+    tasks = [ asyncio.ensure_future( fetch_bounded(page) ) for page in pages ]
+    try:
+        results = []
+        for task in tasks:
+            results += await task
+        return results
+    finally:
+        # a page failed (or the caller went away): the others are of no use anymore
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+def connection_pool_stats(http_client: httpx.AsyncClient) -> Dict[str, int]:
+    # httpx does not expose its pool, peek into the default httpcore transport when it is there
+    pool        = getattr( getattr(http_client, '_transport', None), '_pool', None )
+    connections = getattr(pool, 'connections', [ ])
+    idle        = sum( 1 for connection in connections if connection.is_idle() )
+    return {
+        'active': len(connections) - idle,
+        'idle':   idle,
+        'max':    getattr(pool, '_max_connections', 0) or 0
+    }
+
+async def open_connections(http_client: httpx.AsyncClient, url: str, count: int):
+    # TCP and TLS handshakes paid ahead of time: concurrent HEAD requests leave that many connections in the pool,
+    # whatever they answer (HTTP/2 origins share a single one anyway)
+    async def open_connection():
+        try:
+            await http_client.head(url)
+        except httpx.HTTPError as e:
+            logging.warning(f'[Warm-up] - Could not connect to {url}: {type(e).__name__}')
 
-    return response
\ No newline at end of file
+    await asyncio.gather(*[ open_connection() for _ in range(count) ])
@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import signal
+import logging
+import functools
+
+from typing              import List
+from socket              import socket
+from uvicorn             import Config, Server
+from uvicorn._subprocess import get_subprocess
+from libs.logging        import setup_logging
+
+
+# e.g. UVICORN_WORKERS=4, SIGHUP to the supervisor restarts them one by one without dropping the listening socket
+UVICORN_WORKERS        = int( os.environ.get('UVICORN_WORKERS', '1') )
+# how long a replacement worker gets to start before the one it replaces is stopped
+WORKERS_RESTART_DELAY  = float( os.environ.get('WORKERS_RESTART_DELAY', '5') )
+# how long a stopping worker gets to finish its in-flight requests
+WORKERS_STOP_TIMEOUT   = float( os.environ.get('WORKERS_STOP_TIMEOUT', '30') )
+WORKERS_CHECK_INTERVAL = 0.5
+# a worker exiting within WORKERS_RESPAWN_MIN_UPTIME seconds of its start crashed on startup (e.g. a bad setting):
+# it is replaced after WORKERS_RESPAWN_BACKOFF seconds, doubled on every further crash up to WORKERS_RESPAWN_MAX_BACKOFF,
+# and the supervisor gives up after WORKERS_RESPAWN_MAX_CRASHES of them in a row (0: never)
+WORKERS_RESPAWN_MIN_UPTIME  = float( os.environ.get('WORKERS_RESPAWN_MIN_UPTIME', '10') )
+WORKERS_RESPAWN_BACKOFF     = float( os.environ.get('WORKERS_RESPAWN_BACKOFF', '1') )
+WORKERS_RESPAWN_MAX_BACKOFF = float( os.environ.get('WORKERS_RESPAWN_MAX_BACKOFF', '60') )
+WORKERS_RESPAWN_MAX_CRASHES = int( os.environ.get('WORKERS_RESPAWN_MAX_CRASHES', '5') )
+
+
+def run_worker(config: Config, sockets: List[socket]):
+    # runs in every worker process: logging as in the single process mode, then the same server on the shared socket
+    setup_logging()
+    Server(config).run(sockets = sockets)
+
+
+class Supervisor:
+    # Keeps `workers` processes serving the app on a socket bound once, replacing those exiting unexpectedly.
+    # Every worker runs the app lifespan on its own: clients, connection pool and L1 cache are per process, the
+    # L2 cache (CACHE_L2_URL) is what they share, provider tokens included.
+    def __init__(self, config: Config, workers: int = UVICORN_WORKERS):
+        self.config      = config
+        self.workers     = workers
+        self.sockets     = []
+        self.processes   = []
+        self.should_exit = False
+        self.restarting  = False
+        self.failed      = False
+        # per worker slot: consecutive startup crashes, and when its replacement is due
+        self.crashes     = []
+        self.respawn_at  = []
+        self.started     = {}
+
+    def spawn(self):
+        process = get_subprocess(config = self.config, target = functools.partial(run_worker, self.config), sockets = self.sockets)
+        process.start()
+        self.started[process.pid] = time.monotonic()
+        logging.info(f'[Supervisor] - Started worker [{process.pid}]')
+        return process
+
+    def stop(self, process):
+        # SIGTERM: the worker stops accepting, finishes what is in flight and runs its lifespan shutdown
+        process.terminate()
+        process.join(WORKERS_STOP_TIMEOUT)
+        if process.is_alive():
+            logging.warning(f'[Supervisor] - Worker [{process.pid}] did not stop in {WORKERS_STOP_TIMEOUT}s, killing it')
+            process.kill()
+            process.join()
+        self.started.pop(process.pid, None)
+
+    def restart(self):
+        # rolling: a replacement first, then the old worker, so that there is always someone accepting
+        logging.info(f'[Supervisor] - Restarting {len(self.processes)} workers')
+        for index, process in enumerate( list(self.processes) ):
+            if self.should_exit:
+                break
+            self.processes[index]  = self.spawn()
+            self.respawn_at[index] = None
+            time.sleep(WORKERS_RESTART_DELAY)
+            self.stop(process)
+
+    def replace(self, index: int, process):
+        # a worker that ran for a while is replaced right away, one crashing on startup after a growing delay
+        now = time.monotonic()
+        if self.respawn_at[index] is None:
+            uptime = now - self.started.pop(process.pid, now)
+            if uptime >= WORKERS_RESPAWN_MIN_UPTIME:
+                self.crashes[index] = 0
+                delay               = 0
+            else:
+                self.crashes[index] += 1
+                if WORKERS_RESPAWN_MAX_CRASHES and self.crashes[index] >= WORKERS_RESPAWN_MAX_CRASHES:
+                    logging.error(
+                        f'[Supervisor] - Worker [{process.pid}] exited with {process.exitcode} on startup '
+                        f'{self.crashes[index]} times in a row, giving up'
+                    )
+                    self.failed      = True
+                    self.should_exit = True
+                    return
+                delay = min( WORKERS_RESPAWN_BACKOFF * 2 ** (self.crashes[index] - 1), WORKERS_RESPAWN_MAX_BACKOFF )
+            logging.warning(f'[Supervisor] - Worker [{process.pid}] exited with {process.exitcode} after {uptime:.1f}s, replacing it in {delay:g}s')
+            self.respawn_at[index] = now + delay
+        if now >= self.respawn_at[index]:
+            self.respawn_at[index] = None
+            self.processes[index]  = self.spawn()
+
+    def handle_exit(self, sig, frame):
+        self.should_exit = True
+
+    def handle_restart(self, sig, frame):
+        self.restarting = True
+
+    def run(self):
+        self.sockets = [ self.config.bind_socket() ]
+        logging.info(f'[Supervisor] - Starting {self.workers} workers, parent process [{os.getpid()}]')
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self.handle_exit)
+        signal.signal(signal.SIGHUP, self.handle_restart)
+
+        self.processes  = [ self.spawn() for _ in range(self.workers) ]
+        self.crashes    = [ 0 ] * self.workers
+        self.respawn_at = [ None ] * self.workers
+        while not self.should_exit:
+            if self.restarting:
+                self.restarting = False
+                self.restart()
+            for index, process in enumerate(self.processes):
+                if not process.is_alive() and not self.should_exit:
+                    self.replace(index, process)
+            time.sleep(WORKERS_CHECK_INTERVAL)
+
+        logging.info('[Supervisor] - Stopping workers')
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            self.stop(process)
+        for sock in self.sockets:
+            sock.close()
+        if self.failed:
+            sys.exit(1)
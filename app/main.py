@@ -1,22 +1,33 @@
 import os
 import time
 import httpx
-import uvicorn
+import asyncio
 import logging
-import warnings
 
-from uvicorn            import Config, Server
+from contextlib         import asynccontextmanager
+from cashews.ttl        import ttl_to_seconds
 from fastapi            import FastAPI, HTTPException, Depends
-from cashews            import Cache
+from libs.cache         import cache, refresher
 from libs.logging       import LOG_LEVEL, setup_logging
+from libs.retry         import start_request_budget
+from libs.metrics       import registry, REQUEST_LATENCY, Gauge
+from libs.utils         import connection_pool_stats, open_connections
+from libs.offload       import monitor_loop_lag, shutdown as shutdown_offload
+from libs.index         import title_index
+from libs.store         import store
 from libs.tvdb          import TVDBClient
 from libs.tmdb          import TMDBClient
-from routers            import search, details
+from libs.updates       import TVDBUpdatesWatcher
+from routers            import search, details, metrics, health
 from starlette.requests import Request
 from starlette.status   import HTTP_200_OK, \
                                HTTP_511_NETWORK_AUTHENTICATION_REQUIRED
 
 
+# the warm-up never holds readiness back for longer than this, whatever is still missing is done on first use
+WARMUP_TIMEOUT     = ttl_to_seconds( os.environ.get('WARMUP_TIMEOUT', '15s') )
+WARMUP_CONNECTIONS = int( os.environ.get('WARMUP_CONNECTIONS', '4') )
+
 clients = {}
 
 
@@ -30,44 +41,86 @@ async def verify_dependencies():
             detail      = '[TVDB] - Missing API authentication'
         )
 
-app = FastAPI(
-    title        = 'Project: Atlas - Backend API',
-    description  = 'API used mainly for Project: Atlas and tools',
-    version      = '0.0.1',
-    docs_url     = '/',
-    redoc_url    = None,
-    debug        = True,
-    dependencies = [ Depends(verify_dependencies) ]
-)
-
-
-@app.on_event('startup')
-async def instantiate_clients():
+async def warm_up():
+    # everything the first requests would otherwise wait for, at once
+    start_time = time.time()
+    tasks      = [
+        open_connections(clients['httpx'], clients['tvdb'].api_url, WARMUP_CONNECTIONS),
+        open_connections(clients['httpx'], clients['tmdb'].api_url, WARMUP_CONNECTIONS),
+        title_index.load(),
+        store.open()
+    ]
+    if os.environ.get('TVDB_USR_PIN') and os.environ.get('TVDB_API_KEY'):
+        tasks.append( clients['tvdb'].warm_up() )
+    if os.environ.get('TMDB_API_KEY'):
+        tasks.append( clients['tmdb'].warm_up() )
+
+    start_request_budget()
+    try:
+        results = await asyncio.wait_for( asyncio.gather(*tasks, return_exceptions = True), WARMUP_TIMEOUT )
+        for result in results:
+            if isinstance(result, Exception):
+                logging.warning(f'[PlexAPI] - Warm-up step failed, left to the first request: {result!r}')
+    except asyncio.TimeoutError:
+        logging.warning(f'[PlexAPI] - Warm-up still incomplete after {WARMUP_TIMEOUT}s, the rest is left to the first requests')
+    app.state.ready = True
+    logging.info('[PlexAPI] - Warm-up completed in: {:.2f}s'.format(time.time() - start_time))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready  = False
     logging.info('[PlexAPI] - Initializing client cache...')
-    clients['cache'] = Cache()
-    # clients['cache'].setup(
-    #     "redis://redis-10577.c55.eu-central-1-1.ec2.cloud.redislabs.com:10577/",
-    #     db     = 1,
-    #     wait_for_connection_timeout = 0.5,
-    #     safe   = False,
-    #     enable = True,
-    #     username = "project-atlas-editor",
-    #     password = "F&_!dT7V*Ws!YN*7q67vSHrDN5Zugy"
-    # )
-    clients['cache'].setup("mem://?check_interval=10&size=30720")
+    clients['cache'] = cache.setup()
     logging.info('[FastAPI] - Initializing HTTPX client...')
     clients['httpx'] = httpx.AsyncClient(
         limits    = httpx.Limits(max_connections = 50),
         timeout   = httpx.Timeout(60.0),
-        http2     = True,
-        transport = httpx.AsyncHTTPTransport(
-            retries = 1 # TODO: I nostri retry in async_ext_api_call() non tengono conto di questo
-        )
+        http2     = True
+        # no transport-level retries: async_ext_api_call() owns the whole retry policy
     )
     logging.info('[PlexAPI] - Initializing TVDB client...')
     clients['tvdb']  = TVDBClient(clients['httpx'])
     logging.info('[PlexAPI] - Initializing TMDB client...')
     clients['tmdb']  = TMDBClient(clients['httpx'])
+    clients['updates'] = TVDBUpdatesWatcher(clients['tvdb'])
+    if os.environ.get('TVDB_USR_PIN') and os.environ.get('TVDB_API_KEY'):
+        logging.info('[PlexAPI] - Watching TVDB updates feed...')
+        clients['updates'].start()
+    # requests are accepted right away, readiness waits for the warm-up
+    warm_up_task  = asyncio.ensure_future( warm_up() )
+    loop_lag_task = asyncio.ensure_future( monitor_loop_lag() )
+    index_task    = asyncio.ensure_future( title_index.keep_saved() )
+
+    yield
+
+    for task in [ warm_up_task, loop_lag_task, index_task ]:
+        task.cancel()
+    await asyncio.gather(warm_up_task, loop_lag_task, index_task, return_exceptions = True)
+    await title_index.save()
+    logging.info('[PlexAPI] - Stopping background cache refreshes...')
+    await refresher.stop()
+    await clients['updates'].stop()
+    logging.info('[FastAPI] - Closing HTTPX client...')
+    await clients['httpx'].aclose()
+    await clients['cache'].close()
+    shutdown_offload()
+    store.close()
+
+app = FastAPI(
+    title        = 'Project: Atlas - Backend API',
+    description  = 'API used mainly for Project: Atlas and tools',
+    version      = '0.0.1',
+    docs_url     = '/',
+    redoc_url    = None,
+    debug        = True,
+    lifespan     = lifespan
+)
+
+registry.register( Gauge(
+    'atlas_upstream_connections', 'Connections of the shared HTTPX pool by state (active, idle, max)', [ 'state' ],
+    collect = lambda: { (state,): value for state, value in connection_pool_stats(clients['httpx']).items() } if 'httpx' in clients else {}
+) )
+
 
 @app.middleware('http')
 async def add_global_vars(request: Request, call_next):
@@ -75,9 +128,17 @@ async def add_global_vars(request: Request, call_next):
     request.state.httpx = clients['httpx']
     request.state.tvdb  = clients['tvdb']
     request.state.tmdb  = clients['tmdb']
+    start_request_budget()
 
     start_time = time.time()
     response = await call_next(request)
+    route    = request.scope.get('route')
+    REQUEST_LATENCY.observe(
+        time.time() - start_time,
+        method = request.method,
+        route  = route.path if route else 'unmatched',
+        status = response.status_code
+    )
     logging.info( '[FastAPI] - The request was completed in: %ss', '{:.2f}'.format(time.time() - start_time) )
     # await request.state.httpx.aclose()
     return response
@@ -86,9 +147,10 @@ async def add_global_vars(request: Request, call_next):
 # import the /search branch of PlexAPI
 app.include_router(
     search.router,
-    prefix    = '/search',
-    tags      = ['search'],
-    responses = {
+    prefix       = '/search',
+    tags         = ['search'],
+    dependencies = [ Depends(verify_dependencies) ],
+    responses    = {
         HTTP_200_OK: {}
     }
 )
@@ -96,8 +158,29 @@ app.include_router(
 # import the /details branch of PlexAPI
 app.include_router(
     details.router,
-    prefix    = '/details',
-    tags      = ['details'],
+    prefix       = '/details',
+    tags         = ['details'],
+    dependencies = [ Depends(verify_dependencies) ],
+    responses    = {
+        HTTP_200_OK: {}
+    }
+)
+
+# import the /health branch of PlexAPI, probes never depend on provider credentials
+app.include_router(
+    health.router,
+    prefix    = '/health',
+    tags      = ['health'],
+    responses = {
+        HTTP_200_OK: {}
+    }
+)
+
+# import the /metrics branch of PlexAPI, available even without provider credentials
+app.include_router(
+    metrics.router,
+    prefix    = '/metrics',
+    tags      = ['metrics'],
     responses = {
         HTTP_200_OK: {}
     }
@@ -105,21 +188,25 @@ app.include_router(
 
 
 if __name__ == '__main__':
-    # WORKAROUND for https://github.com/scrapinghub/dateparser/issues/1013
-    warnings.filterwarnings(
-        "ignore",
-        message = "The localize method is no longer necessary, as this time zone supports the fold attribute",
-    )
+    from uvicorn      import Config, Server
+    from libs.workers import UVICORN_WORKERS, WORKERS_STOP_TIMEOUT, Supervisor
 
-    server = Server( Config(
+    config = Config(
         "main:app",
-        host      = os.environ.get('UVICORN_HOST', '0.0.0.0'),
-        port      = int( os.environ.get('UVICORN_PORT', '8080') ),
-        log_level = LOG_LEVEL,
-    ) )
+        host                      = os.environ.get('UVICORN_HOST', '0.0.0.0'),
+        port                      = int( os.environ.get('UVICORN_PORT', '8080') ),
+        log_level                 = LOG_LEVEL,
+        workers                   = UVICORN_WORKERS,
+        timeout_graceful_shutdown = WORKERS_STOP_TIMEOUT
+    )
 
     # setup logging last, to make sure no library overwrites it
     # (they shouldn't, but it happens)
     setup_logging()
 
-    server.run()
+    if UVICORN_WORKERS > 1:
+        if not os.environ.get('CACHE_L2_URL'):
+            logging.warning('[PlexAPI] - Multiple workers without CACHE_L2_URL: every worker caches, and logs in, on its own')
+        Supervisor(config, UVICORN_WORKERS).run()
+    else:
+        Server(config).run()
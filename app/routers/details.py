@@ -1,17 +1,47 @@
+import os
+import asyncio
 import logging
 
-from   fastapi             import APIRouter, Path, HTTPException, Query
-from   typing              import Dict
-from   libs.models         import Movie, Show, SupportedProviders, MediaType
+from   fastapi             import APIRouter, Body, Path, HTTPException, Query
+from   typing              import Dict, List, Union
+from   libs.models         import Movie, Show, SupportedProviders, MediaType, BatchDetailsItem
+from   libs.retry          import start_request_budget
+from   libs.ratelimit      import BACKGROUND, request_priority
+from   libs.responses      import cached_response, dumps, response_key, validate
+from   libs.store          import store
 from   starlette.requests  import Request
-from   starlette.status    import HTTP_501_NOT_IMPLEMENTED, \
+from   starlette.responses import StreamingResponse
+from   starlette.status    import HTTP_500_INTERNAL_SERVER_ERROR, \
+                                  HTTP_501_NOT_IMPLEMENTED, \
                                   HTTP_503_SERVICE_UNAVAILABLE, \
                                   HTTP_511_NETWORK_AUTHENTICATION_REQUIRED
 
 
+DETAILS_BATCH_MAX_ITEMS   = int( os.environ.get('DETAILS_BATCH_MAX_ITEMS', '500') )
+DETAILS_BATCH_CONCURRENCY = int( os.environ.get('DETAILS_BATCH_CONCURRENCY', '8') )
+
 router = APIRouter()
 
 
+async def get_details(request: Request, item: BatchDetailsItem) -> Union[Movie, Show]:
+    if   item.source == SupportedProviders.THE_TV_DB:
+        client = request.state.tvdb
+    elif item.source == SupportedProviders.THE_MOVIE_DB:
+        client = request.state.tmdb
+    else:
+        detail = '[PlexAPI] - Unsupported source selected.'
+        logging.error(detail)
+        raise HTTPException(status_code = HTTP_501_NOT_IMPLEMENTED, detail = detail)
+
+    # the local store first, the source only for what is missing there (or too old), stored on the way back
+    result = await store.read(item)
+    if result is not None:
+        return result
+    if item.type == MediaType.MOVIE:
+        return await store.fetch(item, lambda: client.get_movie(id = item.id))
+    return await store.fetch(item, lambda: client.get_show(id = item.id, with_episodes = item.with_episodes))
+
+
 @router.get(
     '/sources/{source}/type/movie/{id}',
     summary        = 'Obtain all the details for the requested movie',
@@ -35,14 +65,13 @@ async def get_movie_details(
 
     The search is performed in italian, with an automatic fallback to the english or native language if no results are found.
     """
-    if   source == SupportedProviders.THE_TV_DB:
-        return await request.state.tvdb.get_movie(id = id)
-    elif source == SupportedProviders.THE_MOVIE_DB:
-        return await request.state.tmdb.get_movie(id = id)
-    else:
-        detail = '[PlexAPI] - Unsupported source selected.'
-        logging.error(detail)
-        raise HTTPException(status_code = HTTP_501_NOT_IMPLEMENTED, detail = detail)
+    item = BatchDetailsItem(source = source, type = MediaType.MOVIE, id = id)
+    return await cached_response(
+        request        = request,
+        key            = response_key('details', **item.dict()),
+        response_model = Movie,
+        produce        = lambda: get_details(request, item)
+    )
 
 @router.get(
     '/sources/{source}/type/series/{id}',
@@ -72,11 +101,68 @@ async def get_show_details(
 
     The search is performed in italian, with an automatic fallback to the english or native language if no results are found.
     """
-    if   source == SupportedProviders.THE_TV_DB:
-        return await request.state.tvdb.get_show(id = id, with_episodes = with_episodes)
-    elif source == SupportedProviders.THE_MOVIE_DB:
-        return await request.state.tmdb.get_show(id = id, with_episodes = with_episodes)
-    else:
-        detail = '[PlexAPI] - Unsupported source selected.'
-        logging.error(detail)
-        raise HTTPException(status_code = HTTP_501_NOT_IMPLEMENTED, detail = detail)
+    item = BatchDetailsItem(source = source, type = MediaType.SERIES, id = id, with_episodes = with_episodes)
+    return await cached_response(
+        request        = request,
+        key            = response_key('details', **item.dict()),
+        response_model = Show,
+        produce        = lambda: get_details(request, item)
+    )
+
+@router.post(
+    '/batch',
+    summary        = 'Obtain all the details for many movies and shows at once',
+    response_class = StreamingResponse,
+    responses      = {
+        200: {
+            'content':     { 'application/x-ndjson': {} },
+            'description': 'One JSON object per line, in completion order'
+        }
+    }
+)
+async def get_batch_details(
+    request: Request,
+    items:   List[BatchDetailsItem] = Body(
+        default     = ...,
+        title       = 'Items',
+        description = 'The list of movies and shows to retrieve',
+        max_items   = DETAILS_BATCH_MAX_ITEMS
+    )
+):
+    """
+    Retrieve details for many movies and shows, possibly from different sources, in a single round trip.
+
+    Items are resolved concurrently and streamed back as NDJSON as soon as each of them completes,
+    every line carries the `index` of the requested item and either its `result` or its `error`.
+    """
+    semaphore = asyncio.Semaphore(DETAILS_BATCH_CONCURRENCY)
+
+    async def resolve(index: int, item: BatchDetailsItem) -> Dict:
+        # bulk work: single lookups made meanwhile get ahead of it at the provider rate limiters
+        request_priority.set(BACKGROUND)
+        line = { 'index': index } | item.dict()
+        async with semaphore:
+            # every item gets the budget of a standalone request, queueing time excluded
+            start_request_budget()
+            try:
+                result         = await get_details(request, item)
+                line['result'] = validate(type(result), result).dict()
+            except HTTPException as e:
+                line['error']  = { 'status_code': e.status_code, 'detail': e.detail }
+            except Exception as e:
+                logging.exception(f'[PlexAPI] - Unexpected error while resolving batch item {index}: {e}')
+                line['error']  = { 'status_code': HTTP_500_INTERNAL_SERVER_ERROR, 'detail': None }
+        return line
+
+    async def stream():
+        tasks = [ asyncio.ensure_future( resolve(index, item) ) for index, item in enumerate(items) ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                # encoded the same way as the single lookups
+                yield dumps(await task) + b'\n'
+        finally:
+            # the client went away: stop working for it
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type = 'application/x-ndjson')
@@ -0,0 +1,34 @@
+from   fastapi             import APIRouter
+from   starlette.requests  import Request
+from   starlette.responses import JSONResponse
+from   starlette.status    import HTTP_200_OK, \
+                                  HTTP_503_SERVICE_UNAVAILABLE
+
+
+router = APIRouter()
+
+
+@router.get(
+    '/live',
+    summary = 'Tell whether the service is up'
+)
+async def get_liveness():
+    """
+    Always successful as long as the process is able to serve requests.
+    """
+    return { 'status': 'alive' }
+
+@router.get(
+    '/ready',
+    summary   = 'Tell whether the service is ready to serve traffic',
+    responses = {
+        HTTP_503_SERVICE_UNAVAILABLE: { 'description': 'Still warming up' }
+    }
+)
+async def get_readiness(request: Request):
+    """
+    Successful once the warm-up is over: providers logged in, their configuration loaded and the connections opened.
+    """
+    if not request.app.state.ready:
+        return JSONResponse({ 'status': 'warming up' }, status_code = HTTP_503_SERVICE_UNAVAILABLE)
+    return JSONResponse({ 'status': 'ready' }, status_code = HTTP_200_OK)
@@ -0,0 +1,19 @@
+from   fastapi             import APIRouter
+from   libs.metrics        import registry
+from   starlette.responses import PlainTextResponse
+
+
+router = APIRouter()
+
+
+@router.get(
+    '',
+    summary        = 'Expose the service metrics in the Prometheus text format',
+    response_class = PlainTextResponse
+)
+async def get_metrics():
+    """
+    Request latency, upstream calls (latency, status codes, retries), cache and single-flight activity,
+    HTTPX connection pool usage.
+    """
+    return PlainTextResponse(registry.expose(), media_type = 'text/plain; version=0.0.4')
@@ -1,12 +1,21 @@
+import os
 import logging
 
 from   fastapi             import APIRouter, Path, Query, HTTPException
 from   typing              import Any, List, Dict
-from   libs.models         import SupportedProviders, MediaType, SearchResult, Show
+from   libs.models         import SupportedProviders, MediaType, SearchMode, SearchResult, Show
+from   libs.utils          import SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT
+from   libs.responses      import cached_response, response_key
+from   libs.index          import title_index
 from   starlette.requests  import Request
-from   starlette.status    import HTTP_501_NOT_IMPLEMENTED
+from   starlette.status    import HTTP_422_UNPROCESSABLE_ENTITY, HTTP_501_NOT_IMPLEMENTED
 
 
+# shortest query the providers are asked about, shorter ones (type-ahead) are only answered locally
+UPSTREAM_MIN_QUERY_LENGTH      = 3
+# in hybrid mode, local results enough to skip the providers (capped to the requested limit)
+TITLE_INDEX_HYBRID_MIN_RESULTS = int( os.environ.get('TITLE_INDEX_HYBRID_MIN_RESULTS', '5') )
+
 router = APIRouter()
 
 
@@ -26,24 +35,70 @@ async def search(
         default     = ...,
         title       = 'Search Query',
         description = 'The title of media you are searching for',
-        min_length  = 3
+        min_length  = 1
     ),
     type:    MediaType = Query(
         default     = None,
         title       = 'Media Type',
         description = 'The type of the media you are searching for'
+    ),
+    page:    int = Query(
+        default     = 1,
+        title       = 'Page',
+        description = 'The page of results to retrieve, for every media type',
+        ge          = 1
+    ),
+    limit:   int = Query(
+        default     = SEARCH_DEFAULT_LIMIT,
+        title       = 'Page Size',
+        description = 'The maximum number of results per page, for every media type',
+        ge          = 1,
+        le          = SEARCH_MAX_LIMIT
+    ),
+    mode:    SearchMode = Query(
+        default     = SearchMode.UPSTREAM,
+        title       = 'Search Mode',
+        description = 'Where to search: the providers (upstream), the titles seen so far (local) or the latter first (hybrid)'
     )
 ):
     """
     Search for the requested media in the selected source.
 
     The search is performed in italian, with an automatic fallback to the english or native language if no results are found.
+
+    Results are paginated with `page` and `limit`, deep pages may come back empty since the number of upstream pages
+    fetched for a single search is capped.
+
+    With `mode=local` only the titles already returned by the source are searched, by word prefix and similarity,
+    without going upstream: meant for autocomplete, queries of any length are accepted. With `mode=hybrid` the
+    local results are returned when they are enough, the source being searched otherwise. Upstream searches need
+    at least 3 characters.
     """
-    if   source == SupportedProviders.THE_TV_DB:
-        return await request.state.tvdb.do_search(query = query, type = type)
-    elif source == SupportedProviders.THE_MOVIE_DB:
-        return await request.state.tmdb.do_search(query = query, type = type)
-
-    detail = '[PlexAPI] - Function not yet implemented.'
-    logging.error(detail)
-    return HTTPException(status_code = HTTP_501_NOT_IMPLEMENTED, detail = detail)
\ No newline at end of file
+    if mode != SearchMode.UPSTREAM:
+        local = title_index.search(query, source, type = type, page = page, limit = limit)
+        found = min( len(local['movies']) if type != MediaType.SERIES else limit, len(local['series']) if type != MediaType.MOVIE else limit )
+        if mode == SearchMode.LOCAL or len(query) < UPSTREAM_MIN_QUERY_LENGTH or found >= min(limit, TITLE_INDEX_HYBRID_MIN_RESULTS):
+            return local
+
+    if len(query) < UPSTREAM_MIN_QUERY_LENGTH:
+        raise HTTPException(
+            status_code = HTTP_422_UNPROCESSABLE_ENTITY,
+            detail      = f'[PlexAPI] - Searching the source needs at least {UPSTREAM_MIN_QUERY_LENGTH} characters, use mode=local for shorter queries.'
+        )
+
+    async def do_search():
+        if   source == SupportedProviders.THE_TV_DB:
+            return await request.state.tvdb.do_search(query = query, type = type, page = page, limit = limit)
+        elif source == SupportedProviders.THE_MOVIE_DB:
+            return await request.state.tmdb.do_search(query = query, type = type, page = page, limit = limit)
+
+        detail = '[PlexAPI] - Function not yet implemented.'
+        logging.error(detail)
+        raise HTTPException(status_code = HTTP_501_NOT_IMPLEMENTED, detail = detail)
+
+    return await cached_response(
+        request        = request,
+        key            = response_key('search', source = source, query = query, type = type, page = page, limit = limit),
+        response_model = SearchResult,
+        produce        = do_search
+    )
\ No newline at end of file
@@ -0,0 +1,60 @@
+# Run from the app folder: python -m pytest tests
+import time
+import asyncio
+
+from libs.cache import CACHE_HOT_THRESHOLD, BackgroundRefresher, CacheEntry, cache, noself_cache, refresher
+
+
+class Client:
+    def __init__(self):
+        self.calls = 0
+
+    @noself_cache(ttl = '1h', soft_ttl = '10m')
+    async def get_title(self, id: int) -> str:
+        self.calls += 1
+        return f'title {id} v{self.calls}'
+
+KEY = f'{__name__}:Client.get_title:id=1'
+
+
+def test_stale_entry_served_then_refreshed_in_background():
+    async def scenario():
+        cache.setup()
+        client = Client()
+        assert await client.get_title(id = 1) == 'title 1 v1'
+        assert await client.get_title(id = 1) == 'title 1 v1' and client.calls == 1
+
+        # past its soft TTL: still served as is, while it is fetched again
+        await cache.set(KEY, CacheEntry('title 1 v1', created = time.time() - 15 * 60))
+        assert await client.get_title(id = 1) == 'title 1 v1'
+        await refresher.queue.join()
+        assert client.calls == 2
+        assert await client.get_title(id = 1) == 'title 1 v2'
+
+        await refresher.stop()
+        await cache.close()
+
+    asyncio.run(scenario())
+
+def test_hot_entries_refreshed_before_turning_stale():
+    async def scenario():
+        cache.setup()
+        refreshed = []
+        sweeping  = BackgroundRefresher(sweep_interval = 0.1)
+        for key, hits in [ ('hot', CACHE_HOT_THRESHOLD), ('cold', CACHE_HOT_THRESHOLD - 1) ]:
+            # fresh still, but not for as long as the next sweep
+            await cache.set(key, CacheEntry(key, created = time.time() - 9.85))
+            async def refresh(key = key):
+                refreshed.append(key)
+            for _ in range(hits):
+                sweeping.track(key, refresh, soft_ttl = 10)
+
+        sweeping.start()
+        await asyncio.sleep(0.15)
+        await sweeping.queue.join()
+        assert refreshed == [ 'hot' ]
+
+        await sweeping.stop()
+        await cache.close()
+
+    asyncio.run(scenario())
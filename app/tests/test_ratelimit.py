@@ -0,0 +1,84 @@
+# Run from the app folder: python -m pytest tests
+import time
+import httpx
+import pytest
+import asyncio
+
+from fastapi        import HTTPException
+from libs.ratelimit import BACKGROUND, INTERACTIVE, RATE_LIMIT_INTERACTIVE_WEIGHT, RateLimiter, limiters, request_priority
+from libs.retry     import start_request_budget
+from libs.utils     import async_ext_api_call
+
+
+async def acquire(limiter: RateLimiter, priority: str, granted: list):
+    request_priority.set(priority)
+    await limiter.acquire()
+    granted.append( (priority, time.monotonic()) )
+
+def empty(rate: float, burst: int = 1) -> RateLimiter:
+    limiter        = RateLimiter('TEST', rate = rate, burst = burst)
+    limiter.tokens = 0
+    return limiter
+
+
+def test_interactive_calls_go_first_without_starving_background_ones():
+    async def scenario():
+        limiter = empty(rate = 200)
+        granted = []
+        # the background work queued first
+        tasks   = [ acquire(limiter, BACKGROUND, granted) for _ in range(10) ] + [ acquire(limiter, INTERACTIVE, granted) for _ in range(10) ]
+        await asyncio.gather(*tasks)
+
+        order = [ priority for priority, _ in granted ]
+        cycle = [ INTERACTIVE ] * RATE_LIMIT_INTERACTIVE_WEIGHT + [ BACKGROUND ]
+        assert order[:2 * len(cycle)] == cycle * 2
+        assert order.count(BACKGROUND) == order.count(INTERACTIVE) == 10
+
+    asyncio.run(scenario())
+
+def test_cancelled_waiters_take_no_token():
+    async def scenario():
+        limiter   = empty(rate = 10)
+        granted   = []
+        abandoned = asyncio.ensure_future( acquire(limiter, INTERACTIVE, granted) )
+        waiting   = asyncio.ensure_future( acquire(limiter, INTERACTIVE, granted) )
+        await asyncio.sleep(0.01)
+        started   = time.monotonic()
+        abandoned.cancel()
+        await waiting
+        # the first token, 0.1s after the empty bucket, went to the one still waiting
+        assert len(granted) == 1 and granted[0][1] - started < 0.15
+
+    asyncio.run(scenario())
+
+def test_no_burst_right_after_a_pause():
+    async def scenario():
+        limiter = RateLimiter('TEST', rate = 50, burst = 5)
+        granted = []
+        started = time.monotonic()
+        limiter.pause(0.2)
+        await asyncio.gather(*[ acquire(limiter, INTERACTIVE, granted) for _ in range(3) ])
+
+        times = [ at - started for _, at in granted ]
+        # nobody during the pause, then one every 1/rate: the bucket did not fill up meanwhile
+        assert times[0] >= 0.2
+        assert times[-1] - times[0] >= 0.03
+
+    asyncio.run(scenario())
+
+def test_rate_limited_upstream_pauses_every_caller():
+    async def scenario():
+        limiter = limiters['PAUSED'] = RateLimiter('PAUSED', rate = 100, burst = 5)
+
+        def upstream(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(429, headers = { 'Retry-After': '2' })
+
+        start_request_budget()
+        async with httpx.AsyncClient(transport = httpx.MockTransport(upstream)) as http_client:
+            with pytest.raises(HTTPException) as error:
+                await async_ext_api_call(http_client, 'https://api.example.com/v4/search', httpx.AsyncClient.get, 'PAUSED', max_retries = 0)
+        assert error.value.status_code == 429
+        # the tokens left are gone too, for as long as the upstream asked
+        assert limiter.tokens <= 0 and limiter.paused_until - time.monotonic() > 1.5
+
+    asyncio.run(scenario())
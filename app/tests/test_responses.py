@@ -0,0 +1,78 @@
+# Run from the app folder: python -m pytest tests
+import re
+import time
+
+from fastapi            import FastAPI
+from fastapi.testclient import TestClient
+from pydantic           import BaseModel
+from libs.cache         import CacheEntry, cache, noself_cache, refresher
+from libs.responses     import cached_response, response_key
+from starlette.requests import Request
+
+
+class Title(BaseModel):
+    id:    int
+    title: str
+
+class Provider:
+    @noself_cache(ttl = '1h', soft_ttl = '10m')
+    async def get_title(self, id: int) -> Title:
+        return Title(id = id, title = f'title {id}')
+
+def provider_key(id: int) -> str:
+    return f'{__name__}:Provider.get_title:id={id}'
+
+
+def make_app() -> FastAPI:
+    app      = FastAPI()
+    provider = Provider()
+
+    @app.middleware('http')
+    async def add_cache(request: Request, call_next):
+        request.state.cache = cache
+        return await call_next(request)
+
+    @app.get('/titles/{id}')
+    async def get_title(request: Request, id: int):
+        return await cached_response(request, response_key('titles', id = id), Title, lambda: provider.get_title(id = id))
+
+    return app
+
+def max_age(response) -> int:
+    return int( re.search(r'max-age=(\d+)', response.headers['Cache-Control'])[1] )
+
+
+def test_not_modified_on_a_matching_etag():
+    cache.setup()
+    with TestClient(make_app()) as client:
+        response = client.get('/titles/1')
+        assert response.status_code == 200 and response.json() == { 'id': 1, 'title': 'title 1' }
+        etag     = response.headers['ETag']
+
+        revalidated = client.get('/titles/1', headers = { 'If-None-Match': f'W/{etag}, "another"' })
+        assert revalidated.status_code == 304 and revalidated.content == b''
+        assert revalidated.headers['ETag'] == etag
+
+        assert client.get('/titles/1', headers = { 'If-None-Match': '"another"' }).status_code == 200
+        client.portal.call(cache.close)
+
+def test_age_and_max_age_follow_the_provider_data():
+    cache.setup()
+    with TestClient(make_app()) as client:
+        # fresh data: fresh for the whole provider soft TTL
+        response = client.get('/titles/1')
+        assert int(response.headers['Age']) == 0 and max_age(response) == 600
+
+        # data cached 5 minutes ago: the body is as old, and fresh for the other 5
+        client.portal.call(cache.set, provider_key(2), CacheEntry(Title(id = 2, title = 'title 2'), created = time.time() - 300))
+        response = client.get('/titles/2')
+        assert 300 <= int(response.headers['Age']) <= 301 and max_age(response) == 600
+        assert 'Warning' not in response.headers
+
+        # data past its soft TTL: served, flagged as stale
+        client.portal.call(cache.set, provider_key(3), CacheEntry(Title(id = 3, title = 'title 3'), created = time.time() - 900))
+        response = client.get('/titles/3')
+        assert int(response.headers['Age']) >= 900 and response.headers['Warning'] == '110 - "Response is Stale"'
+        # its refresh was scheduled meanwhile, not to outlive this event loop
+        client.portal.call(refresher.stop)
+        client.portal.call(cache.close)
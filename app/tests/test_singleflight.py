@@ -0,0 +1,54 @@
+# Run from the app folder: python -m pytest tests
+import gc
+import asyncio
+
+from libs.ratelimit    import BACKGROUND, INTERACTIVE, request_priority
+from libs.retry        import remaining_budget, start_request_budget
+from libs.singleflight import SingleFlight
+
+
+def test_shared_call_gets_the_most_generous_budget_and_priority():
+    async def scenario():
+        flight = SingleFlight('generous')
+        seen   = {}
+
+        async def lookup():
+            await asyncio.sleep(0.1)
+            seen['budget'], seen['priority'] = remaining_budget(), request_priority.get()
+            return 'result'
+
+        async def batch_item():
+            # nearly out of budget, bulk work
+            request_priority.set(BACKGROUND)
+            start_request_budget(0.05)
+            return await flight.do('key', lookup)
+
+        async def single_lookup():
+            await asyncio.sleep(0.01)
+            start_request_budget(30)
+            return await flight.do('key', lookup)
+
+        assert await asyncio.gather(batch_item(), single_lookup()) == [ 'result', 'result' ]
+        assert seen['budget'] > 29 and seen['priority'] == INTERACTIVE
+        assert flight.stats()['collapsed'] == 1
+
+    asyncio.run(scenario())
+
+def test_shared_call_failure_retrieved_when_every_waiter_is_gone():
+    async def scenario():
+        flight     = SingleFlight('abandoned')
+        unobserved = []
+        asyncio.get_running_loop().set_exception_handler( lambda loop, context: unobserved.append(context) )
+
+        async def lookup():
+            await asyncio.sleep(0.05)
+            raise RuntimeError('upstream went away')
+
+        waiter = asyncio.ensure_future( flight.do('key', lookup) )
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0.1)
+        gc.collect()
+        assert not flight.in_flight and not unobserved
+
+    asyncio.run(scenario())
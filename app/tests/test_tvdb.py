@@ -0,0 +1,65 @@
+# Run from the app folder: python -m pytest tests
+import httpx
+import asyncio
+
+from libs        import tvdb
+from libs.cache  import cache
+from libs.models import SeasonType
+from libs.tvdb   import TVDBClient
+
+
+def episode(id: int, name: str = None, overview: str = None, names: list = None, overviews: list = None) -> dict:
+    return {
+        'id': id, 'seriesId': 1, 'seasonNumber': 1, 'number': id - 100, 'name': name, 'overview': overview,
+        'image': None, 'aired': None, 'runtime': 24, 'nameTranslations': names, 'overviewTranslations': overviews
+    }
+
+def episodes_page(*episodes: dict) -> dict:
+    return { 'data': { 'series': { 'slug': 'a-show' }, 'episodes': list(episodes) }, 'links': { 'total_items': len(episodes), 'page_size': 500 } }
+
+SERIES = { 'data': {
+    'id': 1, 'slug': 'a-show', 'name': 'Ein Show', 'image': None, 'firstAired': None, 'status': { 'id': 1 }, 'originalLanguage': 'jpn',
+    'translations': { 'nameTranslations': [], 'overviewTranslations': [] },
+    'seasons': [ { 'id': 10, 'type': { 'type': 'official' }, 'number': 1, 'image': None } ]
+} }
+# every language lists the episodes in its own order: only their ids tell which is which
+SWEEPS = {
+    'official': episodes_page(
+        episode(102, 'Nihongo 2', None,        [ 'jpn', 'eng' ],        [ 'eng' ]),
+        episode(101, 'Nihongo 1', 'Arasuji 1', [ 'jpn', 'ita', 'eng' ], [ 'jpn', 'eng' ]),
+        episode(103, 'Nihongo 3', 'Arasuji 3', [ 'jpn' ],               [ 'jpn' ])
+    ),
+    'official/ita': episodes_page(
+        episode(101, 'Titolo 1')
+    ),
+    'official/eng': episodes_page(
+        episode(101, 'Title 1', 'Overview 1'),
+        episode(102, 'Title 2', 'Overview 2')
+    )
+}
+
+def upstream(request: httpx.Request) -> httpx.Response:
+    path = request.url.path.removeprefix('/v4')
+    if path == '/login':
+        return httpx.Response(200, json = { 'data': { 'token': 'token' } })
+    if path == '/series/1/extended':
+        return httpx.Response(200, json = SERIES)
+    return httpx.Response(200, json = SWEEPS[ path.removeprefix('/series/1/episodes/') ])
+
+
+def test_episode_translations_overlaid_by_guid(monkeypatch):
+    monkeypatch.setattr(tvdb, 'TVDB_LANGUAGES', [ 'ita', 'eng' ])
+
+    async def scenario():
+        cache.setup()
+        async with httpx.AsyncClient(transport = httpx.MockTransport(upstream)) as http_client:
+            show = await TVDBClient(http_client).get_show(id = 1, season_type = SeasonType.OFFICIAL, with_episodes = True)
+        episodes = { episode.source_id: episode for episode in show.seasons[0].episodes }
+        # the preferred language first, the next one for what it lacks, the original one when no other has it
+        assert (episodes[101].title, episodes[101].overview) == ('Titolo 1', 'Overview 1')
+        assert (episodes[102].title, episodes[102].overview) == ('Title 2',  'Overview 2')
+        assert (episodes[103].title, episodes[103].overview) == ('Nihongo 3', 'Arasuji 3')
+        assert [ episode.number for episode in show.seasons[0].episodes ] == [ 1, 2, 3 ]
+        await cache.close()
+
+    asyncio.run(scenario())
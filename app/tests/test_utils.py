@@ -0,0 +1,148 @@
+# Run from the app folder: python -m pytest tests
+import time
+import httpx
+import pytest
+import asyncio
+
+from fastapi        import HTTPException
+from libs.auth      import TokenManager
+from libs.cache     import cache
+from libs.breaker   import HALF_OPEN, CLOSED, get_breaker
+from libs.ratelimit import RateLimiter, limiters
+from libs.retry     import RetryPolicy, start_request_budget
+from libs.utils     import async_ext_api_call, conditional_api_call
+
+
+URL = 'https://api.example.com/v4/series/1/extended'
+
+def healthy(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json = { 'data': { 'id': 1 } })
+
+async def call(caller: str, handler = healthy, max_retries: int = 0, **kwargs):
+    async with httpx.AsyncClient(transport = httpx.MockTransport(handler)) as http_client:
+        return await async_ext_api_call(http_client, URL, httpx.AsyncClient.get, caller, max_retries = max_retries, **kwargs)
+
+def failing(status_code: int, headers: dict = None, then = None):
+    # `status_code` on every call, or only on the first one when `then` takes over
+    calls = []
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(time.monotonic())
+        if then is not None and len(calls) > 1:
+            return then(request)
+        return httpx.Response(status_code, headers = headers)
+    handler.calls = calls
+    return handler
+
+class SteadyRetryPolicy(RetryPolicy):
+    # no jitter, for the attempts to be counted
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        return max(0.1, retry_after or 0)
+
+def half_open(caller: str):
+    breaker = get_breaker(caller, httpx.URL(URL).path)
+    breaker.transition(HALF_OPEN)
+    return breaker
+
+
+def test_retries_stop_at_the_request_budget():
+    async def scenario():
+        upstream = failing(503)
+        start_request_budget(0.35)
+        with pytest.raises(HTTPException) as error:
+            await call('RETRIED', upstream, max_retries = 10, retry_policy = SteadyRetryPolicy())
+        # attempts at 0, 0.1, 0.2 and 0.3s: the next one would be past the budget, the upstream error is returned
+        assert error.value.status_code == 503
+        assert len(upstream.calls) == 4
+
+    asyncio.run(scenario())
+
+def test_retry_after_is_waited_for():
+    async def scenario():
+        upstream = failing(503, { 'Retry-After': '1' }, then = healthy)
+        start_request_budget(5)
+        assert await call('RETRY_AFTER', upstream, max_retries = 3, retry_policy = SteadyRetryPolicy()) == { 'data': { 'id': 1 } }
+        assert upstream.calls[1] - upstream.calls[0] >= 1
+
+    asyncio.run(scenario())
+
+def test_retry_after_past_the_request_budget_is_not_waited_for():
+    async def scenario():
+        upstream = failing(503, { 'Retry-After': '30' }, then = healthy)
+        start_request_budget(2)
+        started  = time.monotonic()
+        with pytest.raises(HTTPException) as error:
+            await call('RETRY_AFTER_LONG', upstream, max_retries = 3)
+        assert error.value.status_code == 503
+        assert len(upstream.calls) == 1 and time.monotonic() - started < 1
+
+    asyncio.run(scenario())
+
+def test_half_open_probe_returned_when_the_rate_limiter_times_out():
+    async def scenario():
+        breaker          = half_open('LIMITED')
+        limiter          = limiters['LIMITED'] = RateLimiter('LIMITED', rate = 1, burst = 1)
+        limiter.tokens   = 0
+        limiter.updated += 60   # no refill for a while
+
+        start_request_budget(0.05)
+        with pytest.raises(HTTPException) as error:
+            await call('LIMITED')
+        assert error.value.status_code == 504
+        assert (breaker.state, breaker.probes) == (HALF_OPEN, 0)
+
+        # the upstream is healthy: the next call is the probe, and closes the circuit
+        limiters['LIMITED'] = RateLimiter('LIMITED', rate = 0, burst = 1)
+        start_request_budget()
+        assert await call('LIMITED') == { 'data': { 'id': 1 } }
+        assert breaker.state == CLOSED
+
+    asyncio.run(scenario())
+
+def test_half_open_probe_returned_when_the_login_fails():
+    async def scenario():
+        cache.setup()
+        breaker = half_open('AUTHED')
+
+        async def failing_login() -> str:
+            raise HTTPException(status_code = 503)
+
+        start_request_budget()
+        with pytest.raises(HTTPException) as error:
+            await call('AUTHED', auth = TokenManager('FAILING', login = failing_login))
+        assert error.value.status_code == 503
+        assert (breaker.state, breaker.probes) == (HALF_OPEN, 0)
+
+        async def login() -> str:
+            return 'token'
+
+        assert await call('AUTHED', auth = TokenManager('WORKING', login = login)) == { 'data': { 'id': 1 } }
+        assert breaker.state == CLOSED
+        await cache.close()
+
+    asyncio.run(scenario())
+
+def test_revalidation_survives_a_rotated_api_key():
+    async def scenario():
+        cache.setup()
+
+        statuses = []
+
+        def upstream(request: httpx.Request) -> httpx.Response:
+            statuses.append(304 if request.headers.get('If-None-Match') == '"v1"' else 200)
+            if statuses[-1] == 304:
+                return httpx.Response(304)
+            return httpx.Response(200, json = { 'data': { 'id': 1 } }, headers = { 'ETag': '"v1"' })
+
+        async with httpx.AsyncClient(transport = httpx.MockTransport(upstream)) as http_client:
+            for api_key in [ 'secret-1', 'secret-2' ]:
+                start_request_budget()
+                response, version = await conditional_api_call(
+                    http_client, URL, httpx.AsyncClient.get, 'KEYED', params = { 'api_key': api_key, 'language': 'en' }
+                )
+                assert (response, version) == ({ 'data': { 'id': 1 } }, '"v1"')
+        # the new key revalidates what the old one downloaded
+        assert statuses == [ 200, 304 ]
+        assert not [ key async for key in cache.l1.scan('upstream:KEYED:*') if 'secret' in key ]
+        await cache.close()
+
+    asyncio.run(scenario())